@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+#
+# bench_qel.py
+#
+# Benchmarks parsing and rendering of QEL files, using synthetic
+# collections produced by qelcorpus.py.  For each operation the best
+# time out of several runs is reported as quotations per second, along
+# with the peak memory allocated while performing it.  The memory still
+# held by a parsed collection is also reported.  Results can be saved
+# as JSON and compared against an earlier run.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import sys, os, io, re, time, json, getopt, platform, tempfile, tracemalloc
+
+# Allow running from a source checkout without installing qel.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from qel import jsonl, parse, quotation
+import qelcorpus
+
+__doc__ = """Usage: %s [options] [file1 file2 ...]
+Benchmark parsing and rendering of QEL files.  If no files are given,
+synthetic collections are generated with qelcorpus.py.
+Options:
+    -n N,N,...              Sizes of the generated collections
+                            (default 1000,10000)
+    -s N, --seed=N          Random seed for the generated collections
+    -m F, --markup=F        Markup density of the generated collections
+    -r N, --repeat=N        Number of times each benchmark is run (default 3)
+    -b NAME, --backend=NAME Parser backend to use (default sax)
+    -o FILE, --output=FILE  Save the results as JSON in FILE
+    -c FILE, --compare=FILE Compare the results with an earlier JSON file
+""" % sys.argv[0]
+
+RENDERERS = ['as_text', 'as_rst', 'as_wiki', 'as_fortune', 'as_html', 'as_xml']
+
+_split_ws = re.compile(r'(\s+)')
+
+def fragment (paragraph):
+    """Return a copy of 'paragraph' broken into small Text pieces
+    surrounded by whitespace, as the parser sees it before simplify()
+    is called.
+    """
+    L = [quotation.Text('\n      ')]
+    for t in paragraph:
+        if type(t) is quotation.Text:
+            L.extend(quotation.Text(s) for s in _split_ws.split(t.text) if s)
+        else:
+            L.append(t)
+    L.append(quotation.Text('\n    '))
+    return L
+
+def measure (func, repeat):
+    """Call 'func' 'repeat' times, returning the best time in seconds
+    and the peak memory allocated during one more call.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def retained (path, backend):
+    "Return the number of bytes of memory held by the parsed file 'path'."
+    tracemalloc.start()
+    try:
+        coll = parse.parse(path, backend)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del coll
+    return current
+
+def bench_file (path, repeat, backend):
+    "Run all the benchmarks on the QEL file 'path', returning a dict."
+    results = {}
+    coll = parse.parse(path, backend)
+    count = len(coll)
+
+    def record (name, n, func):
+        seconds, peak = measure(func, repeat)
+        results[name] = {'seconds': seconds,
+                         'items': n,
+                         'items_per_sec': n / seconds if seconds else None,
+                         'peak_bytes': peak}
+        print('  %-12s %10.0f/s %9.1f MB' % (name, n / seconds if seconds
+                                              else float('inf'),
+                                              peak / 2.0**20))
+        sys.stdout.flush()
+
+    record('parse', count, lambda: parse.parse(path, backend))
+
+    stream = io.StringIO()
+    coll.write_jsonl(stream)
+    data = stream.getvalue().encode('utf-8')
+    record('load_jsonl', count, lambda: jsonl.load(io.BytesIO(data)))
+
+    paragraphs = [p for qt in coll for p in qt.text]
+    def run_simplify ():
+        # Fragmenting the paragraphs is a small part of the total.
+        for p in paragraphs:
+            parse.simplify(fragment(p))
+    record('simplify', len(paragraphs), run_simplify)
+
+    for method in RENDERERS:
+        def run_render (method=method):
+            for qt in coll:
+                getattr(qt, method)()
+        record(method, count, run_render)
+
+    del coll, paragraphs, data
+    retained_bytes = retained(path, backend)
+    print('  %-12s %9.1f MB %8.0f bytes/quotation'
+          % ('retained', retained_bytes / 2.0**20,
+             retained_bytes / max(count, 1)))
+
+    return {'quotations': count, 'size': os.path.getsize(path),
+            'retained_bytes': retained_bytes, 'results': results}
+
+def compare (old, new):
+    "Print the ratio of each new rate to the corresponding old one."
+    print('\nComparison with the earlier run (new/old, > 1 is faster):')
+    for name, run in sorted(new['runs'].items()):
+        old_run = old['runs'].get(name)
+        if old_run is None:
+            continue
+        print(' ', name)
+        for op, result in run['results'].items():
+            old_result = old_run['results'].get(op)
+            if not old_result or not old_result['items_per_sec']:
+                continue
+            print('  %-12s %6.2fx speed %6.2fx memory'
+                  % (op, result['items_per_sec'] / old_result['items_per_sec'],
+                     result['peak_bytes'] / max(old_result['peak_bytes'], 1)))
+        if 'retained_bytes' in old_run:
+            print('  %-12s %6.2fx memory'
+                  % ('retained', run['retained_bytes'] /
+                     max(old_run['retained_bytes'], 1)))
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'hn:s:m:r:b:o:c:',
+                               ['help', 'seed=', 'markup=', 'repeat=',
+                                'backend=', 'output=', 'compare='])
+    sizes = [1000, 10000]
+    seed, markup, repeat, backend = 0, 0.1, 3, 'sax'
+    output = compare_file = None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print(__doc__, file=sys.stderr)
+            sys.exit(0)
+        elif opt == '-n':
+            sizes = [int(n) for n in arg.split(',')]
+        elif opt in ('-s', '--seed'):
+            seed = int(arg)
+        elif opt in ('-m', '--markup'):
+            markup = float(arg)
+        elif opt in ('-r', '--repeat'):
+            repeat = int(arg)
+        elif opt in ('-b', '--backend'):
+            backend = arg
+        elif opt in ('-o', '--output'):
+            output = arg
+        elif opt in ('-c', '--compare'):
+            compare_file = arg
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'backend': backend, 'repeat': repeat,
+              'seed': seed, 'markup': markup,
+              'runs': {}}
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        files = [(os.path.basename(path), path) for path in args]
+        for n in sizes if not args else []:
+            path = os.path.join(tempdir, 'corpus-%d.xml' % n)
+            qelcorpus.write_corpus(path, n, seed, markup)
+            files.append(('synthetic-%d' % n, path))
+
+        for name, path in files:
+            print(name)
+            report['runs'][name] = bench_file(path, repeat, backend)
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if compare_file is not None:
+        with open(compare_file, 'r') as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
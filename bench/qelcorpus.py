@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# qelcorpus.py
+#
+# Generates synthetic QEL collections for benchmarking.  The output is
+# determined entirely by the parameters and the random seed, so two runs
+# with the same arguments produce identical files.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import sys, random, getopt
+
+__doc__ = """Usage: %s [options]
+Write a synthetic QEL file containing randomly generated quotations.
+Options:
+    -n N, --count=N         Number of quotations to generate (default 1000)
+    -s N, --seed=N          Random seed (default 0)
+    -m F, --markup=F        Probability of a word being marked up (default 0.1)
+    --notes=F               Fraction of quotations with a note (default 0.1)
+    --attribution=F         Fraction of quotations with an author and
+                            source (default 0.7)
+    -o FILE, --output=FILE  Write to FILE instead of standard output
+""" % sys.argv[0]
+
+_WORDS = """the of and to in is that it was for on are as with his they
+at be this from have or by one had not but what all were when we there
+can an your which their said if do will each about how up out them then
+she many some so these would other into has more her two like him see
+time could no make than first been its who now people my made over did
+down only way find use may water long little very after words called
+just where most know quotation universe entropy language machine garden
+river mountain library theorem paradox silence teacher memory window
+""".split()
+
+_ENTITIES = ['&amp;', '&lt;', '&gt;', '&#233;', '&#x2014;']
+
+# Inline elements that may contain other markup, and those that can't
+_NESTING_TAGS = ['em', 'cite', 'q', 'foreign']
+_FLAT_TAGS = ['abbr', 'acronym', 'code']
+
+_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<quotations xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+            xmlns="http://www.amk.ca/qel/">
+
+  <title>Synthetic QEL collection</title>
+  <editor>qelcorpus.py</editor>
+  <description>
+    %d randomly generated quotations (seed %d, markup density %g).
+  </description>
+  <copyright>
+    Placed in the public domain.
+  </copyright>
+  <license><p>Use for benchmarking only.</p></license>
+
+"""
+
+_FOOTER = "</quotations>\n"
+
+
+class CorpusGenerator:
+    """Generates random quotations as QEL markup.
+
+    'markup' is the probability that each word starts an inline
+    element, which may itself contain nested elements; it also scales
+    the frequency of <br/> and <pre> elements.  'notes' and
+    'attribution' are the fractions of quotations that get a <note>
+    and <author>/<source> elements, respectively.
+    """
+
+    def __init__ (self, seed=0, markup=0.1, notes=0.1, attribution=0.7):
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.markup = markup
+        self.notes = notes
+        self.attribution = attribution
+
+    def words (self, count):
+        choice = self.random.choice
+        return ' '.join(choice(_WORDS) for i in range(count))
+
+    def inline (self, length, depth=0):
+        "Return a run of mixed text and inline markup."
+        rand = self.random.random
+        parts = []
+        i = 0
+        while i < length:
+            r = rand()
+            if r < self.markup:
+                n = self.random.randint(1, 4)
+                if depth < 2 and rand() < 0.3:
+                    tag = self.random.choice(_NESTING_TAGS)
+                    body = self.inline(n, depth + 1)
+                else:
+                    tag = self.random.choice(_NESTING_TAGS + _FLAT_TAGS)
+                    body = self.words(n)
+                parts.append('<%s>%s</%s>' % (tag, body, tag))
+                i += n
+            elif r < self.markup * 1.15:
+                parts.append('<br/>')
+            elif r < self.markup * 1.25:
+                parts.append(self.random.choice(_ENTITIES))
+            else:
+                parts.append(self.random.choice(_WORDS))
+                i += 1
+            # Line breaks and indentation, as in hand-edited files
+            parts.append('\n      ' if rand() < 0.1 else ' ')
+        return ''.join(parts).rstrip()
+
+    def paragraph (self):
+        if self.random.random() < self.markup * 0.2:
+            lines = [self.words(self.random.randint(2, 6))
+                     for i in range(self.random.randint(2, 5))]
+            return '<p>\n<pre>\n%s\n</pre>\n</p>' % '\n    '.join(lines)
+        return '<p>\n      %s\n    </p>' % self.inline(
+            self.random.randint(8, 60))
+
+    def quotation (self, index):
+        rand = self.random.random
+        attrs = ' id="q%d"' % index
+        if rand() < 0.5:
+            attrs += ' date="%04d-%02d-%02d"' % (self.random.randint(1900, 2020),
+                                                 self.random.randint(1, 12),
+                                                 self.random.randint(1, 28))
+        if rand() < 0.3:
+            attrs += ' type="%s"' % ', '.join(
+                self.random.sample(['funny', 'science', 'history', 'tv'],
+                                   self.random.randint(1, 2)))
+
+        parts = ['<quotation%s>' % attrs]
+        for i in range(self.random.choice([1, 1, 1, 2, 3])):
+            parts.append('    ' + self.paragraph())
+        if rand() < self.attribution:
+            parts.append('    <author rdf:resource="http://example.com/a%d"'
+                         ' type="person">%s</author>'
+                         % (index, self.words(2).title()))
+            parts.append('    <source type="book">%s <cite>%s</cite></source>'
+                         % (self.words(2), self.words(3).title()))
+        if rand() < self.notes:
+            parts.append('    <note>\n    %s\n    </note>' % self.paragraph())
+        parts.append('</quotation>\n\n')
+        return '\n'.join(parts)
+
+    def write (self, output, count):
+        "Write a complete QEL document with 'count' quotations to 'output'."
+        output.write(_HEADER % (count, self.seed, self.markup))
+        for i in range(count):
+            output.write(self.quotation(i))
+        output.write(_FOOTER)
+
+
+def write_corpus (path, count, seed=0, markup=0.1, notes=0.1,
+                  attribution=0.7):
+    "Write a synthetic QEL file with 'count' quotations to 'path'."
+    gen = CorpusGenerator(seed, markup, notes, attribution)
+    with open(path, 'w', encoding='utf-8') as output:
+        gen.write(output, count)
+
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], 'hn:s:m:o:',
+                               ['help', 'count=', 'seed=', 'markup=',
+                                'notes=', 'attribution=', 'output='])
+    count, seed, output = 1000, 0, None
+    kw = {}
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print(__doc__, file=sys.stderr)
+            sys.exit(0)
+        elif opt in ('-n', '--count'):
+            count = int(arg)
+        elif opt in ('-s', '--seed'):
+            seed = int(arg)
+        elif opt in ('-m', '--markup'):
+            kw['markup'] = float(arg)
+        elif opt == '--notes':
+            kw['notes'] = float(arg)
+        elif opt == '--attribution':
+            kw['attribution'] = float(arg)
+        elif opt in ('-o', '--output'):
+            output = arg
+
+    if output is None:
+        CorpusGenerator(seed, **kw).write(sys.stdout, count)
+    else:
+        write_corpus(output, count, seed, **kw)
+
+if __name__ == '__main__':
+    main()
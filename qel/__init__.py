@@ -21,10 +21,19 @@ qel -- A package for parsing and manipulating collections of quotations
        in Quotation Exchange Language (QEL) format.
 
 Modules contained in the qel package:
-    database -- Storing and indexing QEL files for fast access.
+    aio -- Parsing and rendering QEL from asyncio code.
+    cache -- Caching parsed QEL files on disk.
+    incremental -- Re-parsing only the changed parts of an edited QEL file.
+    index -- A full-text index for searching large QEL files.
+    jsonl -- Reading and writing collections in JSON Lines format.
+    opcodes -- A compact, flat form of paragraphs that's fast to render.
     parse -- Parsing a QEL file into a series of Quotation instances.
+    qelfile -- Random access to the quotations in a QEL file.
     quotations -- Contains the Quotation class, representing a single
                   quotation's contents, and other associated classes.
+    search -- Skipping quotations that can't match before parsing them.
+    strfile -- Writing fortune(6) files along with their strfile indexes.
+    wrap -- Fast word wrapping, equivalent to the textwrap module.
 
 Constants:
 QEL_HEADER -- The XML header to be written at the start of a QEL file.
@@ -0,0 +1,100 @@
+"""
+qel.aio -- Parsing and rendering QEL without blocking an asyncio event loop.
+
+The functions in this module are coroutines or asynchronous generators
+that do a small amount of work at a time and then give the event loop
+a chance to run other tasks:
+
+    async for item in aiterparse(request.content):
+        ...
+
+As with qel.parse.iterparse(), the first item produced is a Collection
+holding the header fields, followed by each Quotation in turn.
+"""
+
+import asyncio
+
+from qel import QEL_FOOTER
+from qel import parse
+
+__all__ = ['aiterparse', 'aparse', 'arender', 'arender_xml']
+
+async def _chunks (input, bufsize):
+    """Produce the data from 'input', which is either an object with
+    a read() coroutine (such as an asyncio.StreamReader) or an
+    asynchronous iterable of bytes or str.
+    """
+    if hasattr(input, 'read'):
+        while 1:
+            data = await input.read(bufsize)
+            if not data:
+                break
+            yield data
+    else:
+        async for data in input:
+            # Large chunks are split up so the parser never holds
+            # the event loop for long.
+            for i in range(0, len(data), bufsize):
+                yield data[i:i+bufsize]
+
+async def aiterparse (input, bufsize=2**16):
+    """Parse the QEL document read from 'input', asynchronously
+    producing a Collection containing the header fields, and then
+    each Quotation as soon as its closing tag has been read.
+
+    'input' is an object with a read() coroutine, such as an
+    asyncio.StreamReader, or an asynchronous iterable of bytes
+    or str chunks.  Data is parsed 'bufsize' characters at a time.
+    """
+    feeder = parse._SAXFeeder()
+    async for data in _chunks(input, bufsize):
+        for item in feeder.feed(data):
+            yield item
+        # Let other tasks run, even if the data was already available.
+        await asyncio.sleep(0)
+    for item in feeder.feed(None):
+        yield item
+
+async def aparse (input, bufsize=2**16):
+    """Parse the QEL document read from 'input', returning a Collection.
+    'input' and 'bufsize' are as for aiterparse().
+    """
+    coll = None
+    async for item in aiterparse(input, bufsize):
+        if coll is None:
+            coll = item
+        else:
+            coll.append(item)
+    return coll
+
+async def _aiter (quotations):
+    if hasattr(quotations, '__aiter__'):
+        async for qt in quotations:
+            yield qt
+    else:
+        for qt in quotations:
+            yield qt
+
+async def arender (quotations, method='as_text', *args, **kw):
+    """Asynchronously produce the result of calling the method named
+    'method' on each quotation, passing it any additional arguments.
+    'quotations' may be an ordinary or asynchronous iterable; control
+    is returned to the event loop after each quotation.
+    """
+    async for qt in _aiter(quotations):
+        yield getattr(qt, method)(*args, **kw)
+        await asyncio.sleep(0)
+
+async def arender_xml (coll, quotations=None, encoding='UTF-8'):
+    """Asynchronously produce the XML for the collection 'coll' as a
+    series of strings: the header, each quotation, and the footer.
+    The quotations are taken from 'quotations' if it's given, which
+    may be an asynchronous iterable such as the rest of aiterparse()'s
+    output, and from 'coll' itself otherwise.
+    """
+    yield coll.xml_header(encoding)
+    if quotations is None:
+        quotations = coll
+    async for s in arender(quotations, 'as_xml'):
+        yield s
+    yield QEL_FOOTER
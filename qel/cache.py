@@ -0,0 +1,293 @@
+"""
+qel.cache -- Caches of parsed QEL files and rendered quotations.
+
+Parsing a large QEL file is slow, so scripts that read the same files
+over and over can keep the parsed collections in a cache directory:
+
+    cache = ParseCache('~/.cache/qel')
+    coll = cache.parse('quotations.xml')
+
+The first call parses the file and stores the resulting Collection;
+later calls load it from the cache as long as the file is unchanged.
+
+A RenderCache keeps the output of the Quotation.as_*() methods in
+memory, for programs that render the same quotations repeatedly:
+
+    renders = RenderCache()
+    html = renders.render(qt, 'as_html')
+"""
+
+import io, os, hashlib, json, pickle, tempfile, contextlib
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from qel import opcodes, parse
+
+__all__ = ['ParseCache', 'RenderCache']
+
+# Incremented whenever the pickled classes change incompatibly, so that
+# stale entries are never loaded.
+_FORMAT_VERSION = 3
+
+class ParseCache:
+    """A directory of parsed collections, keyed by file contents.
+
+    Each entry is a pickled Collection, named after the SHA-256 hash
+    of the file it was parsed from and of any arguments to parse().
+    An index records the size, mtime, and entry of each file that has
+    been parsed, so files whose size and mtime haven't changed don't
+    even need to be read; other files are hashed and looked up by
+    their contents.  Where fcntl is available, updates to the index
+    are made while holding a lock on the directory, so several
+    processes can share a cache.
+
+    When the entries take up more than 'max_size' bytes, the least
+    recently used ones are deleted.  Loading an entry unpickles it, so
+    the cache directory must only be writable by trusted users.
+    """
+
+    def __init__ (self, directory, max_size=256 * 1024 * 1024):
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        self._index_path = os.path.join(self.directory, 'index.json')
+
+    def _entry_path (self, digest):
+        return os.path.join(self.directory, digest + '.pickle')
+
+    @contextlib.contextmanager
+    def _lock (self):
+        "Hold an exclusive lock on the cache directory."
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _read_index (self):
+        try:
+            with open(self._index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != _FORMAT_VERSION:
+            return {}
+        return index.get('files', {})
+
+    def _write_index (self, files):
+        self._write_atomically(self._index_path,
+                               json.dumps({'version': _FORMAT_VERSION,
+                                           'files': files}).encode('ascii'))
+
+    def _write_atomically (self, path, data):
+        # Write to a temporary file and rename it, so that concurrent
+        # readers never see a partially written file.
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _load (self, digest):
+        "Return the cached collection for 'digest', or None."
+        path = self._entry_path(digest)
+        try:
+            with open(path, 'rb') as f:
+                coll = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # A corrupted entry is treated as missing.  Another
+            # process may have deleted it already.
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return None
+
+        # Mark the entry as recently used.
+        os.utime(path)
+        return coll
+
+    def _store (self, digest, coll):
+        self._write_atomically(self._entry_path(digest),
+                               pickle.dumps(coll, pickle.HIGHEST_PROTOCOL))
+
+    def _evict (self):
+        """Delete the least recently used entries until under max_size,
+        and drop the index records of deleted entries and files.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pickle'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        entries.sort()
+        while total > self.max_size and len(entries) > 1:
+            mtime, size, path = entries.pop(0)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock():
+            files = self._read_index()
+            kept = dict((key, record) for key, record in files.items()
+                        if os.path.exists(self._entry_path(record[2])) and
+                        os.path.exists(key.split('\0', 1)[0]))
+            if len(kept) != len(files):
+                self._write_index(kept)
+
+    def parse (self, path, **kw):
+        """Return the Collection for the QEL file 'path', parsing it
+        only if it's not in the cache.  Keyword arguments are passed
+        on to qel.parse.parse(), and collections parsed with different
+        arguments are cached separately.
+
+        The returned collection belongs to the caller; modifying it
+        doesn't affect the cached copy.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = path
+        if kw:
+            key += '\0' + repr(sorted(kw.items()))
+
+        # If the size and mtime match, the entry is already known.
+        record = self._read_index().get(key)
+        if record is not None and record[:2] == [st.st_size, st.st_mtime_ns]:
+            coll = self._load(record[2])
+            if coll is not None:
+                return coll
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data)
+        if kw:
+            digest.update(key[len(path):].encode('utf-8'))
+        digest = digest.hexdigest()
+        coll = self._load(digest)
+        stored = coll is None
+        if stored:
+            coll = parse.parse(io.BytesIO(data), **kw)
+            self._store(digest, coll)
+
+        # The record is only added once the entry exists, and the index
+        # is read again while locked, so that records added by other
+        # processes in the meantime aren't lost.
+        with self._lock():
+            files = self._read_index()
+            files[key] = [st.st_size, st.st_mtime_ns, digest]
+            self._write_index(files)
+        if stored:
+            self._evict()
+        return coll
+
+    def clear (self):
+        "Remove all of the entries from the cache."
+        for entry in os.scandir(self.directory):
+            if (entry.name.endswith('.pickle') or
+                entry.path == self._index_path):
+                os.unlink(entry.path)
+
+
+def _fingerprint(qt):
+    """Return a value that changes whenever the contents of 'qt' do,
+    or None if they contain markup that can't be compiled.
+    """
+    # Compiled paragraphs are immutable, so while the quotation stays
+    # compiled the same tuple is found and compared by identity.
+    code = qt._code
+    try:
+        if code is None:
+            code = (tuple(map(opcodes.compile_paragraph, qt.text)),
+                    tuple(map(opcodes.compile_paragraph, qt.note)))
+        attributes = []
+        for attr in (qt.author, qt.source):
+            if attr is not None:
+                attr = (attr.type and tuple(attr.type), attr.uri,
+                        opcodes.compile_paragraph(attr.text or ()))
+            attributes.append(attr)
+    except TypeError:
+        return None
+    return (qt._version, code, tuple(attributes))
+
+
+class RenderCache:
+    """An in-memory cache of the output of Quotation.as_*() methods.
+
+    Results are cached for each combination of quotation, method, and
+    arguments, along with a fingerprint of the quotation's contents:
+    its ._version and its compiled paragraphs, author, and source.
+    Results are discarded when the fingerprint changes, so modifying
+    a quotation in place doesn't require calling invalidate().
+    Quotations containing markup that can't be compiled aren't cached.
+    At most 'maxsize' results are kept; when there are more,
+    the least recently used ones are discarded.  The cache holds
+    references to the quotations it has results for.
+
+    Instance attributes:
+      .hits, .misses : int
+        Number of lookups that were or weren't satisfied by the cache.
+    """
+
+    def __init__ (self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        # Maps (id(qt), method, args) to (qt, fingerprint, output)
+        self._entries = OrderedDict()
+
+    def __len__ (self):
+        return len(self._entries)
+
+    def render (self, qt, method, *args, **kw):
+        """Return the result of calling the method named 'method' on
+        'qt' with the given arguments, such as
+        render(qt, 'as_text', include_date=1).
+        """
+        key = (id(qt), method, args, tuple(sorted(kw.items())))
+        entry = self._entries.get(key)
+        if (entry is not None and entry[0] is qt and
+            entry[1] == _fingerprint(qt)):
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[2]
+
+        self.misses += 1
+        output = getattr(qt, method)(*args, **kw)
+        # The fingerprint is taken afterwards because rendering a
+        # LazyQuotation fills in its contents.
+        fingerprint = _fingerprint(qt)
+        if fingerprint is None:
+            self._entries.pop(key, None)
+            return output
+        self._entries[key] = (qt, fingerprint, output)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return output
+
+    def invalidate (self, qt):
+        "Discard all the cached results for 'qt'."
+        for key in [key for key, entry in self._entries.items()
+                    if entry[0] is qt]:
+            del self._entries[key]
+
+    def clear (self):
+        "Discard all of the cached results."
+        self._entries.clear()
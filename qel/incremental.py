@@ -0,0 +1,223 @@
+"""
+qel.incremental -- Re-parsing a QEL file after it has been edited.
+
+An IncrementalParser remembers a hash of each quotation's XML from the
+last time it parsed a file.  When the file is parsed again, only the
+<quotation> elements whose bytes have changed are parsed; the others
+are reused from the previous collection:
+
+    parser = IncrementalParser()
+    coll, changes = parser.parse('quotations.xml')
+    ... edit the file ...
+    coll, changes = parser.parse('quotations.xml')
+    print(changes.modified)
+
+The parser's state can be saved to disk with save() and restored with
+IncrementalParser.load(), so separate runs of a script can share it.
+"""
+
+import os, hashlib, pickle, tempfile
+
+from qel import parse, quotation
+
+__all__ = ['IncrementalParser', 'ChangeSet']
+
+def _digest(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).digest()
+
+
+class ChangeSet:
+    """The differences between two versions of a collection.
+
+    Instance attributes:
+      .added : [str]
+        IDs of quotations that weren't present before.
+      .removed : [str]
+        IDs of quotations that are no longer present.
+      .modified : [str]
+        IDs of quotations whose XML has changed.
+      .header_changed : bool
+        True if the collection's title, editor, etc. may have changed.
+
+    Quotations without an ID can't be tracked, and aren't listed.
+    The IDs are listed in document order, except for .removed, which
+    follows the order of the previous version.
+    """
+
+    def __init__ (self, added=(), removed=(), modified=(),
+                  header_changed=False):
+        self.added = list(added)
+        self.removed = list(removed)
+        self.modified = list(modified)
+        self.header_changed = header_changed
+
+    def __bool__ (self):
+        return bool(self.added or self.removed or self.modified or
+                    self.header_changed)
+
+    def __repr__ (self):
+        return ('<ChangeSet: %d added, %d removed, %d modified>'
+                % (len(self.added), len(self.removed), len(self.modified)))
+
+
+class IncrementalParser:
+    """Parses successive versions of a QEL file, re-using the quotations
+    that haven't changed.
+
+    Unchanged quotations are the same objects as in the previous
+    collection, so callers that modify the returned quotations should
+    copy them first.
+
+    Instance attributes:
+      .collection : Collection
+        The collection from the last call to parse(), or None.
+    """
+
+    def __init__ (self, backend='sax'):
+        self.backend = backend
+        self.collection = None
+        self._prolog = None
+        self._header_digest = None
+        # Maps each quotation's digest to the quotations parsed from it
+        self._quotations = {}
+        # Maps each quotation ID to the digest of its XML
+        self._id_digests = {}
+
+    def parse (self, input):
+        """Parse 'input', a filename or file object, returning a
+        (Collection, ChangeSet) tuple describing the differences from
+        the previous call.  On the first call, every quotation is
+        reported as added.
+
+        Documents containing comments or CDATA sections, which can hide
+        tags from scan_quotations(), are parsed completely, and every
+        quotation is reported as added or modified.
+        """
+        data = parse._read_input(input)
+        if parse._may_hide_tags(data):
+            return self._parse_all(data)
+        prolog, spans = parse.scan_quotations(data)
+        if prolog is None:
+            raise parse.ParseError("No <quotations> element found")
+        if prolog != self._prolog:
+            # The encoding or namespace declarations may have changed,
+            # so nothing can be reused.
+            self._quotations = {}
+
+        header = data[:spans[0][0]] if spans else data
+        header_digest = _digest(header)
+        header_changed = (header_digest != self._header_digest)
+        if header_changed:
+            coll = parse._parse_header(data, spans, self.backend)
+        else:
+            coll = quotation.Collection()
+            # Copy the title, editor, etc.
+            for attr in quotation.Collection.__slots__:
+                setattr(coll, attr, getattr(self.collection, attr))
+
+        # Find the quotations that can be reused, and parse the rest.
+        old_quotations = self._quotations
+        digests = []
+        changed = []
+        for i, (start, end) in enumerate(spans):
+            digest = _digest(data[start:end])
+            digests.append(digest)
+            reusable = old_quotations.get(digest)
+            if reusable:
+                # Each object is used at most once, in case a quotation
+                # has been duplicated.
+                coll.append(reusable.pop(0))
+            else:
+                coll.append(None)
+                changed.append(i)
+        parsed = self._parse_spans(prolog, data, spans, changed)
+        if len(parsed) != len(changed):
+            raise parse.ParseError("Expected %d changed quotations, found %d"
+                                   % (len(changed), len(parsed)))
+        for i, qt in zip(changed, parsed):
+            coll[i] = qt
+
+        # Record the state for the next call.
+        self._quotations = {}
+        id_digests = {}
+        for qt, digest in zip(coll, digests):
+            self._quotations.setdefault(digest, []).append(qt)
+            if qt.id is not None:
+                # The first quotation with a given ID wins.
+                id_digests.setdefault(qt.id, digest)
+
+        old_ids = self._id_digests
+        changes = ChangeSet(header_changed=header_changed)
+        for id, digest in id_digests.items():
+            if id not in old_ids:
+                changes.added.append(id)
+            elif old_ids[id] != digest:
+                changes.modified.append(id)
+        changes.removed = [id for id in old_ids if id not in id_digests]
+
+        self._prolog = prolog
+        self._header_digest = header_digest
+        self._id_digests = id_digests
+        self.collection = coll
+        return coll, changes
+
+    def _parse_all (self, data):
+        """Parse all of 'data', whose quotations can't be located by
+        scanning it.  Nothing is reused, and no digests are recorded,
+        so every quotation is reported as added or modified, now and
+        on the next call.
+        """
+        coll = parse.parse(parse._as_stream(data), self.backend)
+        id_digests = {}
+        for qt in coll:
+            if qt.id is not None:
+                id_digests.setdefault(qt.id, None)
+
+        old_ids = self._id_digests
+        changes = ChangeSet(header_changed=True)
+        for id in id_digests:
+            if id in old_ids:
+                changes.modified.append(id)
+            else:
+                changes.added.append(id)
+        changes.removed = [id for id in old_ids if id not in id_digests]
+
+        self._prolog = self._header_digest = None
+        self._quotations = {}
+        self._id_digests = id_digests
+        self.collection = coll
+        return coll, changes
+
+    def _parse_spans (self, prolog, data, spans, indexes):
+        "Parse the quotations at the given indexes of 'spans'."
+        if not indexes:
+            return []
+        sep = '\n' if isinstance(data, str) else b'\n'
+        fragment = sep.join(data[spans[i][0]:spans[i][1]] for i in indexes)
+        return parse.parse_fragment(prolog, fragment, self.backend)
+
+    def save (self, path):
+        "Save the parser's state in the file 'path'."
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load (cls, path):
+        """Return the parser saved in the file 'path'.  The file is
+        unpickled, so it must come from a trusted source.
+        """
+        with open(path, 'rb') as f:
+            parser = pickle.load(f)
+        if not isinstance(parser, cls):
+            raise TypeError("%r doesn't contain an %s"
+                            % (path, cls.__name__))
+        return parser
@@ -0,0 +1,562 @@
+"""
+qel.index -- A full-text index for searching large QEL files.
+
+Searching a QEL file for a regular expression normally means parsing
+every quotation.  A SearchIndex records which quotations contain each
+word and each three-character sequence (trigram) in the string
+returned by their search_text(True) method, which includes the
+author, source and notes, so a search only has to parse the
+quotations that could possibly match:
+
+    with SearchIndex.open('quotations.xml') as index:
+        for qt in index.search(re.compile('deep thought', re.IGNORECASE)):
+            print(qt.as_text())
+
+required_literals() works out which strings every match of a pattern
+must contain.  The quotations containing those strings are looked up
+in the index, and are then checked with Quotation.is_matching_regex(),
+so the results are exactly those of a full scan.  Patterns that don't
+require any literal text, such as '.', still have to check every
+quotation.  Text is indexed in the form returned by fold(), so the
+index works for case-insensitive patterns.
+
+As with QELFile, the index is stored in a sidecar file next to the
+QEL file and is rebuilt automatically when the QEL file changes.  The
+sidecar is mapped into memory, so opening it and looking up a few
+terms is fast even for very large files.
+"""
+
+import io, os, re, sys, json, mmap, array, tempfile
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    # Python 3.10 and earlier
+    import sre_parse, sre_constants
+
+from qel import parse
+
+__all__ = ['SearchIndex', 'fold', 'required_literals']
+
+# Version of the sidecar file's format
+_INDEX_VERSION = 3
+
+# Number of quotations parsed at a time when building the index or
+# checking the candidates of a search.
+_BATCH_SIZE = 256
+
+# Characters that re.IGNORECASE treats as equal even though they
+# don't have the same lowercase form.  fold() replaces each of them
+# with the first character of its group.
+_CASE_EQUIVALENCES = (
+    'iı', 'sſ', '\xb5μ', 'ͅιι',
+    'ΐΐ', 'ΰΰ', 'βϐ', 'εϵ',
+    'θϑ', 'κϰ', 'πϖ', 'ρϱ',
+    'ςσ', 'φϕ', 'вᲀ', 'дᲁ',
+    'оᲂ', 'сᲃ', 'тᲄᲅ', 'ъᲆ',
+    'ѣᲇ', 'ᲈꙋ', 'ṡẛ', 'ﬅﬆ',
+)
+
+_fold_table = {}
+for group in _CASE_EQUIVALENCES:
+    for ch in group[1:]:
+        _fold_table[ord(ch)] = group[0]
+del group, ch
+
+# str.lower() turns U+0130 into two characters, but re lowercases it
+# to a plain 'i'.
+_before_lower = {0x130: 'i'}
+
+def fold(s):
+    """Return a copy of 's' in which characters that match each other
+    under re.IGNORECASE have been replaced by the same character.
+    Each character is replaced by exactly one character, so offsets
+    in 's' and in the result are the same.
+    """
+    if s.isascii():
+        return s.lower()
+    return s.translate(_before_lower).lower().translate(_fold_table)
+
+
+# Finding the literal strings required by a regular expression
+
+_LITERAL = sre_constants.LITERAL
+_AT = sre_constants.AT
+_SUBPATTERN = sre_constants.SUBPATTERN
+_BRANCH = sre_constants.BRANCH
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+            getattr(sre_constants, 'POSSESSIVE_REPEAT', None))
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+
+def required_literals(pattern):
+    """Return the strings that any match of the compiled regular
+    expression 'pattern' must contain, as a list of clauses.
+
+    Each clause is a tuple of folded strings, and a match contains at
+    least one string from every clause.  For example, 'ab+c(d|ef)'
+    produces [('ab',), ('bc',), ('d', 'ef')].  An empty list means that
+    nothing is known about the matches.
+    """
+    if not isinstance(pattern.pattern, str):
+        return []
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return []
+    exact, clauses = _analyze(parsed)
+    result = []
+    for clause in clauses:
+        clause = tuple(sorted(set(fold(s) for s in clause)))
+        if clause not in result:
+            result.append(clause)
+    return result
+
+def _analyze(items):
+    """Analyze a sequence of parsed regular expression items, returning
+    an (exact, clauses) tuple.  'exact' is the string matched by the
+    whole sequence if it always matches the same string, and None
+    otherwise; 'clauses' are as for required_literals().
+    """
+    clauses = []
+    run = []            # Characters of the current literal string
+    exact = True
+
+    def end_run():
+        if run:
+            clauses.append((''.join(run),))
+            del run[:]
+
+    for op, av in items:
+        if op is _LITERAL:
+            run.append(chr(av))
+            continue
+        elif op is _AT:
+            # Anchors don't consume any characters.
+            continue
+        elif op is _SUBPATTERN or op is _ATOMIC_GROUP:
+            sub = av if op is _ATOMIC_GROUP else av[-1]
+            sub_exact, sub_clauses = _analyze(sub)
+            if sub_exact is not None:
+                run.append(sub_exact)
+                continue
+            end_run()
+            clauses.extend(sub_clauses)
+        elif op in _REPEATS:
+            min_count, max_count, sub = av
+            sub_exact, sub_clauses = _analyze(sub)
+            if min_count >= 1 and sub_exact:
+                # The first repetition follows the preceding text, and
+                # the last one precedes the following text.
+                run.append(sub_exact)
+                end_run()
+                run.append(sub_exact)
+            else:
+                end_run()
+                if min_count >= 1:
+                    clauses.extend(sub_clauses)
+        elif op is _BRANCH:
+            end_run()
+            clause = _branch_clause([_analyze(alt) for alt in av[1]])
+            if clause is not None:
+                clauses.append(clause)
+        else:
+            end_run()
+        exact = False
+
+    if exact:
+        s = ''.join(run)
+        return s, [(s,)] if s else []
+    end_run()
+    return None, clauses
+
+def _branch_clause(alternatives):
+    """Return a clause satisfied by every match of one of 'alternatives',
+    a list of (exact, clauses) tuples, or None if there isn't one.
+    """
+    clause = []
+    for exact, clauses in alternatives:
+        if not clauses:
+            return None
+        # Use the clause whose shortest string is the longest one.
+        clause.extend(max(clauses, key=lambda c: min(len(s) for s in c)))
+    return tuple(clause)
+
+
+# The index
+
+_word_re = re.compile(r'\w+')
+
+def _terms(text):
+    "Return the set of index terms for 'text', which must be folded."
+    terms = {'w' + word for word in _word_re.findall(text)}
+    terms.update('t' + text[i:i+3] for i in range(len(text) - 2))
+    return terms
+
+def _add_postings(postings, number, qt):
+    "Add the terms of the quotation 'qt', numbered 'number', to 'postings'."
+    for term in _terms(fold(qt.search_text(True))):
+        L = postings.get(term)
+        if L is None:
+            postings[term] = [number]
+        else:
+            L.append(number)
+
+def _pad(length):
+    return b'\0' * (-length % 8)
+
+
+class SearchIndex:
+    """A full-text index of a QEL file.
+
+    Quotations are identified by their position in the file, counting
+    from 0.  Terms are the words and trigrams of the folded text,
+    prefixed with 'w' and 't' respectively; the index holds the
+    numbers of the quotations containing each term.
+
+    Instance attributes:
+      .path : str
+        Path of the QEL file.
+      .index_path : str
+        Path of the sidecar file holding the index.
+    """
+
+    def __init__ (self, path, index_path=None):
+        self.path = path
+        if index_path is None:
+            index_path = path + '.sidx'
+        self.index_path = index_path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            self._map = b''
+        self._index_map = None
+        self._views = []
+        self._words = None
+        if not self._read_index():
+            self.build_index()
+
+    @classmethod
+    def open (cls, path, index_path=None):
+        "Open the QEL file 'path', building its index if necessary."
+        return cls(path, index_path)
+
+    def close (self):
+        self._release()
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+    def __len__ (self):
+        return len(self._spans) // 2
+
+    def _stat_key (self):
+        st = os.fstat(self._file.fileno())
+        return [st.st_size, st.st_mtime_ns]
+
+    def _release (self):
+        "Release the views of the index data, and the mapping holding it."
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+
+    def _load (self, data):
+        """Set up access to the index data 'data', a bytes-like object.
+        Returns false if it's out of date or in another format.
+        """
+        end = data.find(b'\n')
+        try:
+            header = json.loads(bytes(data[:end]))
+        except ValueError:
+            return False
+        if (header.get('version') != _INDEX_VERSION or
+            header.get('byteorder') != sys.byteorder or
+            header.get('stat') != self._stat_key()):
+            return False
+
+        self._prolog_length = header['prolog']
+        self._located = header['located']
+        view = memoryview(data)
+        self._views.append(view)
+        pos = end + 1
+        def section(length, format):
+            nonlocal pos
+            v = view[pos:pos + length]
+            self._views.append(v)
+            pos += length + len(_pad(length))
+            if format is not None:
+                v = v.cast(format)
+                self._views.append(v)
+            return v
+        count, nterms = header['quotations'], header['terms']
+        self._spans = section(16 * count, 'q')
+        self._term_offsets = section(8 * (nterms + 1), 'q')
+        self._posting_offsets = section(8 * (nterms + 1), 'q')
+        self._postings = section(4 * header['postings'], 'I')
+        self._blob = section(header['blob'], None)
+        return True
+
+    def _read_index (self):
+        """Map the sidecar index into memory, returning false if it's
+        missing or out of date.
+        """
+        try:
+            with open(self.index_path, 'rb') as f:
+                index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        if not self._load(index_map):
+            self._release()
+            index_map.close()
+            return False
+        self._index_map = index_map
+        return True
+
+    def build_index (self):
+        """Parse the whole file and index each quotation, saving the
+        index in the sidecar file if possible.
+
+        If the file contains comments or CDATA sections, which can hide
+        tags from scan_quotations(), the quotations' locations aren't
+        recorded, and search() has to parse the whole file.
+        """
+        data = self._map
+        located = not parse._may_hide_tags(data)
+        postings = {}
+        if located:
+            prolog, spans = parse.scan_quotations(data)
+            if prolog is None:
+                raise parse.ParseError("No <quotations> element found")
+            for i in range(0, len(spans), _BATCH_SIZE):
+                batch = spans[i:i + _BATCH_SIZE]
+                fragment = data[batch[0][0]:batch[-1][1]]
+                quotations = parse.parse_fragment(prolog, fragment)
+                if len(quotations) != len(batch):
+                    raise parse.ParseError("Quotations couldn't be located")
+                for number, qt in enumerate(quotations, i):
+                    _add_postings(postings, number, qt)
+        else:
+            prolog = b''
+            spans = []
+            items = parse.iterparse(self.path)
+            next(items)
+            for number, qt in enumerate(items):
+                _add_postings(postings, number, qt)
+                spans.append((0, 0))
+
+        terms = sorted(postings)
+        span_array = array.array('q')
+        for start, end in spans:
+            span_array.append(start)
+            span_array.append(end - start)
+        blob = bytearray()
+        term_offsets = array.array('q', [0])
+        posting_offsets = array.array('q', [0])
+        posting_array = array.array('I')
+        for term in terms:
+            blob += term.encode('utf-8')
+            term_offsets.append(len(blob))
+            posting_array.extend(postings[term])
+            posting_offsets.append(len(posting_array))
+        del postings
+
+        header = {'version': _INDEX_VERSION,
+                  'byteorder': sys.byteorder,
+                  'stat': self._stat_key(),
+                  'prolog': len(prolog),
+                  'located': located,
+                  'quotations': len(spans),
+                  'terms': len(terms),
+                  'postings': len(posting_array),
+                  'blob': len(blob)}
+        header = json.dumps(header).encode('ascii')
+        # Pad the header so that the arrays are aligned.
+        header += b' ' * (-(len(header) + 1) % 8) + b'\n'
+        out = io.BytesIO()
+        out.write(header)
+        for section in (span_array, term_offsets, posting_offsets,
+                        posting_array, blob):
+            section = bytes(section)
+            out.write(section)
+            out.write(_pad(len(section)))
+        index = out.getvalue()
+
+        self._release()
+        self._load(index)
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(index)
+                os.replace(temp_path, self.index_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            # The index will have to be rebuilt next time.
+            pass
+
+    def _term (self, i):
+        offsets = self._term_offsets
+        return str(self._blob[offsets[i]:offsets[i+1]], 'utf-8')
+
+    def _find (self, term):
+        "Return the position of 'term' in the sorted list of terms."
+        lo, hi = 0, len(self._term_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _postings_for (self, i):
+        "Return the quotation numbers for the i'th term, as a memoryview."
+        return self._postings[self._posting_offsets[i]:
+                              self._posting_offsets[i+1]]
+
+    def lookup (self, term):
+        """Return a list of the numbers of the quotations containing
+        'term', which is a word or trigram with its prefix.
+        """
+        i = self._find(term)
+        if i < len(self._term_offsets) - 1 and self._term(i) == term:
+            return self._postings_for(i).tolist()
+        return []
+
+    def _word_list (self):
+        "Return a list of (word, term position) pairs for all the words."
+        if self._words is None:
+            start = self._find('w')
+            end = self._find('x')
+            self._words = [(self._term(i)[1:], i) for i in range(start, end)]
+        return self._words
+
+    def _literal_candidates (self, s):
+        """Return the set of quotations that may contain the folded
+        string 's', or None if the index can't tell.
+        """
+        if len(s) >= 3:
+            lists = []
+            for trigram in set(s[i:i+3] for i in range(len(s) - 2)):
+                i = self._find('t' + trigram)
+                if (i == len(self._term_offsets) - 1 or
+                    self._term(i) != 't' + trigram):
+                    return set()
+                lists.append(self._postings_for(i))
+            lists.sort(key=len)
+            result = set(lists[0])
+            for L in lists[1:]:
+                # Intersecting with a much longer list takes more time
+                # than it saves; the candidates are checked anyway.
+                if len(L) > 64 * len(result):
+                    break
+                result.intersection_update(L)
+            return result
+        elif _word_re.fullmatch(s):
+            # Short strings can only be found within words.
+            result = set()
+            for word, i in self._word_list():
+                if s in word:
+                    result.update(self._postings_for(i))
+            return result
+        return None
+
+    def candidates (self, pattern):
+        """Return a sorted list of the numbers of the quotations that
+        may match the compiled regular expression 'pattern', or None
+        if every quotation has to be checked.
+        """
+        result = None
+        for clause in required_literals(pattern):
+            found = set()
+            for s in clause:
+                candidates = self._literal_candidates(s)
+                if candidates is None:
+                    found = None
+                    break
+                found |= candidates
+            if found is None:
+                continue
+            if result is None:
+                result = found
+            else:
+                result &= found
+            if not result:
+                break
+        if result is None:
+            return None
+        return sorted(result)
+
+    def get_xml (self, number):
+        """Return the bytes of the XML for the quotation numbered
+        'number', or None if the quotations' locations aren't known.
+        """
+        if not self._located:
+            return None
+        offset = self._spans[2 * number]
+        return self._map[offset:offset + self._spans[2 * number + 1]]
+
+    def search (self, pattern, include_all=False):
+        """Produce the quotations matching the compiled regular
+        expression 'pattern', in the order they appear in the file.
+        'include_all' is passed to Quotation.is_matching_regex().
+        """
+        from qel.search import Prefilter, _encoding
+
+        numbers = self.candidates(pattern)
+        if not self._located:
+            yield from self._scan(pattern, numbers, include_all)
+            return
+        if numbers is None:
+            numbers = range(len(self))
+        prolog = self._map[:self._prolog_length]
+        # The index only records words and trigrams, so the candidates
+        # are checked for the complete literals before being parsed.
+        prefilter = Prefilter(pattern, _encoding(prolog))
+        batch = []
+        for n in numbers:
+            xml = self.get_xml(n)
+            if prefilter.may_match(xml):
+                batch.append(xml)
+            if len(batch) == _BATCH_SIZE or (batch and n == numbers[-1]):
+                for qt in parse.parse_fragment(prolog, b''.join(batch)):
+                    if qt.is_matching_regex(pattern, include_all):
+                        yield qt
+                batch = []
+
+    def _scan (self, pattern, numbers, include_all):
+        """Implementation of search() for files whose quotations weren't
+        located: the file is parsed, and the quotations whose numbers
+        are in 'numbers' are checked, or all of them if it's None.
+        """
+        if numbers is None:
+            wanted, last = None, len(self) - 1
+        else:
+            wanted, last = set(numbers), (numbers[-1] if numbers else -1)
+        if last < 0:
+            return
+        items = parse.iterparse(self.path)
+        try:
+            next(items)
+            for number, qt in enumerate(items):
+                if ((wanted is None or number in wanted) and
+                    qt.is_matching_regex(pattern, include_all)):
+                    yield qt
+                if number == last:
+                    break
+        finally:
+            items.close()
@@ -0,0 +1,302 @@
+"""
+qel.jsonl -- Reading and writing collections in JSON Lines format.
+
+A JSON Lines file holds one JSON object per line.  The first line
+contains the collection's header fields, and each following line
+contains a quotation:
+
+    {"collection": {"title": "Quotations", "license": [["CC0"]]}}
+    {"id": "q1", "type": ["humor"], "text": [["Some ", ["em", "text"]]],
+     "author": {"text": ["Someone"], "uri": "http://..."}}
+
+(The quotation is shown on two lines here, but occupies a single line
+in the file.)  A paragraph is a list of chunks, where each chunk is
+either a string or a list containing an element name such as "em",
+"cite", "pre" or "br" followed by the element's contents.  Fields
+that are empty or None are left out.
+
+The format is much faster to read than XML, and converting between
+the two is lossless: a collection loaded from JSON Lines produces
+the same as_xml() output as the collection it was written from.
+"""
+
+import io, sys, json, codecs
+
+from qel import opcodes, parse, quotation
+
+__all__ = ['quotation_to_dict', 'quotation_from_dict',
+           'header_to_dict', 'header_from_dict',
+           'write_quotation', 'dump', 'iterload', 'load']
+
+_HEADER_FIELDS = ('title', 'editor', 'description', 'copyright')
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+# Converting paragraphs to lists of chunks
+
+def _code_to_chunks(code):
+    "Convert a compiled paragraph to a list of chunks."
+    chunks = []
+    stack = []
+    it = iter(code)
+    for op, arg in zip(it, it):
+        if op == opcodes.TEXT:
+            chunks.append(arg)
+        elif op == opcodes.OPEN:
+            element = [arg.xml_tag]
+            chunks.append(element)
+            stack.append(chunks)
+            chunks = element
+        elif op == opcodes.CLOSE:
+            chunks = stack.pop()
+        elif op == opcodes.BREAK:
+            chunks.append(['br'])
+        else:
+            chunks.append(['pre'] + _code_to_chunks(arg))
+    return chunks
+
+def _paragraph_to_chunks(paragraph):
+    """Convert a list of Text and Markup instances to a list of chunks.
+    TypeError is raised if the paragraph contains anything that can't
+    be represented.
+    """
+    return _code_to_chunks(opcodes.compile_paragraph(paragraph))
+
+def _chunks_to_code(chunks, code):
+    "Append the compiled form of the list 'chunks' to the list 'code'."
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            if len(chunk) <= parse._INTERN_LENGTH:
+                chunk = sys.intern(chunk)
+            code += (opcodes.TEXT, chunk)
+            continue
+        tag = chunk[0]
+        if tag == 'br':
+            code += (opcodes.BREAK, None)
+        elif tag == 'pre':
+            pre = []
+            _chunks_to_code(chunk[1:], pre)
+            code += (opcodes.PRE, tuple(pre))
+        elif tag in parse.horiz_tags:
+            klass = parse.horiz_tags[tag]
+            code += (opcodes.OPEN, klass)
+            _chunks_to_code(chunk[1:], code)
+            code += (opcodes.CLOSE, klass)
+        else:
+            raise parse.ParseError("Unexpected element: <%s>" % tag)
+
+def _chunks_to_compiled(chunks):
+    code = []
+    _chunks_to_code(chunks, code)
+    return tuple(code)
+
+def _chunks_to_paragraph(chunks):
+    return opcodes.decompile_paragraph(_chunks_to_compiled(chunks))
+
+# Converting quotations and headers to dictionaries
+
+def _attribute_to_dict(attr):
+    "Convert an Author or Source instance to a dictionary."
+    d = {'text': _paragraph_to_chunks(attr.text)}
+    if attr.type:
+        d['type'] = attr.type
+    if attr.uri:
+        d['uri'] = attr.uri
+    return d
+
+def _attribute_from_dict(klass, d):
+    attr = klass()
+    attr.text = _chunks_to_paragraph(d['text'])
+    attr.type = d.get('type')
+    attr.uri = d.get('uri')
+    return attr
+
+def quotation_to_dict(qt):
+    """Return a dictionary representing the Quotation 'qt', suitable
+    for json.dump().  TypeError is raised if the quotation's text
+    contains instances of classes not defined in qel.quotation.
+    """
+    d = {}
+    if qt.id is not None:
+        d['id'] = qt.id
+    if qt.date is not None:
+        d['date'] = qt.date
+    if qt.type is not None:
+        d['type'] = qt.type
+    code = qt._code
+    if code is not None:
+        d['text'] = [_code_to_chunks(p) for p in code[0]]
+        note = [_code_to_chunks(p) for p in code[1]]
+    else:
+        d['text'] = [_paragraph_to_chunks(p) for p in qt.text]
+        note = [_paragraph_to_chunks(p) for p in qt.note]
+    if qt.author is not None:
+        d['author'] = _attribute_to_dict(qt.author)
+    if qt.source is not None:
+        d['source'] = _attribute_to_dict(qt.source)
+    if note:
+        d['note'] = note
+    return d
+
+def quotation_from_dict(d):
+    """Return a new Quotation built from the dictionary 'd', as produced
+    by quotation_to_dict().  The quotation's paragraphs are stored in
+    compiled form.
+    """
+    qt = quotation.Quotation()
+    qt.id = d.get('id')
+    qt.date = d.get('date')
+    qt.type = d.get('type')
+    if 'author' in d:
+        qt.author = _attribute_from_dict(quotation.Author, d['author'])
+    if 'source' in d:
+        qt.source = _attribute_from_dict(quotation.Source, d['source'])
+    qt._set_code(tuple([_chunks_to_compiled(p) for p in d.get('text', ())]),
+                 tuple([_chunks_to_compiled(p) for p in d.get('note', ())]))
+    return qt
+
+def header_to_dict(coll):
+    "Return a dictionary holding the header fields of the Collection 'coll'."
+    d = {}
+    for name in _HEADER_FIELDS:
+        value = getattr(coll, name)
+        if value is not None:
+            d[name] = value
+    if coll.license is not None:
+        license = []
+        for t in coll.license:
+            if isinstance(t, str):
+                license.append(t)
+            elif isinstance(t, quotation.Text):
+                license.append(t.text)
+            else:
+                # A paragraph, as produced by the parser
+                license.append(_paragraph_to_chunks(t))
+        d['license'] = license
+    return d
+
+def header_from_dict(d):
+    "Return an empty Collection with the header fields in the dictionary 'd'."
+    coll = quotation.Collection()
+    for name in _HEADER_FIELDS:
+        setattr(coll, name, d.get(name))
+    if 'license' in d:
+        coll.license = [t if isinstance(t, str) else _chunks_to_paragraph(t)
+                        for t in d['license']]
+    return coll
+
+# Reading and writing files
+
+def write_quotation(out, qt):
+    "Write the Quotation 'qt' to 'out' as a single line of JSON."
+    out.write(_encoder.encode(quotation_to_dict(qt)))
+    out.write('\n')
+
+def dump(coll, fp, quotations=None):
+    """Write the Collection 'coll' to 'fp' in JSON Lines format.
+
+    'fp' can be a text file or a binary file, which receives UTF-8.
+    If 'quotations' is supplied, it's an iterable whose quotations are
+    written instead of the collection's contents, as for
+    Collection.write_xml().
+    """
+    if isinstance(fp, (io.RawIOBase, io.BufferedIOBase)):
+        fp = codecs.getwriter('utf-8')(fp)
+    if quotations is None:
+        quotations = coll
+    fp.write(_encoder.encode({'collection': header_to_dict(coll)}))
+    fp.write('\n')
+    for qt in quotations:
+        write_quotation(fp, qt)
+
+def _load_lines(lines):
+    """Return a list of the quotations in 'lines', an iterable of
+    JSON lines.  Blank lines are ignored.
+    """
+    decode = json.loads
+    return [quotation_from_dict(decode(line)) for line in lines
+            if line.strip()]
+
+def _iterload(lines):
+    "Implementation of iterload(), reading from an iterable of lines."
+    coll = None
+    for line in lines:
+        if not line.strip():
+            continue
+        d = json.loads(line)
+        if coll is None:
+            if 'collection' in d:
+                coll = header_from_dict(d['collection'])
+                yield coll
+                continue
+            # There's no header line.
+            coll = quotation.Collection()
+            yield coll
+        yield quotation_from_dict(d)
+    if coll is None:
+        yield quotation.Collection()
+
+def iterload(input):
+    """Read a collection in JSON Lines format from 'input', a filename
+    or a file object, returning an iterator.  As with
+    qel.parse.iterparse(), the first item produced is a Collection
+    containing the header fields, followed by each Quotation in turn.
+    """
+    if isinstance(input, str):
+        with open(input, 'rb') as stream:
+            yield from _iterload(stream)
+    else:
+        yield from _iterload(input)
+
+def load(input, workers=None):
+    """Read a collection in JSON Lines format from 'input', a filename
+    or a file object, returning a Collection.
+
+    If 'workers' is greater than 1, the file is read into memory,
+    split into chunks of lines, and the chunks are decoded in that
+    many processes; the quotations are returned in their original
+    order.
+    """
+    if workers is None or workers <= 1:
+        items = iterload(input)
+        coll = next(items)
+        coll.extend(items)
+        return coll
+
+    import concurrent.futures
+
+    data = parse._read_input(input)
+    # Only newlines separate records; str.splitlines() would also
+    # break lines at characters such as U+2028.
+    newline = '\n' if isinstance(data, str) else b'\n'
+    lines = data.split(newline)
+    del data
+
+    # The header is decoded here, and the quotations by the workers.
+    coll = None
+    start = 0
+    while start < len(lines) and not lines[start].strip():
+        start += 1
+    if start < len(lines):
+        d = json.loads(lines[start])
+        if 'collection' in d:
+            coll = header_from_dict(d['collection'])
+            start += 1
+    if coll is None:
+        coll = quotation.Collection()
+
+    # Several chunks per worker, so that the load is balanced.
+    nchunks = 4 * workers
+    chunk_size = (len(lines) - start) // nchunks + 1
+    chunks = [newline.join(lines[i:i+chunk_size])
+              for i in range(start, len(lines), chunk_size)]
+    del lines
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for quotations in executor.map(_load_chunk, chunks):
+            coll.extend(quotations)
+    return coll
+
+def _load_chunk(chunk):
+    "Decode the quotations in a chunk of JSON Lines data."
+    newline = '\n' if isinstance(chunk, str) else b'\n'
+    return _load_lines(chunk.split(newline))
@@ -0,0 +1,298 @@
+"""
+qel.opcodes -- A compiled, flat representation of paragraphs.
+
+A paragraph is normally a tree of Text and Markup instances, and
+rendering it means calling a method on every node.  compile_paragraph()
+turns the tree into a flat tuple of alternating opcodes and payloads:
+
+    TEXT, str      A chunk of text.
+    OPEN, class    The start of a Markup subclass such as EmphasizedText.
+    CLOSE, class   The end of the most recently opened markup.
+    BREAK, None    A <br/> element.
+    PRE, tuple     A <pre> element; the payload is the compiled contents.
+
+For example, [Text('a '), EmphasizedText('b')] compiles to
+
+    (TEXT, 'a ', OPEN, EmphasizedText, TEXT, 'b', CLOSE, EmphasizedText)
+
+The write_*() functions render compiled paragraphs in a single loop,
+looking up the delimiters for each kind of markup in a table, and
+produce exactly the same output as the write_*() methods of the
+corresponding tree.  decompile_paragraph() turns a compiled paragraph
+back into a tree.
+
+The parser stores each quotation's paragraphs in compiled form; the
+.text and .note attributes are rebuilt from it when they're accessed.
+"""
+
+from xml.sax.saxutils import escape
+
+from qel import quotation, wrap
+
+__all__ = ['TEXT', 'OPEN', 'CLOSE', 'BREAK', 'PRE',
+           'compile_paragraph', 'decompile_paragraph', 'length', 'texts',
+           'write_text', 'write_rst', 'write_wiki', 'write_html',
+           'write_xml', 'write_note_text']
+
+# Opcodes.  No payload is an integer, so the opcodes can be found
+# with the 'in' operator.
+TEXT, OPEN, CLOSE, BREAK, PRE = range(5)
+
+# The Markup subclasses that can be compiled, and their delimiters
+# in each output format.  Classes that render themselves in some other
+# way can't be compiled.
+_tables = {'text': {}, 'rst': {}, 'wiki': {}, 'html': {}, 'xml': {}}
+
+# Classes whose contents are written as plain text in RestructuredText
+_rst_as_text = set()
+
+for klass in (quotation.Abbreviation, quotation.Acronym,
+              quotation.CitedText, quotation.CodeFormattedText,
+              quotation.EmphasizedText, quotation.ForeignText,
+              quotation.QuotedText):
+    _tables['text'][klass] = (klass.text_char, klass.text_char)
+    if klass.write_rst is quotation.Markup.write_text:
+        _tables['rst'][klass] = _tables['text'][klass]
+        _rst_as_text.add(klass)
+    elif klass.xml_tag:
+        _tables['rst'][klass] = (':%s:`' % klass.xml_tag, '`')
+    else:
+        _tables['rst'][klass] = ('`', '`')
+    if isinstance(klass.wiki_delim, tuple):
+        _tables['wiki'][klass] = klass.wiki_delim
+    else:
+        _tables['wiki'][klass] = (klass.wiki_delim, klass.wiki_delim)
+    for fmt, tag in (('html', klass.html_tag), ('xml', klass.xml_tag)):
+        if tag:
+            _tables[fmt][klass] = ('<%s>' % tag, '</%s>' % tag)
+        else:
+            _tables[fmt][klass] = ('', '')
+del klass
+
+def compile_paragraph (paragraph):
+    """Return the compiled form of 'paragraph', a list of Text and
+    Markup instances.  TypeError is raised if the paragraph contains
+    anything that can't be compiled, such as strings or instances of
+    Markup subclasses defined outside qel.quotation.
+    """
+    code = []
+    _compile(paragraph, code)
+    return tuple(code)
+
+def _compile (nodes, code):
+    for t in nodes:
+        klass = type(t)
+        if klass is quotation.Text:
+            code += (TEXT, t.text)
+        elif klass is quotation.Break:
+            code += (BREAK, None)
+        elif klass is quotation.PreformattedText:
+            code += (PRE, compile_paragraph(t.children))
+        elif klass in _tables['text']:
+            code += (OPEN, klass)
+            _compile(t.children, code)
+            code += (CLOSE, klass)
+        else:
+            raise TypeError("can't compile %r" % (t,))
+
+def decompile_paragraph (code):
+    "Return a new list of Text and Markup instances for a compiled paragraph."
+    paragraph = []
+    current = paragraph
+    stack = []
+    it = iter(code)
+    for op, arg in zip(it, it):
+        if op == TEXT:
+            current.append(quotation.Text(arg))
+        elif op == OPEN:
+            inst = arg()
+            current.append(inst)
+            stack.append(current)
+            current = inst.children
+        elif op == CLOSE:
+            current = stack.pop()
+        elif op == BREAK:
+            current.append(quotation.Break())
+        else:
+            inst = quotation.PreformattedText()
+            inst.children = decompile_paragraph(arg)
+            current.append(inst)
+    return paragraph
+
+def texts (code):
+    "Produce each chunk of text in a compiled paragraph, in order."
+    it = iter(code)
+    for op, arg in zip(it, it):
+        if op == TEXT:
+            yield arg
+        elif op == PRE:
+            yield from texts(arg)
+
+def length (code):
+    "Return the number of characters of text in a compiled paragraph."
+    size = 0
+    for s in texts(code):
+        size += len(s)
+    return size
+
+def _pre_as_text (code):
+    "Return the plain text of a <pre> element's compiled contents."
+    return _render(code, 'text').strip()
+
+def _pre_as_rst (code):
+    return '\n\n::\n' + _pre_as_text(code).replace('\n', '\n    ') + '\n\n'
+
+def _render (code, fmt, split=False):
+    """Return the output for the compiled paragraph 'code' in the format
+    'fmt', without any wrapping.
+
+    If 'split' is true, the paragraph is divided at the BREAK and PRE
+    tokens that aren't inside any markup, as the tree renderers do,
+    and these tokens aren't rendered.  A list is returned holding the
+    output for each part, with the opcode and payload of the dividing
+    token between each pair of parts.  Parts containing no tokens are
+    represented by None.
+    """
+    table = _tables[fmt]
+    markup = fmt == 'html' or fmt == 'xml'
+    wiki = fmt == 'wiki'
+    rst = fmt == 'rst'
+    depth = 0
+    pieces = []
+    parts = []
+    append = parts.append
+    # For Wiki markup, empty elements produce no output, so the
+    # position of each open element's delimiter is remembered.
+    size = 0
+    marks = []
+    # In RestructuredText, the contents of some elements are written
+    # as plain text; this records the format outside each open element.
+    formats = []
+
+    it = iter(code)
+    for op, arg in zip(it, it):
+        if op == TEXT:
+            if markup:
+                append(escape(arg))
+            else:
+                append(arg)
+                if wiki:
+                    size += len(arg)
+        elif op == OPEN:
+            depth += 1
+            if wiki:
+                marks.append((len(parts), size))
+            append(table[arg][0])
+            if rst:
+                formats.append(fmt)
+                if fmt == 'rst' and arg in _rst_as_text:
+                    fmt = 'text'
+                    table = _tables[fmt]
+        elif op == CLOSE:
+            depth -= 1
+            if wiki:
+                pos, old_size = marks.pop()
+                if size == old_size:
+                    del parts[pos:]
+                    continue
+            if rst:
+                fmt = formats.pop()
+                table = _tables[fmt]
+            append(table[arg][1])
+        elif split and not depth:
+            pieces.append(''.join(parts) if parts else None)
+            pieces.append(op)
+            pieces.append(arg)
+            parts = []
+            append = parts.append
+        elif op == BREAK:
+            if markup:
+                append('<br />')
+        elif fmt == 'text':
+            append(_pre_as_text(arg))
+        elif fmt == 'rst':
+            append(_pre_as_rst(arg))
+        elif wiki:
+            pre_size = length(arg)
+            if pre_size:
+                append('<nowiki>')
+                append(_render(arg, fmt))
+                append('</nowiki>')
+                size += pre_size
+        else:
+            append('<pre>')
+            append(_render(arg, fmt))
+            append('</pre>')
+
+    if not split:
+        return ''.join(parts)
+    pieces.append(''.join(parts) if parts else None)
+    return pieces
+
+def write_text (out, code, indent, fmt='text'):
+    """Write a compiled paragraph as plain text, filled to 79 columns and
+    indented by 'indent'.  Breaks and preformatted text start new lines.
+    If 'fmt' is 'rst', the paragraph is written as RestructuredText.
+    """
+    pieces = _render(code, fmt, True)
+    for i in range(0, len(pieces), 3):
+        if i:
+            # The token preceding this part
+            if pieces[i-2] == PRE:
+                if fmt == 'rst':
+                    out.write(_pre_as_rst(pieces[i-1]))
+                else:
+                    out.write(_pre_as_text(pieces[i-1]))
+                out.write('\n')
+        text = pieces[i]
+        if text is not None:
+            lines = wrap.wrap(text, 79, indent, split_hyphens=False)
+            out.write('\n'.join(lines) + '\n')
+
+def write_rst (out, code):
+    "Write a compiled paragraph as RestructuredText."
+    write_text(out, code, "", 'rst')
+
+def write_wiki (out, code):
+    "Write a compiled paragraph as Wiki markup, preceded by a '*'."
+    pieces = _render(code, 'wiki', True)
+    for i in range(0, len(pieces) - 1, 3):
+        if pieces[i] is not None:
+            out.write(pieces[i])
+        if pieces[i+1] == PRE:
+            out.write(_pre_as_rst(pieces[i+2]))
+            out.write('\n')
+    out.write('*')
+    if pieces[-1] is not None:
+        out.write(pieces[-1])
+    out.write('\n')
+
+def write_html (out, code):
+    "Write the HTML for the contents of a compiled paragraph."
+    out.write(_render(code, 'html'))
+
+def write_xml (out, code, indent):
+    """Write pretty-printed XML for the contents of a compiled paragraph,
+    filled to 70 columns and indented by 'indent'.  Breaks and
+    preformatted text start new lines.
+    """
+    pieces = _render(code, 'xml', True)
+    for i in range(0, len(pieces), 3):
+        if i:
+            if pieces[i-2] == BREAK:
+                out.write(indent)
+                out.write('<br />')
+            else:
+                out.write('<pre>')
+                out.write(_render(pieces[i-1], 'xml'))
+                out.write('</pre>')
+            out.write('\n')
+        lines = wrap.wrap(pieces[i] or '', 70, indent, split_hyphens=False)
+        out.write('\n'.join(lines))
+        out.write('\n')
+
+def write_note_text (out, code):
+    "Write a compiled paragraph of a note as plain text, filled to 75 columns."
+    lines = wrap.wrap(_render(code, 'text'), 75)
+    out.write('\n'.join(lines))
+    out.write('\n')
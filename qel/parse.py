@@ -4,12 +4,17 @@ qel.parse -- Parse a document in the QEL DTD,
 """
 
 import io, codecs, sys, string, re
+import xml.sax
+from xml.sax import handler
+from xml.sax.saxutils import unescape
 from xml.dom import pulldom
 
 from qel import QEL_NS, RDF_NS
 from qel import quotation
 
-__all__ = ['ParseError', 'parse']
+__all__ = ['ParseError', 'parse', 'iterparse',
+           'scan_quotations', 'iterscan_quotations', 'parse_fragment',
+           'LazyQuotation']
 
 class ParseError (Exception):
     pass
@@ -21,79 +26,151 @@ def _split_type(S):
     """
     if S is None:
         return None
-    return [typ.strip() for typ in S.split(',')]
+    return [sys.intern(typ.strip()) for typ in S.split(',')]
+
+_whitespace_re = re.compile(r'\s+')
+
+# Strings of at most this many characters are interned, so the many
+# copies of short words and single spaces in a collection are shared.
+_INTERN_LENGTH = 12
+
+def _text(text):
+    "Return a new Text instance for 'text', interning it if it's short."
+    if len(text) <= _INTERN_LENGTH:
+        text = sys.intern(text)
+    return quotation.Text(text)
+
+def _normalize_run(run):
+    """Merge a run of consecutive Text instances into one, translating
+    all whitespace to spaces and condensing runs of whitespace down to
+    a single space.  A new instance is only created if necessary, or
+    to intern a short string.
+    """
+    if len(run) == 1:
+        t = run[0]
+        text = _whitespace_re.sub(' ', t.text)
+        if text == t.text and len(text) > _INTERN_LENGTH:
+            return t
+    else:
+        text = _whitespace_re.sub(' ', ''.join([t.text for t in run]))
+    return _text(text)
+
+def _lstrip(t):
+    if isinstance(t, quotation.Text):
+        text = t.text.lstrip()
+        if len(text) == len(t.text):
+            return t
+        return _text(text)
+    return t.lstrip()
+
+def _rstrip(t):
+    if isinstance(t, quotation.Text):
+        text = t.text.rstrip()
+        if len(text) == len(t.text):
+            return t
+        return _text(text)
+    return t.rstrip()
+
+# Kinds of chunk distinguished by simplify()
+_PLAIN_TEXT, _PLAIN_MARKUP, _FORMATTED, _BARRIER = range(4)
 
 def simplify(text_list, trim_ends = True):
-    "Apply various simplifications to a list of Text instances"
-    # Merge consecutive Text objects
-    for i in range(1, len(text_list)):
-        t1 = text_list[i-1]
-        t2 = text_list[i]
-        if isinstance(t1, quotation.Text) and isinstance(t2, quotation.Text):
-            t2.text = t1.text + t2.text
-            text_list[i-1] = None
-            i += 1
-
-    # Remove Nones
-    text_list = [obj for obj in text_list if obj is not None]
-
-    # Translate all whitespace to spaces, and condense runs of whitespace
-    # down to a single space.
-    for i in range(len(text_list)):
-        t = text_list[i]
+    """Apply various simplifications to a list of Text instances,
+    returning a new list.  Markup instances in the list have their
+    children simplified in place.
+    """
+    return _simplify(text_list, trim_ends, True)
+
+def _simplify(text_list, trim_ends, recurse):
+    """Implementation of simplify().  If 'recurse' is false, the
+    children of Markup instances are assumed to be simplified already;
+    simplifying them again wouldn't change them.
+    """
+    # Merge consecutive Text objects and normalize their whitespace,
+    # recording the kind of each chunk.
+    L = []
+    kinds = []
+    run = []
+    for t in text_list:
         if isinstance(t, quotation.Text):
-            text_list[i] = quotation.Text(re.sub('\s+', ' ', t.text))
-        elif t.is_break() or t.is_preformatted():
+            run.append(t)
             continue
+        if run:
+            L.append(_normalize_run(run))
+            kinds.append(_PLAIN_TEXT)
+            run = []
+        if t.is_break() or t.is_preformatted():
+            kinds.append(_BARRIER)
         else:
-            t.children = simplify(t.children, trim_ends=False)
-
-    # Remove redundant whitespace between chunks.
-    for i in range(len(text_list)-2, -1, -1):
-        left, right = text_list[i:i+2]
-        if (left.is_break() or right.is_break() or
-            left.is_preformatted() or right.is_preformatted()):
-            continue
-        if (left.endswith(' ') and right.startswith(' ')):
-            if left.is_plain():
+            if recurse:
+                t.children = _simplify(t.children, False, True)
+            kinds.append(_PLAIN_MARKUP if t.is_plain() else _FORMATTED)
+        L.append(t)
+    if run:
+        L.append(_normalize_run(run))
+        kinds.append(_PLAIN_TEXT)
+
+    # Remove redundant whitespace between chunks, working from right to
+    # left; the output list is built in reverse order.
+    output = []
+    if L:
+        right = L[-1]
+        right_kind = kinds[-1]
+        for i in range(len(L)-2, -1, -1):
+            left = L[i]
+            left_kind = kinds[i]
+            if (left_kind == _BARRIER or right_kind == _BARRIER or
+                not (left.text.endswith(' ') if left_kind == _PLAIN_TEXT
+                     else left.endswith(' ')) or
+                not (right.text.startswith(' ') if right_kind == _PLAIN_TEXT
+                     else right.startswith(' '))):
+                pass
+            elif left_kind != _FORMATTED:
                 if len(right) > 1:
-                    text_list[i+1] = right = right.lstrip()
-            elif right.is_plain():
+                    right = _lstrip(right)
+            elif right_kind != _FORMATTED:
                 if len(left) > 1:
-                    text_list[i] = left = left.rstrip()
+                    left = _rstrip(left)
             else:
                 # Both chunks are something formatted.  This is likely to
                 # be an error, so we'll insert a Text chunk between them.
-                text_list[i] = left = left.rstrip()
-                text_list[i+1] = right = right.lstrip()
-                text_list.insert( i+1, quotation.Text(' '))
+                output.append(_lstrip(right))
+                right = quotation.Text(' ')
+                left = _rstrip(left)
+            output.append(right)
+            right = left
+            right_kind = left_kind
+        output.append(right)
+        output.reverse()
+
+    if not trim_ends:
+        return output
 
     # Remove leading whitespace from the first Text instance,
-    # and trailing whitespace from the last one.
-    changed = True
-    while trim_ends and len(text_list) and changed:
-        changed = False
-        first = text_list[0]
-        if not (first.is_preformatted() or first.is_break()):
-            text_list[0] = first = first.lstrip()
-            if len(first) == 0:
-                del text_list[0]
-                changed = True
-
-    changed = True
-    while trim_ends and len(text_list) and changed:
-        changed = False
-        last = text_list[-1]
-        if not (last.is_preformatted() or last.is_break() ):
-            text_list[-1] = last = last.rstrip()
-            if len(last) == 0:
-                del text_list[-1]
-                changed = True
-
-    if text_list and trim_ends:
-        assert not text_list[0].startswith(' ')
-
-    return text_list
+    # and trailing whitespace from the last one, dropping any
+    # chunks that become empty.
+    start, end = 0, len(output)
+    while start < end:
+        first = output[start]
+        if first.is_preformatted() or first.is_break():
+            break
+        output[start] = first = _lstrip(first)
+        if len(first):
+            break
+        start += 1
+
+    while start < end:
+        last = output[end-1]
+        if last.is_preformatted() or last.is_break():
+            break
+        output[end-1] = last = _rstrip(last)
+        if len(last):
+            break
+        end -= 1
+
+    if start or end < len(output):
+        output = output[start:end]
+    return output
 
 def _ignore_text (stream):
     """_ignore_text(DOMStream) : (str,Node)
@@ -208,24 +285,255 @@ def _parse_quotation (stream, token, node):
                     if (c2.nodeType == c2.ELEMENT_NODE):
                         qt.note.append(_make_para(c2))
 
+    qt.compile()
     return qt
 
 
-def parse(input):
-    """Parse 'input' as a QEL file, returning a QuotationCollection
-    object.  'input' can be either a file object or a string.  If
-    'input' is a file object, it is not closed when parsing is
-    complete."""
+# The SAX backend builds Quotation instances directly from the parser's
+# events, without constructing any DOM nodes.  The handler keeps a stack
+# of _Frame instances, one for each open element, recording how the
+# element's contents are to be handled.
+
+# Frame kinds
+_TOP, _HEADER, _LICENSE, _QUOTATION, _NOTE, _TEXT, _SKIP = range(7)
+
+class _Frame:
+    """An open element being processed by _QELHandler.
+
+    For _TEXT frames, 'items' accumulates the Text and Markup
+    instances, 'chars' accumulates character data not yet converted
+    into a Text instance, and 'done' is called with the finished list.
+    """
+    __slots__ = ('kind', 'items', 'chars', 'do_simplify', 'done')
+
+    def __init__ (self, kind, done=None, do_simplify=True):
+        self.kind = kind
+        self.items = []
+        self.chars = []
+        self.do_simplify = do_simplify
+        self.done = done
+
+
+class _QELHandler (handler.ContentHandler):
+    """SAX content handler that builds a Collection's header and its
+    Quotation instances.  Completed quotations are appended to the
+    .quotations list, where the caller can collect them.
+    """
+
+    def __init__ (self):
+        handler.ContentHandler.__init__(self)
+        self.collection = quotation.Collection()
+        self.quotations = []
+        self.found_root = False
+        self.header_done = False
+        self.qt = None
+        self.stack = [_Frame(_TOP)]
+
+    def startElementNS (self, name, qname, attrs):
+        tag = name[1]
+        stack = self.stack
+        frame = stack[-1]
+        kind = frame.kind
+
+        if kind == _TEXT:
+            if frame.chars:
+                frame.items.append(quotation.Text(''.join(frame.chars)))
+                frame.chars = []
+            if tag in horiz_tags:
+                inst = horiz_tags[tag]()
+                frame.items.append(inst)
+                do_s = not isinstance(inst, quotation.PreformattedText)
+                stack.append(_Frame(_TEXT, inst.children.extend, do_s))
+            elif tag == 'br':
+                frame.items.append(quotation.Break())
+                stack.append(_Frame(_SKIP))
+            else:
+                raise ParseError("Unexpected element: <%s>" % tag)
+
+        elif kind == _QUOTATION:
+            qt = self.qt
+            if tag == 'p':
+                stack.append(_Frame(_TEXT, qt.text.append))
+            elif tag == 'author' or tag == 'source':
+                if tag == 'author':
+                    qt.author = attr = quotation.Author()
+                else:
+                    qt.source = attr = quotation.Source()
+                attr.type = attrs.get((None, 'type')) or None
+                if attr.type is not None:
+                    attr.type = _split_type(attr.type)
+                attr.uri = attrs.get((RDF_NS, 'resource')) or None
+                attr.text = []
+                stack.append(_Frame(_TEXT, attr.text.extend))
+            elif tag == 'note':
+                stack.append(_Frame(_NOTE))
+            else:
+                stack.append(_Frame(_SKIP))
+
+        elif kind == _NOTE:
+            if tag != 'p':
+                raise ParseError("Paragraph tag expected, not <%s>" % tag)
+            stack.append(_Frame(_TEXT, self.qt.note.append))
+
+        elif kind == _HEADER and frame.done is not None:
+            # Inside <title>, <editor>, etc.
+            raise ParseError("Unexpected start tag: <%s>" % tag)
+
+        elif kind == _HEADER and tag in ('title', 'editor',
+                                         'description', 'copyright'):
+            coll = self.collection
+            stack.append(_Frame(_HEADER,
+                                lambda text: setattr(coll, tag, text)))
+
+        elif kind == _HEADER and tag == 'license':
+            self.collection.license = []
+            stack.append(_Frame(_LICENSE))
+
+        elif kind == _LICENSE:
+            if tag == 'p':
+                stack.append(_Frame(_TEXT, self.collection.license.append))
+            else:
+                stack.append(_Frame(_SKIP))
+
+        elif kind == _TOP and not self.found_root:
+            if tag == 'quotations':
+                self.found_root = True
+                stack.append(_Frame(_HEADER))
+            else:
+                stack.append(_Frame(_TOP))
+
+        elif kind == _HEADER or kind == _TOP:
+            # Any other element ends the header.
+            frame.kind = _TOP
+            self.header_done = True
+            if tag == 'quotation':
+                self.qt = qt = quotation.Quotation()
+                qt.id = attrs.get((None, 'id')) or None
+                qt.date = attrs.get((None, 'date')) or None
+                qt.type = attrs.get((None, 'type')) or None
+                if qt.type is not None:
+                    qt.type = _split_type(qt.type)
+                stack.append(_Frame(_QUOTATION))
+            else:
+                stack.append(_Frame(_TOP))
+
+        else:
+            stack.append(_Frame(_SKIP))
+
+    def endElementNS (self, name, qname):
+        frame = self.stack.pop()
+        kind = frame.kind
+        if kind == _TEXT:
+            L = frame.items
+            if frame.chars:
+                L.append(quotation.Text(''.join(frame.chars)))
+            if frame.do_simplify:
+                # Nested markup was simplified when it was closed.
+                L = _simplify(L, True, False)
+            frame.done(L)
+        elif kind == _QUOTATION:
+            self.qt.compile()
+            self.quotations.append(self.qt)
+            self.qt = None
+        elif kind == _HEADER:
+            if frame.done is not None:
+                frame.done(''.join(frame.chars))
+            else:
+                # End of the <quotations> element
+                self.header_done = True
+
+    def characters (self, content):
+        frame = self.stack[-1]
+        if frame.kind == _TEXT or (frame.kind == _HEADER and
+                                   frame.done is not None):
+            frame.chars.append(content)
+
+
+def _make_sax_parser ():
+    """Return an incremental (parser, handler) pair.  Data is passed to
+    parser.feed(), and the handler's .collection, .header_done and
+    .quotations attributes then report what has been parsed.
+    """
+    qelhandler = _QELHandler()
+    parser = xml.sax.make_parser()
+    parser.setFeature(handler.feature_namespaces, True)
+    parser.setContentHandler(qelhandler)
+    return parser, qelhandler
+
+class _SAXFeeder:
+    """Incremental parsing of a QEL document with the SAX backend,
+    shared by iterparse() and qel.aio.aiterparse().  The document is
+    passed to feed() a chunk at a time.
+    """
+    __slots__ = ('parser', 'handler', 'header_sent')
+
+    def __init__ (self):
+        self.parser, self.handler = _make_sax_parser()
+        self.header_sent = False
+
+    def feed (self, data):
+        """Parse the chunk 'data', producing the items that are now
+        complete: first the header Collection, then the Quotations.
+        An empty or None chunk marks the end of the document.
+        """
+        qelhandler = self.handler
+        if data:
+            self.parser.feed(data)
+        else:
+            self.parser.close()
+            if not qelhandler.found_root:
+                raise ParseError("No <quotations> element found")
+
+        if not self.header_sent and (qelhandler.header_done or not data):
+            self.header_sent = True
+            yield qelhandler.collection
+
+        if qelhandler.quotations:
+            quotations = qelhandler.quotations
+            qelhandler.quotations = []
+            yield from quotations
+
+def _iterparse_chunks (chunks):
+    """Parse the QEL document made up of the iterable of bytes or str
+    'chunks' with the SAX backend, producing the items as iterparse()
+    does.
+    """
+    feeder = _SAXFeeder()
+    for data in chunks:
+        if data:
+            yield from feeder.feed(data)
+    yield from feeder.feed(None)
+
+def _read_chunks (input, bufsize):
+    "Produce the contents of the file object 'input' in chunks."
+    while 1:
+        data = input.read(bufsize)
+        if not data:
+            break
+        yield data
+
+def _iterparse_sax (input, bufsize=2**16):
+    "Implementation of iterparse() using the SAX backend."
+    if isinstance(input, str):
+        with open(input, 'rb') as stream:
+            yield from _iterparse_sax(stream, bufsize)
+        return
+    yield from _iterparse_chunks(_read_chunks(input, bufsize))
+
+
+def _iterparse_pulldom (input):
+    "Implementation of iterparse() using the pulldom backend."
 
     coll = quotation.Collection()
     stream = pulldom.parse(input)
 
     # Scan for top-level 'quotations' element
-    while 1:
-        token, node = next(stream)
+    for token, node in stream:
         if (token == pulldom.START_ELEMENT and
             node.tagName == 'quotations'):
             break
+    else:
+        raise ParseError("No <quotations> element found")
 
     # Parse the headers
     while 1:
@@ -243,9 +551,6 @@ def parse(input):
                 while 1:
                     token, node = _ignore_text(stream)
                     if token == pulldom.START_ELEMENT and node.tagName == 'p':
-                        #print repr(node)
-                        #print node.__dict__
-                        #print stream.pulldom.firstEvent
                         stream.expandNode(node)
                         coll.license.append(_make_para(node))
                     else:
@@ -254,12 +559,325 @@ def parse(input):
             else:
                 break
 
-    # Parse a quotation
+    yield coll
+
+    # Parse the quotations one at a time.  Each quotation's nodes
+    # are discarded once the Quotation instance has been built.
     while 1:
         qt = _parse_quotation(stream, token, node)
         if qt is None:
             break
-        coll.append(qt)
-        token, node = next(stream)
+        node = None
+        yield qt
+        try:
+            token, node = next(stream)
+        except StopIteration:
+            break
+
+
+_backends = {'sax': _iterparse_sax,
+             'pulldom': _iterparse_pulldom}
+
+def iterparse(input, backend='sax', lazy=False):
+    """Parse 'input' as a QEL file, returning an iterator.
+
+    The first item produced is a Collection instance containing the
+    header fields (title, editor, etc.) but no quotations.  Each
+    Quotation is then produced as soon as its closing tag has been
+    read, so the entire file never has to be held in memory.  'input',
+    'backend' and 'lazy' are as for parse(); in lazy mode the entire
+    file is read before anything is produced.
+    """
+    if backend not in _backends:
+        raise ValueError("Unknown parser backend %r" % backend)
+    if lazy:
+        return _iterparse_lazy(input, backend)
+    return _backends[backend](input)
+
+
+# Locating quotations without parsing.  A QEL file is a flat sequence of
+# <quotation> elements inside <quotations>, so the elements can be found
+# by searching for their tags.  Both bytes and str documents are
+# supported; documents in encodings that aren't ASCII-compatible, such
+# as UTF-16, will simply appear to contain no quotations.
+
+_root_tag_re = re.compile(r'<quotations(?=[\s/>])[^>]*>')
+_quotation_tag_re = re.compile(r'<(/?)quotation(?=[\s/>])[^>]*>')
+_root_tag_bytes_re = re.compile(_root_tag_re.pattern.encode('ascii'))
+_quotation_tag_bytes_re = re.compile(
+    _quotation_tag_re.pattern.encode('ascii'))
+
+def scan_quotations(data):
+    """Find the quotations in 'data', a QEL document as bytes or str.
+
+    Returns a (prolog, spans) tuple.  'prolog' is the start of the
+    document up to and including the <quotations> start tag, or None
+    if no root element was found; 'spans' is a list of (start, end)
+    offsets of the <quotation> elements.  Tags that appear inside
+    comments or CDATA sections will confuse this function.
+    """
+    prolog, spans = iterscan_quotations(data)
+    return prolog, list(spans)
+
+def iterscan_quotations(data):
+    """Like scan_quotations(), but 'spans' is an iterator that finds
+    each quotation as it's needed.  'data' may also be an mmap object.
+    """
+    if isinstance(data, str):
+        root_re, tag_re = _root_tag_re, _quotation_tag_re
+    else:
+        root_re, tag_re = _root_tag_bytes_re, _quotation_tag_bytes_re
+
+    m = root_re.search(data)
+    if m is None or data[m.end()-2:m.end()-1] in ('/', b'/'):
+        return None, iter([])
+    prolog = data[:m.end()]
+    return prolog, _iter_spans(data, tag_re, len(prolog))
+
+def _iter_spans(data, tag_re, pos):
+    start = None
+    for m in tag_re.finditer(data, pos):
+        if m.group(1):
+            # End tag
+            if start is not None:
+                yield start, m.end()
+                start = None
+        elif data[m.end()-2:m.end()-1] in ('/', b'/'):
+            # Empty <quotation/> element
+            yield m.start(), m.end()
+        else:
+            start = m.start()
+
+
+def parse_fragment(prolog, fragment, backend='sax'):
+    """Parse a fragment of a QEL document, returning a list of Quotations.
+
+    'fragment' is a portion of the document containing complete
+    <quotation> elements, and 'prolog' is the beginning of the document
+    as returned by scan_quotations(), which supplies the encoding and
+    namespace declarations.  Both must be bytes, or both str.
+    """
+    if isinstance(fragment, str):
+        stream = io.StringIO(prolog + fragment + '</quotations>')
+    else:
+        stream = io.BytesIO(prolog + fragment + b'</quotations>')
+    items = iterparse(stream, backend)
+    next(items)
+    return list(items)
+
+
+def _read_input(input):
+    "Return the entire contents of 'input', a filename or file object."
+    if isinstance(input, str):
+        with open(input, 'rb') as stream:
+            return stream.read()
+    return input.read()
+
+def _as_stream(data):
+    if isinstance(data, str):
+        return io.StringIO(data)
+    return io.BytesIO(data)
+
+def _parse_header(data, spans, backend):
+    """Parse the header of the document 'data', returning an empty
+    Collection.  'spans' is as returned by scan_quotations().
+    """
+    if not spans:
+        return parse(_as_stream(data), backend)
+    # The header is parsed from everything before the first quotation.
+    end_tag = '</quotations>' if isinstance(data, str) else b'</quotations>'
+    return parse(_as_stream(data[:spans[0][0]] + end_tag), backend)
+
+
+def _may_hide_tags(data):
+    """Return true if the document 'data' contains comments or CDATA
+    sections, which can hide tags from scan_quotations().  'data' may
+    also be an mmap object, for which 'in' doesn't find substrings.
+    """
+    if isinstance(data, str):
+        return data.find('<!--') != -1 or data.find('<![CDATA[') != -1
+    return data.find(b'<!--') != -1 or data.find(b'<![CDATA[') != -1
+
+def _parse_parallel(input, backend, workers):
+    """Parse 'input' by splitting it at quotation boundaries and
+    parsing the pieces in 'workers' processes.
+    """
+    import concurrent.futures
+
+    data = _read_input(input)
+    if _may_hide_tags(data):
+        return parse(_as_stream(data), backend)
+    prolog, spans = scan_quotations(data)
+    if len(spans) < 2 * workers:
+        # Too small to be worth it, or not a document we can split.
+        return parse(_as_stream(data), backend)
+
+    coll = _parse_header(data, spans, backend)
+
+    # Divide the quotations into chunks of roughly equal size,
+    # several per worker so that the load is balanced.
+    nchunks = 4 * workers
+    chunk_size = (spans[-1][1] - spans[0][0]) // nchunks + 1
+    chunks = []
+    start = spans[0][0]
+    for i in range(len(spans)):
+        end = spans[i][1]
+        if end - start >= chunk_size or i == len(spans) - 1:
+            chunks.append(data[start:end])
+            start = end
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for quotations in executor.map(parse_fragment,
+                                       [prolog] * len(chunks), chunks,
+                                       [backend] * len(chunks)):
+            coll.extend(quotations)
+    return coll
+
+
+_encoding_re = re.compile(
+    br"""<\?xml[^>]*encoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+_attribute_re = re.compile(
+    r"""\s([\w.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+_attribute_ws_re = re.compile(r'[\t\n\r]')
+_charref_re = re.compile(r'&#(x[0-9a-fA-F]+|[0-9]+);')
+
+def _unescape_attribute(value):
+    "Replace entity and character references in an attribute value."
+    value = _attribute_ws_re.sub(' ', value)
+    value = _charref_re.sub(lambda m: chr(int(m.group(1)[1:], 16)
+                                          if m.group(1)[0] == 'x'
+                                          else int(m.group(1))), value)
+    return unescape(value, {'&quot;': '"', '&apos;': "'"})
+
+def _tag_attributes(tag):
+    """Return a dictionary of the unprefixed attributes of the start
+    tag 'tag', a string.
+    """
+    attrs = {}
+    for m in _attribute_re.finditer(tag):
+        value = m.group(2)
+        if value is None:
+            value = m.group(3)
+        attrs[m.group(1)] = _unescape_attribute(value)
+    return attrs
+
+
+class LazyQuotation (quotation.Quotation):
+    """A Quotation whose contents are only parsed when they're needed.
+
+    The .id, .date and .type attributes are available immediately.
+    The .text, .note, .author and .source attributes are parsed from
+    the quotation's XML the first time one of them is accessed.
+    """
+
+    __slots__ = ('_prolog', '_xml', '_backend')
+    # ._code holds the compiled paragraphs, so the renderers load it too.
+    _lazy_attributes = ('text', 'note', 'author', 'source', '_code')
+
+    def __init__(self, prolog, xml, backend='sax'):
+        # Quotation.__init__() isn't called, because it would set
+        # the lazily parsed attributes.
+        object.__setattr__(self, '_version', 0)
+        self.id = self.date = self.type = None
+        self._prolog = prolog
+        self._xml = xml
+        self._backend = backend
+
+    def __getattr__(self, name):
+        # Only called when the attribute hasn't been set yet.
+        if name not in LazyQuotation._lazy_attributes or self._xml is None:
+            return quotation.Quotation.__getattr__(self, name)
+        self._load()
+        return getattr(self, name)
+
+    def _is_set(self, name):
+        "Return true if the attribute 'name' has been assigned."
+        try:
+            object.__getattribute__(self, name)
+        except AttributeError:
+            return False
+        return True
+
+    def _load(self):
+        "Parse the quotation's XML and fill in its contents."
+        qt = parse_fragment(self._prolog, self._xml, self._backend)[0]
+        # Assigning .text or .note loads the quotation first, so
+        # neither has been set and the compiled form can be kept.
+        object.__setattr__(self, '_code', qt._code)
+        if qt._code is None:
+            names = ('text', 'note', 'author', 'source')
+        else:
+            names = ('author', 'source')
+        for name in names:
+            # Don't overwrite values that have been assigned already.
+            if not self._is_set(name):
+                setattr(self, name, getattr(qt, name))
+        self._prolog = self._xml = None
+
+
+def _iterparse_lazy(input, backend):
+    "Implementation of iterparse() for lazy=True."
+    data = _read_input(input)
+    if _may_hide_tags(data):
+        # The quotations can't be located reliably, so they're parsed
+        # right away.
+        yield from _backends[backend](_as_stream(data))
+        return
+    prolog, spans = scan_quotations(data)
+    if prolog is None:
+        raise ParseError("No <quotations> element found")
+    yield _parse_header(data, spans, backend)
+
+    encoding = None
+    if not isinstance(data, str):
+        m = _encoding_re.match(data)
+        encoding = m.group(1).decode('ascii') if m else 'UTF-8'
+
+    for start, end in spans:
+        xml = data[start:end]
+        tag = xml[:xml.index(b'>' if encoding else '>')]
+        if encoding:
+            tag = tag.decode(encoding)
+        attrs = _tag_attributes(tag)
+
+        qt = LazyQuotation(prolog, xml, backend)
+        qt.id = attrs.get('id') or None
+        qt.date = attrs.get('date') or None
+        qt.type = _split_type(attrs.get('type') or None)
+        yield qt
+
+
+def parse(input, backend='sax', workers=None, lazy=False):
+    """Parse 'input' as a QEL file, returning a QuotationCollection
+    object.  'input' can be either a file object or a string.  If
+    'input' is a file object, it is not closed when parsing is
+    complete.
+
+    'backend' selects the parser used: 'sax' builds the quotations
+    directly from the XML parser's events, while 'pulldom' builds
+    a DOM tree for each quotation and then converts it.  Both
+    produce the same quotations, but 'sax' is considerably faster.
+
+    If 'workers' is greater than 1, the file is read into memory,
+    split at quotation boundaries, and the pieces are parsed in that
+    many processes; the quotations are returned in document order.
+    Documents containing comments or CDATA sections are parsed in a
+    single process, since those can hide the boundaries.
+
+    If 'lazy' is true, the quotations are LazyQuotation instances:
+    only their .id, .date and .type are parsed up front, and the rest
+    of each quotation is parsed from its XML when first accessed.
+    This is much faster when only a few quotations will be looked at.
+    Documents containing comments or CDATA sections are parsed
+    completely instead.  'workers' is ignored in lazy mode.
+    """
 
+    if lazy:
+        items = iterparse(input, backend, lazy=True)
+    elif workers is not None and workers > 1:
+        return _parse_parallel(input, backend, workers)
+    else:
+        items = iterparse(input, backend)
+    coll = next(items)
+    coll.extend(items)
     return coll
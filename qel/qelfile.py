@@ -0,0 +1,171 @@
+"""
+qel.qelfile -- Random access to the quotations in a large QEL file.
+
+A QELFile maps the file into memory and keeps an index of where each
+quotation's XML is located, so a single quotation can be retrieved
+by its ID without parsing the rest of the file:
+
+    with QELFile.open('quotations.xml') as qf:
+        qt = qf.get('q12345')
+
+The index is stored in a sidecar file next to the QEL file, and is
+rebuilt automatically when the QEL file changes.
+"""
+
+import os, re, json, mmap, tempfile
+
+from qel import parse
+
+__all__ = ['QELFile']
+
+_encoding_re = re.compile(rb'''<\?xml[^>]*encoding\s*=\s*["']([A-Za-z0-9._-]+)''')
+_id_re = re.compile(rb'''\sid\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+
+# Version of the sidecar file's format
+_INDEX_VERSION = 2
+
+def _attribute_value(value, encoding):
+    "Convert the raw bytes of an attribute value into a string."
+    return parse._unescape_attribute(value.decode(encoding))
+
+
+class QELFile:
+    """A QEL file opened for random access by quotation ID.
+
+    Instance attributes:
+      .path : str
+        Path of the QEL file.
+      .index_path : str
+        Path of the sidecar file holding the index.
+      .offsets : {str : (int, int)}
+        Maps each quotation ID to the offset and length of the
+        quotation's XML in the file.
+    """
+
+    def __init__ (self, path, index_path=None):
+        self.path = path
+        if index_path is None:
+            index_path = path + '.idx'
+        self.index_path = index_path
+        self._file = open(path, 'rb')
+        self._map = b''
+        try:
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped.
+                pass
+            if not self._read_index():
+                self.build_index()
+        except BaseException:
+            self.close()
+            raise
+
+    @classmethod
+    def open (cls, path, index_path=None):
+        "Open the QEL file 'path', building its index if necessary."
+        return cls(path, index_path)
+
+    def close (self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+    def __len__ (self):
+        return len(self.offsets)
+
+    def __contains__ (self, id):
+        return id in self.offsets
+
+    def ids (self):
+        "Return a list of the quotation IDs, in the order they appear."
+        return sorted(self.offsets, key=self.offsets.get)
+
+    def _stat_key (self):
+        st = os.fstat(self._file.fileno())
+        return [st.st_size, st.st_mtime_ns]
+
+    def _read_index (self):
+        """Load the sidecar index, returning false if it's missing
+        or out of date.
+        """
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (index.get('version') != _INDEX_VERSION or
+            index.get('stat') != self._stat_key()):
+            return False
+        self._prolog_length = index['prolog']
+        self.offsets = dict((id, tuple(value))
+                            for id, value in index['offsets'].items())
+        return True
+
+    def build_index (self):
+        """Scan the file for quotations and record their locations,
+        saving the index in the sidecar file if possible.  Files
+        containing comments or CDATA sections, which can hide tags
+        from scan_quotations(), can't be indexed.
+        """
+        data = self._map
+        if parse._may_hide_tags(data):
+            raise parse.ParseError("%s contains comments or CDATA sections, "
+                                   "so its quotations can't be located"
+                                   % self.path)
+        m = _encoding_re.match(data)
+        encoding = m.group(1).decode('ascii') if m else 'UTF-8'
+
+        prolog, spans = parse.scan_quotations(data)
+        if prolog is None:
+            raise parse.ParseError("No <quotations> element found")
+        self._prolog_length = len(prolog)
+        self.offsets = {}
+        for start, end in spans:
+            tag_end = data.find(b'>', start)
+            m = _id_re.search(data, start, tag_end)
+            if m is None:
+                continue
+            id = _attribute_value(m.group(1) or m.group(2) or b'', encoding)
+            # The first quotation with a given ID wins.
+            self.offsets.setdefault(id, (start, end - start))
+
+        index = {'version': _INDEX_VERSION,
+                 'stat': self._stat_key(),
+                 'prolog': self._prolog_length,
+                 'offsets': self.offsets}
+        # The index is written to a temporary file and renamed, so
+        # that other processes never see a partially written index.
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(index, f)
+                os.replace(temp_path, self.index_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            # The index will have to be rebuilt next time.
+            pass
+
+    def get_xml (self, id):
+        "Return the bytes of the XML for the quotation with ID 'id'."
+        offset, length = self.offsets[id]
+        return self._map[offset:offset + length]
+
+    def get (self, id):
+        """Return the Quotation with ID 'id', parsing only its
+        element.  Raises KeyError if there's no such quotation.
+        """
+        prolog = self._map[:self._prolog_length]
+        quotations = parse.parse_fragment(prolog, self.get_xml(id))
+        return quotations[0]
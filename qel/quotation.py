@@ -1,76 +1,140 @@
 """
 qel.quotations -- Contains the classes representing the contents of
                   a QEL-format quotation.
+
+Output is produced by write_*() methods that write fragments of text
+to a file-like object, so that large quotations and collections can
+be rendered in linear time.  The as_*() methods are wrappers that
+return the output as a string, and render() writes any object in a
+named format.
 """
 
-import string, time, re
+import io, codecs, string, time, re
 
-import textwrap
 from xml.sax.saxutils import escape
-from qel import iso8601
-
-def format_paragraph_as_text (paragraph, indent,
-                              use_rst=False, use_wiki=False):
-    "Format a list of Text instances into a plain text string"
+from qel import iso8601, wrap
+
+def _as_string (write, *args, **kw):
+    "Call the write method 'write' on a StringIO, returning the output."
+    out = io.StringIO()
+    write(out, *args, **kw)
+    return out.getvalue()
+
+def render (obj, fmt, out=None, **kw):
+    """Render 'obj' in the format 'fmt' by calling out.write() with each
+    fragment of the output.  'obj' is a Collection, Quotation, or chunk
+    of text, and 'fmt' is the name of a format such as 'text', 'html',
+    or 'xml'.  Keyword arguments are passed on to the object's
+    write_<fmt>() method.  If 'out' is None, the output is returned
+    as a string.
+    """
+    write = getattr(obj, 'write_' + fmt, None)
+    if write is None:
+        raise ValueError("%s can't be rendered as %r"
+                         % (obj.__class__.__name__, fmt))
+    if out is None:
+        return _as_string(write, **kw)
+    write(out, **kw)
+
+def write_paragraph_as_text (out, paragraph, indent,
+                             use_rst=False, use_wiki=False):
+    "Format a list of Text instances as plain text, writing it to 'out'."
 
     if len(paragraph) == 0:
-        return ""
-    output = ""
+        return
+    buf = io.StringIO()
     for t in paragraph:
         if use_rst:
-            output += t.as_rst()
+            t.write_rst(buf)
         elif use_wiki:
-            output += t.as_wiki()
+            t.write_wiki(buf)
         else:
-            output += t.as_text()
+            t.write_text(buf)
+    output = buf.getvalue()
     if not use_wiki:
-        wrap = textwrap.TextWrapper(79, initial_indent=indent)
-        wrap.wordsep_re = re.compile(r'(\s+)')
-        lines = wrap.wrap(output)
+        lines = wrap.wrap(output, 79, indent, split_hyphens=False)
         output = '\n'.join(lines) + '\n'
-    return output
+    out.write(output)
+
+def format_paragraph_as_text (paragraph, indent,
+                              use_rst=False, use_wiki=False):
+    "Format a list of Text instances into a plain text string"
+    return _as_string(write_paragraph_as_text, paragraph, indent,
+                      use_rst, use_wiki)
+
+def write_partial_paragraph_as_xml (out, paragraph, indent):
+    """Write pretty-printed XML output for a portion of a paragraph.
+    Neither Break nor PreformattedText instances should be in the
+    'paragraph' list.
+    """
+    buf = io.StringIO()
+    for t in paragraph:
+        t.write_xml(buf)
+    lines = wrap.wrap(buf.getvalue(), 70, indent, split_hyphens=False)
+    out.write('\n'.join(lines))
+    out.write('\n')
 
 def format_partial_paragraph_as_xml(paragraph, indent):
     """Generate pretty-printed XML output for a portion of a paragraph.
     Neither Break nor PreformattedText instances should be in the
     'paragraph' list.
     """
-    output = ""
-    for t in paragraph:
-        output += t.as_xml()
-    wrap = textwrap.TextWrapper(70, initial_indent=indent)
-    wrap.wordsep_re = re.compile(r'(\s+)')
-    lines = wrap.wrap(output)
-    output = '\n'.join(lines) + '\n'
-    return output
+    return _as_string(write_partial_paragraph_as_xml, paragraph, indent)
 
-def format_paragraph_as_xml(paragraph, indent):
-    """Generate pretty-printed XML output for a paragraph.
+def write_paragraph_as_xml (out, paragraph, indent):
+    """Write pretty-printed XML output for a paragraph to 'out'.
     It will split the paragraph apart at Break and PreformattedText
     instances.
     """
-    output = ""
     start = 0
     for j in range(len(paragraph)):
         t = paragraph[j]
         if isinstance(t, str):
-            output += t
+            out.write(t)
 
         elif (t.is_break() or t.is_preformatted()):
-            output += format_partial_paragraph_as_xml(paragraph[start:j],
-                                                      indent)
+            write_partial_paragraph_as_xml(out, paragraph[start:j], indent)
             start = j + 1
-            if t.is_break(): output += indent
-            output += t.as_xml() + '\n'
+            if t.is_break(): out.write(indent)
+            t.write_xml(out)
+            out.write('\n')
 
-    output += format_partial_paragraph_as_xml(paragraph[start:], indent)
-    return output
+    write_partial_paragraph_as_xml(out, paragraph[start:], indent)
 
+def format_paragraph_as_xml(paragraph, indent):
+    """Generate pretty-printed XML output for a paragraph.
+    It will split the paragraph apart at Break and PreformattedText
+    instances.
+    """
+    return _as_string(write_paragraph_as_xml, paragraph, indent)
+
+def _paragraph_text (paragraph):
+    """Return the text of 'paragraph' without any markup.  'paragraph'
+    is a list of Text and Markup instances, or a compiled paragraph.
+    """
+    if isinstance(paragraph, tuple):
+        return ''.join(opcodes.texts(paragraph))
+    pieces = []
+    stack = [iter(paragraph)]
+    while stack:
+        for t in stack[-1]:
+            if isinstance(t, Text):
+                pieces.append(t.text)
+            elif isinstance(t, str):
+                pieces.append(t)
+            else:
+                stack.append(iter(t.children))
+                break
+        else:
+            stack.pop()
+    return ''.join(pieces)
 
 class Collection (list):
     """A collection of quotations.
 
     """
+    __slots__ = ('title', 'editor', 'description', 'copyright', 'license')
+
     def __init__ (self):
         self.title = None
         self.editor = None
@@ -86,7 +150,48 @@ class Collection (list):
         but it's the caller's responsibility to encode the string returned
         from this method.
         """
-        from qel import QEL_HEADER, QEL_FOOTER
+        return _as_string(self.write_xml, encoding)
+
+    def write_xml (self, fp, encoding="UTF-8", quotations=None):
+        """Write the XML representation of the collection to 'fp'.
+
+        If 'fp' is a binary file, the output is encoded using
+        'encoding' as it's written; characters that can't be encoded
+        are written as character references.  Otherwise 'fp' must
+        accept strings, and 'encoding' is only used in the XML
+        declaration.
+
+        If 'quotations' is supplied, it's an iterable whose quotations
+        are written instead of the collection's contents, so the
+        output of iterparse() can be written without ever holding the
+        whole document in memory.
+        """
+        from qel import QEL_FOOTER
+        if isinstance(fp, (io.RawIOBase, io.BufferedIOBase)):
+            fp = codecs.getwriter(encoding)(fp, 'xmlcharrefreplace')
+        if quotations is None:
+            quotations = self
+        fp.write(self.xml_header(encoding))
+        for qt in quotations:
+            qt.write_xml(fp)
+        fp.write(QEL_FOOTER)
+
+    def write_jsonl (self, fp, quotations=None):
+        """Write the collection to 'fp' in JSON Lines format; see
+        qel.jsonl.dump().
+        """
+        from qel import jsonl
+        jsonl.dump(self, fp, quotations)
+
+    def xml_header (self, encoding="UTF-8"):
+        """(str): str
+
+        Return the start of the collection's XML representation:
+        the XML declaration, the opening <quotations> tag, and the
+        collection's title, editor, etc.  The quotations and the
+        closing tag (qel.QEL_FOOTER) must be written by the caller.
+        """
+        from qel import QEL_HEADER
         s = QEL_HEADER % encoding
         if self.title:
             s += '  <title>%s</title>\n' % escape(self.title)
@@ -101,108 +206,73 @@ class Collection (list):
             for t in self.license:
                 if isinstance(t, str):
                     s += escape(t)
+                elif isinstance(t, list):
+                    # A paragraph, as produced by the parser
+                    s += '\n    <p>%s</p>' % ''.join([c.as_xml() for c in t])
                 else:
                     s += t.as_xml()
             s += '\n  </license>\n'
-        for qt in self:
-            s += qt.as_xml()
-        s += QEL_FOOTER
         return s
 
-class Author:
+class _CollectionAttribute:
+    __slots__ = ('text', 'type', 'uri')
+
     def __init__ (self):
         self.text = None
         self.type = None
         self.uri = None
 
     def as_text (self):
-        v = ""
-        for t in self.text:
-            if isinstance(v, str):
-                v += t
-            else:
-                v += t.as_text()
-        return v
+        return _as_string(self.write_text)
 
     def as_rst (self):
-        v = ""
-        for t in self.text:
-            if isinstance(v, str):
-                v += t
-            else:
-                v += t.as_rst()
-        return v
+        return _as_string(self.write_rst)
 
     def as_wiki (self):
-        v = ""
-        for t in self.text:
-            if isinstance(v, str):
-                v += t
-            else:
-                v += t.as_wiki()
-        return v
-
-    def as_xml (self):
-        s = '<author'
-        if self.type:
-            s += ' type="%s"' % self.type
-        if self.uri:
-            s += ' rdf:resource="%s"' % self.uri
-        s += '>'
-        for t in self.text:
-            s += t.as_xml()
-        s += '</author>'
-        return s
+        return _as_string(self.write_wiki)
 
+    def as_html (self):
+        return _as_string(self.write_html)
 
-class _CollectionAttribute:
-    def __init__ (self):
-        self.text = None
-        self.type = None
-        self.uri = None
+    def as_xml (self):
+        return _as_string(self.write_xml)
 
-    def as_text (self):
-        v = ""
+    def write_text (self, out):
         for t in self.text:
-            v += t.as_text()
-        return v
+            t.write_text(out)
 
-    def as_rst (self):
-        v = ""
+    def write_rst (self, out):
         for t in self.text:
-            v += t.as_rst()
-        return v
+            t.write_rst(out)
 
-    def as_wiki (self):
-        v = ""
+    def write_wiki (self, out):
         for t in self.text:
-            v += t.as_wiki()
-        return v
+            t.write_wiki(out)
 
-    def as_html (self):
-        v = "<p class='%s'>" % self.tag_name
+    def write_html (self, out):
+        out.write("<p class='%s'>" % self.tag_name)
         for t in self.text:
-            t = t.as_html()
-            v += t
-        return v + '</p>\n'
+            t.write_html(out)
+        out.write('</p>\n')
 
-    def as_xml (self):
-        s = '<%s' % self.tag_name
+    def write_xml (self, out):
+        out.write('<%s' % self.tag_name)
         if self.type:
             typ = ','.join(self.type)
-            s += ' type="%s"' % typ
+            out.write(' type="%s"' % typ)
         if self.uri:
-            s += ' rdf:resource="%s"' % self.uri
-        s += '>'
+            out.write(' rdf:resource="%s"' % self.uri)
+        out.write('>')
         for t in self.text:
-            s += t.as_xml()
-        s += '</%s>' % self.tag_name
-        return s
+            t.write_xml(out)
+        out.write('</%s>' % self.tag_name)
 
 class Source (_CollectionAttribute):
+    __slots__ = ()
     tag_name = 'source'
 
 class Author (_CollectionAttribute):
+    __slots__ = ()
     tag_name = 'author'
 
 
@@ -226,17 +296,114 @@ class Quotation:
     as_html()    -- return an HTML version of the quotation
     as_text()    -- return a plain text version of the quotation
     as_xml()     -- return the QEL version of the quotation
+
+    Each as_*() method has a write_*() counterpart that takes a
+    file-like object as its first argument and writes the output to it.
+
+    The ._version attribute is incremented whenever one of the
+    attributes above is assigned, so cached output can be recognized
+    as stale.  Modifying a paragraph list or Author in place doesn't
+    do this, so call invalidate() afterwards.
+
+    After compile() has been called, as the parser does, the paragraphs
+    of .text and .note are stored in the flat form described in
+    qel.opcodes, which takes less memory and is faster to render.
+    Accessing .text or .note turns them back into lists of Text
+    instances, which are then used from then on.
     """
 
+    __slots__ = ('id', 'date', 'type', 'text', 'source', 'author', 'note',
+                 '_version', '_code', '_search_cache')
+    _tracked_attributes = frozenset(['id', 'date', 'type', 'text',
+                                     'source', 'author', 'note'])
+
     def __init__(self):
+        object.__setattr__(self, '_version', 0)
+        object.__setattr__(self, '_code', None)
         self.id = self.date = None
         self.text = []
         self.author = self.source = None
         self.note = []
         self.type = None
 
+    def __setattr__(self, name, value):
+        if ((name == 'text' or name == 'note') and
+            getattr(self, '_code', None) is not None):
+            # The other attribute is still compiled.
+            self._decompile()
+        if name in Quotation._tracked_attributes:
+            try:
+                version = self._version
+            except AttributeError:
+                # Being unpickled, or __init__() wasn't called
+                version = 0
+            object.__setattr__(self, '_version', version + 1)
+        object.__setattr__(self, name, value)
+
+    def __getattr__(self, name):
+        # Only called when the attribute hasn't been set, which is
+        # the case for .text and .note while they're compiled.
+        if ((name == 'text' or name == 'note') and
+            getattr(self, '_code', None) is not None):
+            self._decompile()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # The default would read every slot with getattr(), which
+        # would decompile .text and .note.
+        state = {}
+        for klass in type(self).__mro__:
+            for name in klass.__dict__.get('__slots__', ()):
+                if name == '_search_cache':
+                    continue
+                try:
+                    state[name] = object.__getattribute__(self, name)
+                except AttributeError:
+                    pass
+        return (None, state)
+
+    def invalidate(self):
+        "Record that the quotation's contents have been modified in place."
+        object.__setattr__(self, '_version', self._version + 1)
+
+    def compile(self):
+        """Store the paragraphs of .text and .note in compiled form.
+        Nothing is done if they contain anything that can't be
+        compiled; see qel.opcodes.compile_paragraph().
+        """
+        if self._code is not None:
+            return
+        try:
+            text = tuple(map(opcodes.compile_paragraph, self.text))
+            note = tuple(map(opcodes.compile_paragraph, self.note))
+        except TypeError:
+            return
+        self._set_code(text, note)
+
+    def _set_code(self, text, note):
+        """Replace .text and .note with the compiled paragraphs in the
+        tuples 'text' and 'note'.
+        """
+        if self._code is None:
+            object.__delattr__(self, 'text')
+            object.__delattr__(self, 'note')
+        object.__setattr__(self, '_code', (text, note))
+        object.__setattr__(self, '_version', self._version + 1)
+
+    def _decompile(self):
+        "Rebuild .text and .note from their compiled form."
+        text, note = self._code
+        object.__setattr__(self, '_code', None)
+        object.__setattr__(self, 'text',
+                           list(map(opcodes.decompile_paragraph, text)))
+        object.__setattr__(self, 'note',
+                           list(map(opcodes.decompile_paragraph, note)))
+
     def __len__(self):
         "Return the number of bytes in the text of this quotation"
+        if self._code is not None:
+            return sum(map(opcodes.length, self._code[0]))
         size = 0
         for p in self.text:
             for t in p:
@@ -249,29 +416,71 @@ class Quotation:
         attribution line.  If 'include_note' is true, any notes will
         also be formatted and returned as part of the string.
         """
+        return _as_string(self.write_text, include_date, include_note)
+
+    def as_rst(self):
+        """Convert instance into RestructuredText.
+        """
+        return _as_string(self.write_rst)
+
+    def as_wiki(self):
+        """Convert instance into Wiki markup.
+        """
+        return _as_string(self.write_wiki)
+
+    def as_fortune(self):
+        """Convert instance into plain text and append a '%' character
+        as required by the fortune(6) program, returning a string.
+        """
+        return _as_string(self.write_fortune)
+
+    def as_html(self):
+        """Convert instance into a straightforward HTML format.
+
+        This function's output can't be customized in any way.
+        If you want different formatting, implement it yourself,
+        either by using a Quotation instance or by applying some
+        XML-specific transformation to the QEL representation.
+        """
+        return _as_string(self.write_html)
+
+    def as_xml(self):
+        """Convert instance into QEL, pretty-printing it.
+        """
+        return _as_string(self.write_xml)
+
+    def as_jsonl(self):
+        """Convert instance into a single line of JSON, as used by
+        qel.jsonl.
+        """
+        return _as_string(self.write_jsonl)
+
+    def write_text(self, out, include_date=0, include_note=0):
+        "Write the quotation as plain text; see as_text()."
 
         # If there's more than one paragraph, each paragraph
         # will be indented by 4 spaces.  Single paragraphs
         # aren't indented at all.
-        if len(self.text) > 1: indent = 4 * " "
+        code = self._code
+        text = self.text if code is None else code[0]
+        if len(text) > 1: indent = 4 * " "
         else: indent = ""
 
-        output = ""
-        for i in range(len(self.text)):
-            paragraph = self.text[i]
-
+        for paragraph in text:
+            if code is not None:
+                opcodes.write_text(out, paragraph, indent)
+                continue
             start = 0
             for j in range(len(paragraph)):
                 t = paragraph[j]
                 if (t.is_break() or t.is_preformatted()):
-                    output += format_paragraph_as_text(paragraph[start:j],
-                                                       indent)
-                    output += t.as_text()
+                    write_paragraph_as_text(out, paragraph[start:j], indent)
+                    t.write_text(out)
                     if t.is_preformatted():
-                        output += '\n'
+                        out.write('\n')
                     start = j + 1
 
-            output += format_paragraph_as_text(paragraph[start:], indent)
+            write_paragraph_as_text(out, paragraph[start:], indent)
 
         para = ""
         for i in ['author', 'source']:
@@ -290,71 +499,73 @@ class Quotation:
 
         if para:
             para = "-- " + para
-            lines = textwrap.wrap(para, 75,
-                                  initial_indent = 6*' ',
-                                  subsequent_indent = 9*' ')
-            para = '\n'.join(lines) + '\n'
-            output += para
-
-        if include_note and self.note:
-            output += '\n'
-            for paragraph in self.note:
-                para = ""
+            lines = wrap.wrap(para, 75,
+                              initial_indent = 6*' ',
+                              subsequent_indent = 9*' ')
+            out.write('\n'.join(lines))
+            out.write('\n')
+
+        note = self.note if code is None else code[1]
+        if include_note and note:
+            out.write('\n')
+            for paragraph in note:
+                if code is not None:
+                    opcodes.write_note_text(out, paragraph)
+                    continue
+                buf = io.StringIO()
                 for t in paragraph:
-                    para += t.as_text()
-                lines = textwrap.wrap(para, 75)
-                output += '\n'.join(lines) + '\n'
+                    t.write_text(buf)
+                lines = wrap.wrap(buf.getvalue(), 75)
+                out.write('\n'.join(lines))
+                out.write('\n')
 
-        return output
+    def write_rst(self, out):
+        "Write the quotation as RestructuredText."
 
+        if self._code is not None:
+            for paragraph in self._code[0]:
+                opcodes.write_rst(out, paragraph)
+            return
 
-    def as_rst(self):
-        """Convert instance into RestructuredText.
-        """
-
-        output = ""
-        for i in range(len(self.text)):
-            paragraph = self.text[i]
-
+        for paragraph in self.text:
             start = 0
             for j in range(len(paragraph)):
                 t = paragraph[j]
                 if (t.is_break() or t.is_preformatted()):
-                    output += format_paragraph_as_text(paragraph[start:j],
-                                                       "",
-                                                       use_rst=True)
-                    output += t.as_rst()
+                    write_paragraph_as_text(out, paragraph[start:j], "",
+                                            use_rst=True)
+                    t.write_rst(out)
                     if t.is_preformatted():
-                        output += '\n'
+                        out.write('\n')
                     start = j + 1
 
-            output += format_paragraph_as_text(paragraph[start:], "",
-                                               use_rst=True)
-        return output
+            write_paragraph_as_text(out, paragraph[start:], "", use_rst=True)
 
+    def write_wiki(self, out):
+        "Write the quotation as Wiki markup."
 
-    def as_wiki(self):
-        """Convert instance into Wiki markup.
-        """
-
-        output = ""
-        for i in range(len(self.text)):
-            paragraph = self.text[i]
-
+        # The text is buffered because trailing whitespace is
+        # removed before the attribution.
+        buf = io.StringIO()
+        code = self._code
+        for paragraph in (self.text if code is None else code[0]):
+            if code is not None:
+                opcodes.write_wiki(buf, paragraph)
+                continue
             start = 0
             for j in range(len(paragraph)):
                 t = paragraph[j]
                 if (t.is_break() or t.is_preformatted()):
-                    output += format_paragraph_as_text(paragraph[start:j],
-                                                       "",
-                                                       use_wiki=True)
-                    output += t.as_rst()
+                    write_paragraph_as_text(buf, paragraph[start:j], "",
+                                            use_wiki=True)
+                    t.write_rst(buf)
                     if t.is_preformatted():
-                        output += '\n'
+                        buf.write('\n')
                     start = j + 1
 
-            output += '*' + format_paragraph_as_text(paragraph[start:], "",
-                                               use_wiki=True) + '\n'
+            buf.write('*')
+            write_paragraph_as_text(buf, paragraph[start:], "", use_wiki=True)
+            buf.write('\n')
 
         para = ""
         for i in ['author', 'source']:
@@ -370,49 +581,51 @@ class Quotation:
 
         if para:
             para = "**" + para
-            lines = textwrap.wrap(para, 75)
-            para = '\n'.join(lines) + '\n'
-            output = output.rstrip() + '\n' + para
-
-        return output
-
-
-    def as_fortune(self):
-        """Convert instance into plain text and append a '%' character
-        as required by the fortune(6) program, returning a string.
-        """
-        return self.as_text() + '%'
+            lines = wrap.wrap(para, 75)
+            out.write(buf.getvalue().rstrip())
+            out.write('\n')
+            out.write('\n'.join(lines))
+            out.write('\n')
+        else:
+            out.write(buf.getvalue())
 
-    def as_html(self):
-        """Convert instance into a straightforward HTML format.
+    def write_fortune(self, out):
+        "Write the quotation in fortune(6) format; see as_fortune()."
+        self.write_text(out)
+        out.write('%')
 
-        This function's output can't be customized in any way.
-        If you want different formatting, implement it yourself,
-        either by using a Quotation instance or by applying some
-        XML-specific transformation to the QEL representation.
-        """
+    def write_html(self, out):
+        "Write the quotation as HTML; see as_html()."
 
         id_attr = ""
         if self.id:
             id_attr = " id='%s'" % str(self.id)
-        output = "<div class='quotation'%s>\n" % id_attr
-        for paragraph in self.text:
-            output += "<p class='quotation'>"
-            for t in paragraph:
-                output += t.as_html()
-            output += "</p>\n"
+        out.write("<div class='quotation'%s>\n" % id_attr)
+        code = self._code
+        for paragraph in (self.text if code is None else code[0]):
+            out.write("<p class='quotation'>")
+            if code is not None:
+                opcodes.write_html(out, paragraph)
+            else:
+                for t in paragraph:
+                    t.write_html(out)
+            out.write("</p>\n")
 
         for i in ['author', 'source']:
             value = getattr(self, i)
             if value is not None:
-                output += value.as_html()
+                value.write_html(out)
 
-        output += '</div>\n'
-        return output
+        out.write('</div>\n')
+
+    def write_jsonl(self, out):
+        "Write the quotation as a line of JSON; see as_jsonl()."
+        from qel import jsonl
+        jsonl.write_quotation(out, self)
+
+    def write_xml(self, out):
+        "Write the quotation as pretty-printed QEL."
 
-    def as_xml(self):
-        """Convert instance into QEL, pretty-printing it.
-        """
         id = date = typ = ""
         if self.id is not None:
             id = ' id="%s"' % escape(self.id)
@@ -422,45 +635,78 @@ class Quotation:
             typ = ','.join(self.type)
             typ = ' type="%s"' % escape(typ)
 
-        output = "  <quotation%s%s%s>\n" % (id, date, typ)
-        for paragraph in self.text:
-            output += "    <p>\n"
-            output += format_paragraph_as_xml(paragraph, 6*' ')
-            output += "    </p>\n"
+        out.write("  <quotation%s%s%s>\n" % (id, date, typ))
+        code = self._code
+        if code is None:
+            write_paragraph = write_paragraph_as_xml
+            text, note = self.text, self.note
+        else:
+            write_paragraph = opcodes.write_xml
+            text, note = code
+        for paragraph in text:
+            out.write("    <p>\n")
+            write_paragraph(out, paragraph, 6*' ')
+            out.write("    </p>\n")
 
         for i in ['author', 'source']:
             value = getattr(self, i)
             if value is not None:
-                output += (6*' ') + value.as_xml() + '\n'
-
-
-        if self.note:
-            output += "    <note>\n"
-            for paragraph in self.note:
-                output += "      <p>\n"
-                output += format_paragraph_as_xml(paragraph, 8*' ')
-                output += "      </p>\n"
-            output += "    </note>\n"
-
-        output += "  </quotation>\n"
-        return output
-
-    def is_matching_regex(self, regex_pat):
-        """Return true if some of the text in 'quotation' matches
-        the compiled regex object 'pattern'."""
-
-        queue = self.text[:]
-        while len(queue):
-            obj = queue.pop(0)
-            if isinstance(obj, list):
-                queue = obj + queue
-            elif isinstance(obj, Text):
-                if regex_pat.search(obj.text):
-                    return True
-            else:
-                queue += list(obj.children)
-
-        return False
+                out.write(6*' ')
+                value.write_xml(out)
+                out.write('\n')
+
+        if note:
+            out.write("    <note>\n")
+            for paragraph in note:
+                out.write("      <p>\n")
+                write_paragraph(out, paragraph, 8*' ')
+                out.write("      </p>\n")
+            out.write("    </note>\n")
+
+        out.write("  </quotation>\n")
+
+    def search_text(self, include_all=False):
+        """Return the text of the quotation as a single string without
+        any markup, with a newline between paragraphs.  If 'include_all'
+        is true, the author, source and notes follow the text, each
+        on a new line.
+
+        The string is cached until ._version changes, so modifying the
+        quotation in place requires calling invalidate().
+        """
+        try:
+            cache = self._search_cache
+        except AttributeError:
+            cache = None
+        if cache is None or cache[0] != self._version:
+            code = self._code
+            text = '\n'.join(map(_paragraph_text,
+                                 self.text if code is None else code[0]))
+            # Loading a LazyQuotation changes its version.
+            cache = [self._version, text, None]
+            object.__setattr__(self, '_search_cache', cache)
+        if not include_all:
+            return cache[1]
+
+        if cache[2] is None:
+            parts = [cache[1]]
+            for attr in (self.author, self.source):
+                if attr is not None:
+                    parts.append(_paragraph_text(attr.text))
+            code = self._code
+            parts.extend(map(_paragraph_text,
+                             self.note if code is None else code[1]))
+            cache[2] = '\n'.join(parts)
+        return cache[2]
+
+    def is_matching_regex(self, regex_pat, include_all=False):
+        """Return true if the text of the quotation, as returned by
+        search_text(), matches the compiled regex object 'regex_pat'.
+        Matches can span markup, and paragraphs are separated by
+        newlines.  If 'include_all' is true, the author, source and
+        notes are searched too.
+        """
+        return regex_pat.search(self.search_text(include_all)) is not None
 
 
 # Text and Markup and its subclasses are used to hold chunks of text;
@@ -469,6 +715,8 @@ class Quotation:
 class Text:
     """A chunk of plain text."""
 
+    __slots__ = ('text',)
+
     def __init__(self, text=""):
         self.text = text
 
@@ -494,6 +742,16 @@ class Text:
     def as_xml (self):
         return escape(self.text)
 
+    def write_text (self, out):
+        out.write(self.text)
+
+    write_rst = write_wiki = write_text
+
+    def write_html (self, out):
+        out.write(escape(self.text))
+
+    write_xml = write_html
+
     def is_break(self):        return 0
     def is_plain(self):        return 1
     def is_preformatted(self): return 0
@@ -521,6 +779,8 @@ class Markup (object):
         List of children making up this chunk of text.
     """
 
+    __slots__ = ('children',)
+
     text_char = ""
     wiki_delim = ""
     xml_tag = html_tag = ""
@@ -545,74 +805,94 @@ class Markup (object):
         return '<%s: %s>' % (self.__class__.__name__, s)
 
     def as_text (self):
-        text = ""
-        for t in self.children:
-            text += t.as_text()
-        return self.text_char + text + self.text_char
+        return _as_string(self.write_text)
 
     def as_rst (self):
-        text = ""
-        for t in self.children:
-            text += t.as_rst()
-        text = '`%s`' % text
-        if self.xml_tag:
-            text = ':%s:%s' % (self.xml_tag, text)
-        return text
+        return _as_string(self.write_rst)
 
     def as_wiki (self):
-        text = ""
-        for t in self.children:
-            text += t.as_wiki()
-        if text:
-            if isinstance(self.wiki_delim, tuple):
-                start, end = self.wiki_delim
-            else:
-                start = end = self.wiki_delim
-            text = '%s%s%s' % (start, text, end)
-        return text
+        return _as_string(self.write_wiki)
 
     def as_html (self):
-        text = ""
+        return _as_string(self.write_html)
+
+    def as_xml (self):
+        return _as_string(self.write_xml)
+
+    def write_text (self, out):
+        out.write(self.text_char)
         for t in self.children:
-            text += t.as_html()
+            t.write_text(out)
+        out.write(self.text_char)
 
-        if self.html_tag:
-            text = "<%s>%s</%s>" % (self.html_tag, text, self.html_tag)
-        return text
+    def write_rst (self, out):
+        if self.xml_tag:
+            out.write(':%s:' % self.xml_tag)
+        out.write('`')
+        for t in self.children:
+            t.write_rst(out)
+        out.write('`')
+
+    def write_wiki (self, out):
+        if not len(self):
+            # Empty elements produce no output at all.
+            return
+        if isinstance(self.wiki_delim, tuple):
+            start, end = self.wiki_delim
+        else:
+            start = end = self.wiki_delim
+        out.write(start)
+        for t in self.children:
+            t.write_wiki(out)
+        out.write(end)
 
-    def as_xml (self):
+    def write_html (self, out):
+        if self.html_tag:
+            out.write("<%s>" % self.html_tag)
         for t in self.children:
-            text = t.as_xml()
+            t.write_html(out)
+        if self.html_tag:
+            out.write("</%s>" % self.html_tag)
 
+    def write_xml (self, out):
         if self.xml_tag:
-            text = "<%s>%s</%s>" % (self.xml_tag, text, self.xml_tag)
-        return text
+            out.write("<%s>" % self.xml_tag)
+        for t in self.children:
+            t.write_xml(out)
+        if self.xml_tag:
+            out.write("</%s>" % self.xml_tag)
 
     def is_break(self):        return 0
     def is_plain(self):        return 1
     def is_preformatted(self): return 0
 
     def startswith (self, S):
-        return self.children[0].startswith(S)
+        return bool(self.children) and self.children[0].startswith(S)
     def endswith (self, S):
-        return self.children[-1].endswith(S)
+        return bool(self.children) and self.children[-1].endswith(S)
     def lstrip (self):
-        c2 = [ self.children[0].lstrip() ] + self.children[1:]
+        c2 = list(self.children)
+        if c2:
+            c2[0] = c2[0].lstrip()
         inst = self.__class__()
         inst.children = c2
         return inst
     def rstrip (self):
-        c2 = self.children[:-1] + [ self.children[-1].rstrip() ]
+        c2 = list(self.children)
+        if c2:
+            c2[-1] = c2[-1].rstrip()
         inst = self.__class__()
         inst.children = c2
         return inst
 
 class Abbreviation (Markup):
+    __slots__ = ()
     text_char = ""
     wiki_delim = ""
     xml_tag = html_tag  = "abbr"
 
 class Acronym (Markup):
+    __slots__ = ()
     text_char = ""
     wiki_delim = ""
     xml_tag = html_tag = "acronym"
@@ -620,6 +900,7 @@ class Acronym (Markup):
 class CitedText (Markup):
     "Text inside <cite>...</cite>"
 
+    __slots__ = ()
     text_char = "_"
     wiki_delim = ("''", "''")
     xml_tag = html_tag  = "cite"
@@ -629,22 +910,25 @@ class CitedText (Markup):
 class CodeFormattedText (Markup):
     "Text inside <code>...</code>"
 
+    __slots__ = ()
     text_char = ""
     wiki_delim = ("<nowiki>", "</nowiki>")
     xml_tag = html_tag  = "code"
 
 class EmphasizedText (Markup):
     "Text inside <em>...</em>"
+    __slots__ = ()
     text_char = "*"
     wiki_delim = "''"
     xml_tag = html_tag  = "em"
 
     def is_plain(self):        return 0
-    as_rst = Markup.as_text
+    write_rst = Markup.write_text
 
 class ForeignText (Markup):
     "Foreign words, from Latin or French or whatever."
 
+    __slots__ = ()
     text_char = "_"
     wiki_delim = ("<i>", "</i>")
     html_tag  = "i"
@@ -655,25 +939,25 @@ class ForeignText (Markup):
 class PreformattedText (Markup):
     "Text inside <pre>...</pre>"
 
+    __slots__ = ()
     text_char = ""
     xml_tag = html_tag  = "pre"
     wiki_delim = ("<nowiki>", "</nowiki>")
 
     def is_preformatted(self): return 1
 
-    def as_text (self):
-        text = super(PreformattedText, self).as_text()
-        text = text.strip()
-        return text
+    def write_text (self, out):
+        text = _as_string(super(PreformattedText, self).write_text)
+        out.write(text.strip())
 
-    def as_rst (self):
-        text = super(PreformattedText, self).as_text()
+    def write_rst (self, out):
+        text = _as_string(super(PreformattedText, self).write_text)
         text = text.strip()
-        text = '\n\n::\n'+ text.replace('\n', '\n    ') + '\n\n'
-        return text
+        out.write('\n\n::\n'+ text.replace('\n', '\n    ') + '\n\n')
 
 
 class QuotedText (Markup):
+    __slots__ = ()
     text_char = '"'
     wiki_delim = '"'
     xml_tag = html_tag = 'q'
@@ -682,9 +966,27 @@ class QuotedText (Markup):
 
 
 class Break (Markup):
+    """A line break.  Breaks have no contents, so a single instance
+    is shared: Break() always returns the same object.
+    """
+
+    __slots__ = ()
+    _instance = None
+
     text = ""
     children = ()
 
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Break, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def __reduce__(self):
+        return (Break, ())
+
     def __repr__(self):
         return '<%s>' % (self.__class__.__name__)
 
@@ -695,6 +997,18 @@ class Break (Markup):
     def as_xml(self):
         return "<br />"
 
+    def write_text(self, out): pass
+    write_rst = write_wiki = write_text
+
+    def lstrip(self): return self
+    rstrip = lstrip
+
+    def write_html(self, out): out.write("<br />")
+    write_xml = write_html
+
     def is_break(self):        return 1
     def is_plain(self):        return 0
     def is_preformatted(self): return 0
+
+# qel.opcodes refers to the classes defined above.
+from qel import opcodes
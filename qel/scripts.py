@@ -2,43 +2,195 @@
 qel.scripts -- Entry points for the quotation-tools scripts
 """
 
-import os, re, time
-from . import quotation
+import os, re, time, itertools, tempfile, contextlib
+from . import parse, quotation
 
 class DuplicateIDException(Exception):
     pass
 
-def merge(*collections, strict=True, generate=False):
-    """Merge two collections into a single collection.
+def iter_files(files, cache=None):
+    """Parse each of 'files' in turn, without reading them into memory.
 
-    If 'strict' is true, a DuplicateIDException will be raised.
-    If it's false, the second occurrence of the ID will be given
-    a new ID.
+    'files' is a list of filenames or file objects such as sys.stdin.
+    For each file, a (file, header, quotations) tuple is produced;
+    'header' is a Collection holding the file's title, editor, etc.,
+    and 'quotations' is an iterator over the file's Quotation instances.
+    Files opened by this function are closed before moving on to
+    the next file, so 'quotations' must be consumed before then.
 
-    If 'generate' is true, quotations without an ID will be assigned one.
+    If 'cache' is a qel.cache.ParseCache instance, named files are
+    loaded through the cache instead; 'header' is then the complete
+    collection.
+
+    Named files ending in '.jsonl' are read as JSON Lines with
+    qel.jsonl, and are never cached.
+    """
+    for file in files:
+        if isinstance(file, str) and file.endswith('.jsonl'):
+            from . import jsonl
+            with open(file, 'rb') as stream:
+                items = jsonl.iterload(stream)
+                yield file, next(items), items
+        elif isinstance(file, str) and cache is not None:
+            coll = cache.parse(file)
+            yield file, coll, iter(coll)
+        elif isinstance(file, str):
+            with open(file, 'r') as stream:
+                items = parse.iterparse(stream)
+                yield file, next(items), items
+        else:
+            items = parse.iterparse(file)
+            yield file, next(items), items
+
+
+def iter_matches(files, pattern, cache=None, use_index=False, jobs=1,
+                 max_count=0):
+    """Search each of 'files' for quotations matching the compiled
+    regular expression 'pattern', as Quotation.is_matching_regex()
+    does.  For each file, a (file, matches) tuple is produced, where
+    'matches' is an iterator over the matching quotations; as for
+    iter_files(), it must be consumed before moving on to the next file.
+
+    Named QEL files are read with qel.search.iter_matching(), which
+    only parses quotations containing the text the pattern requires.
+    If 'use_index' is true, they're searched with a
+    qel.index.SearchIndex instead, which is built first if it doesn't
+    exist or is out of date.
+
+    If 'jobs' is greater than 1, named files are searched in that many
+    worker processes, and each file's matches are returned as a whole;
+    the files are still produced in their original order.
+
+    If 'max_count' isn't 0, at most that many matches are produced for
+    each file, and the rest of the file isn't parsed.
+    """
+    if jobs > 1:
+        for file, matches in _iter_searches(files, pattern, cache, use_index,
+                                            False, jobs, max_count):
+            yield file, iter(matches)
+        return
+
+    for file in files:
+        if use_index and isinstance(file, str) and not file.endswith('.jsonl'):
+            from .index import SearchIndex
+            with SearchIndex.open(file) as index:
+                matches = index.search(pattern)
+                if max_count:
+                    matches = itertools.islice(matches, max_count)
+                yield file, matches
+            continue
+        if (cache is None and isinstance(file, str) and
+            not file.endswith('.jsonl')):
+            from .search import iter_matching
+            matches = iter_matching(file, pattern)
+            if max_count:
+                matches = itertools.islice(matches, max_count)
+            yield file, matches
+            continue
+        for file, header, items in iter_files([file], cache):
+            matches = (qt for qt in items if qt.is_matching_regex(pattern))
+            if max_count:
+                matches = itertools.islice(matches, max_count)
+            yield file, matches
+
+def count_matches(files, pattern, cache=None, use_index=False, jobs=1,
+                  max_count=0):
+    """Count the quotations matching 'pattern' in each of 'files',
+    producing a (file, count) tuple for each file in turn.  The
+    arguments are as for iter_matches(); if 'max_count' isn't 0,
+    counting stops when it's reached.
+    """
+    if jobs > 1:
+        yield from _iter_searches(files, pattern, cache, use_index,
+                                  True, jobs, max_count)
+        return
+    for file, matches in iter_matches(files, pattern, cache, use_index,
+                                      max_count=max_count):
+        yield file, sum(1 for qt in matches)
+
+def search_file(file, pattern, cache=None, use_index=False, count=False,
+                max_count=0):
+    """Search the single file 'file', returning a list of the matching
+    quotations, or their number if 'count' is true.  The other
+    arguments are as for iter_matches().  This is the function run by
+    the worker processes of iter_matches() and count_matches().
+    """
+    if count:
+        for file, n in count_matches([file], pattern, cache, use_index,
+                                     max_count=max_count):
+            return n
+    for file, matches in iter_matches([file], pattern, cache, use_index,
+                                      max_count=max_count):
+        return list(matches)
+
+def _iter_searches(files, pattern, cache, use_index, count, jobs, max_count):
+    """Call search_file() on each of 'files' in 'jobs' worker processes,
+    producing a (file, result) tuple for each file in order.  Files
+    that aren't named, such as sys.stdin, are searched in this process
+    when their turn comes.
+    """
+    import concurrent.futures, collections
+
+    files = iter(files)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        pending = collections.deque()
+        while 1:
+            # Keep every worker busy, with one file waiting for each,
+            # so that the results of only a few files are held at once.
+            while len(pending) < 2 * jobs:
+                file = next(files, None)
+                if file is None:
+                    break
+                if isinstance(file, str):
+                    future = executor.submit(search_file, file, pattern,
+                                             cache, use_index, count,
+                                             max_count)
+                else:
+                    future = None
+                pending.append((file, future))
+            if not pending:
+                break
+            file, future = pending.popleft()
+            if future is None:
+                yield file, search_file(file, pattern, cache, use_index,
+                                        count, max_count)
+            else:
+                yield file, future.result()
+
+
+_id_pat = re.compile(r'q\d+$')
+
+def next_free_id(*collections):
+    """Return the number to use for the next generated ID.
+
+    Generated IDs are of the form 'qNNNN'; the number returned is one
+    larger than the largest such ID found in 'collections', which can
+    be any iterables of quotations.
     """
-    # Determine the maximum ID in the file of the form 'qNNNN'.
     # We ignore any collisions here.
-    id_pat = re.compile('q\d+$')
-    existing_ids = set(qt.id
-                       for qtcoll in collections
-                       for qt in qtcoll
-                       if (qt.id is not None and
-                           id_pat.match(qt.id))
-                       )
-    if existing_ids:
-        new_id = 1 + max(int(id[1:]) for id in existing_ids)
-    else:
-        new_id = 1
-    del existing_ids
+    new_id = 0
+    for qtcoll in collections:
+        for qt in qtcoll:
+            if qt.id is not None and _id_pat.match(qt.id):
+                new_id = max(new_id, int(qt.id[1:]))
+    return new_id + 1
 
-    # Loop over all of the collections
-    newcoll = quotation.Collection()
+
+def iter_merge(*collections, strict=True, generate=False, first_id=None):
+    """Merge collections, returning an iterator over the quotations.
+
+    This is the streaming version of merge(), taking the same
+    arguments.  'first_id' is the number to use for the first generated
+    ID; if it's None, it's computed with next_free_id(), which
+    requires that the collections can be iterated over twice.
+    """
+    if first_id is None:
+        first_id = next_free_id(*collections)
+    new_id = first_id
     ids = set()
 
     for coll in collections:
         for qt in coll:
-            newcoll.append(qt)
             if qt.id is None:
                 if generate:
                     qt.id = 'q' + str(new_id)
@@ -57,71 +209,193 @@ def merge(*collections, strict=True, generate=False):
 
             if qt.id is not None:
                 ids.add(qt.id)
+            yield qt
+
+
+def merge(*collections, strict=True, generate=False):
+    """Merge two collections into a single collection.
 
+    If 'strict' is true, a DuplicateIDException will be raised.
+    If it's false, the second occurrence of the ID will be given
+    a new ID.
+
+    If 'generate' is true, quotations without an ID will be assigned one.
+    """
+    newcoll = quotation.Collection()
+    newcoll.extend(iter_merge(*collections, strict=strict, generate=generate))
     return newcoll
 
 
-def _divide_into_columns(qtcoll):
-    # Group the quotations into a set of columns of roughly equal length.
-    # We'll count the number of characters in the HTML as an estimator of
-    # its length.
-    quote_list = [qt.as_html() for qt in qtcoll]
-    quote_list = [(len(html), html) for html in quote_list]
+def render_chunk(quotations, method, maxlength=0):
+    """Render each of 'quotations' by calling the method named 'method',
+    returning a list of the outputs.  Quotations whose output has more
+    than 'maxlength' lines are left out, unless 'maxlength' is 0.
+    This is the function run by the worker processes of iter_rendered().
+    """
+    output = []
+    for qt in quotations:
+        text = getattr(qt, method)()
+        if maxlength == 0 or text.count('\n') <= maxlength:
+            output.append(text)
+    return output
 
-    # Figure out the total size; we'll try to have 5K of material per column.
-    total_size = sum(size for (size, html) in quote_list)
-    target_column_size = 5 * 1024 # Size of 10K
+def iter_rendered(quotations, method, maxlength=0, jobs=1, chunksize=256):
+    """Render the quotations from the iterable 'quotations' in 'jobs'
+    worker processes, producing the outputs in the original order.
+    'method' and 'maxlength' are as for render_chunk().
 
-    # Divide the quotes up into lists of columns.
-    current_size = 0
-    column_list = [ [] ]
-    for size, html in quote_list:
-        column_list[-1].append(html)
-        current_size += size
-        if current_size > target_column_size:
-            current_size = 0
-            column_list.append( [] )
+    The quotations are sent to the workers in chunks of 'chunksize',
+    and only a few chunks per worker are in progress at a time, so
+    'quotations' is consumed gradually.
+    """
+    import concurrent.futures, collections
 
-    # If last column is empty, remove it.
-    if len(column_list[-1]) == 0:
-        del column_list[-1]
+    quotations = iter(quotations)
+    if jobs <= 1:
+        while 1:
+            chunk = list(itertools.islice(quotations, chunksize))
+            if not chunk:
+                break
+            yield from render_chunk(chunk, method, maxlength)
+        return
 
-    # Ensure there is always an even number of column lists.
-    if (len(column_list) % 2) == 1:
-        column_list.append([])
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        pending = collections.deque()
+        while 1:
+            # Keep every worker busy, with one chunk waiting for each.
+            while len(pending) < 2 * jobs:
+                chunk = list(itertools.islice(quotations, chunksize))
+                if not chunk:
+                    break
+                pending.append(executor.submit(render_chunk, chunk,
+                                               method, maxlength))
+            if not pending:
+                break
+            yield from pending.popleft().result()
 
-    return column_list
 
-def write_html_dir(dir, qtcoll, title):
-    """Export a quotation file as a set of HTML pages, using a fancy template.
+def _iter_pages(htmls, column_size=5*1024):
+    """Group the HTML strings from the iterable 'htmls' into columns of
+    roughly 'column_size' characters, and the columns into pages of two.
+    Produces a (col1, col2, is_last) tuple as soon as each page is
+    complete; col2 may be empty on the last page.
     """
-    from qel.data import HTML_TEMPLATE
+    # The length of the HTML is used as an estimate of its height.
+    # A full page is held back until more HTML arrives, because
+    # otherwise it isn't known whether it's the last one.
+    full = []
+    column = []
+    size = 0
+    for html in htmls:
+        if len(full) == 2:
+            yield full[0], full[1], False
+            full = []
+        column.append(html)
+        size += len(html)
+        if size > column_size:
+            full.append(column)
+            column = []
+            size = 0
 
-    column_list = _divide_into_columns(qtcoll)
+    if column:
+        full.append(column)
+    if full:
+        if len(full) == 1:
+            full.append([])
+        yield full[0], full[1], True
 
-    page_num = 1
-    while len(column_list):
-        if page_num == 1:
-            fn = 'index.html'
-        else:
-            fn = '{}.html'.format(page_num)
-        path = os.path.join(dir, fn)
+def _new_file_mode():
+    "Return the permissions that open() gives new files under the umask."
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def _write_if_changed(path, data, mode=0o644):
+    """Write the bytes 'data' to the file 'path', unless it already
+    contains them; the file is replaced atomically, and given the
+    permissions 'mode' if it didn't exist.  Returns true if the file
+    was written.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        pass
+    else:
+        mode = st.st_mode & 0o7777
+        if st.st_size == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_path)
+        raise
+    return True
 
-        col1 = column_list.pop(0)
-        col2 = column_list.pop(0)
+def write_html_dir(dir, quotations, title, renders=None, jobs=1,
+                   template=None):
+    """Export quotations as a set of HTML pages, using a fancy template.
 
-        last_attr = ('data-last=""' if len(column_list) == 0 else '')
+    'quotations' can be any iterable; the quotations are rendered and
+    divided into pages as they're read, and each page is written as
+    soon as it's complete.  Pages whose contents haven't changed
+    aren't rewritten, so their modification times are preserved.
+    Returns a (pages, written) tuple counting the pages generated
+    and the files that were actually written.
 
-        page = HTML_TEMPLATE.format(page_num=page_num,
-                                    last_attr=last_attr,
-                                    title=title,
-                                    col1='\n'.join(col1),
-                                    col2='\n'.join(col2),
-                                )
+    If 'jobs' is greater than 1, the quotations are rendered in that
+    many worker processes and the pages are written by a pool of
+    threads.  Otherwise, if 'renders' is a qel.cache.RenderCache, the
+    HTML for each quotation is taken from it.
+
+    'template' is a string for str.format() with the fields page_num,
+    last_attr, title, col1 and col2; qel.data.HTML_TEMPLATE is used
+    if it's not given.
+    """
+    import concurrent.futures
 
-        with open(path, 'wt', encoding='latin-1') as f:
-            f.write(page)
+    if template is None:
+        from qel.data import HTML_TEMPLATE as template
 
-        page_num += 1
+    if jobs <= 1 and renders is not None:
+        htmls = (renders.render(qt, 'as_html') for qt in quotations)
+    else:
+        htmls = iter_rendered(quotations, 'as_html', jobs=jobs)
+
+    # The umask is read before any threads are started.
+    mode = _new_file_mode()
+    pages = written = 0
+    with concurrent.futures.ThreadPoolExecutor(max(jobs, 1)) as executor:
+        pending = []
+        for col1, col2, is_last in _iter_pages(htmls):
+            pages += 1
+            if pages == 1:
+                fn = 'index.html'
+            else:
+                fn = '{}.html'.format(pages)
+            page = template.format(page_num=pages,
+                                   last_attr=('data-last=""' if is_last
+                                              else ''),
+                                   title=title,
+                                   col1='\n'.join(col1),
+                                   col2='\n'.join(col2),
+                                   )
+            data = page.encode('latin-1', 'xmlcharrefreplace')
+            pending.append(executor.submit(_write_if_changed,
+                                           os.path.join(dir, fn), data, mode))
+            # Don't let finished pages pile up in memory.
+            while len(pending) > 2 * jobs or (pending and
+                                              pending[0].done()):
+                written += pending.pop(0).result()
+        for future in pending:
+            written += future.result()
 
-    print(page_num-1, 'pages written')
+    print(pages, 'pages generated,', written, 'written')
+    return pages, written
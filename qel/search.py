@@ -0,0 +1,224 @@
+"""
+qel.search -- Skipping quotations that can't match before parsing them.
+
+Most search patterns contain some literal text, and most quotations
+don't contain it.  A Prefilter finds the strings that every match
+must contain, using qel.index.required_literals(), and looks for them
+in the raw XML of a quotation.  Quotations without them can't match,
+so they don't have to be parsed:
+
+    prefilter = Prefilter(pattern)
+    if prefilter.may_match(xml):
+        qt = parse.parse_fragment(prolog, xml)[0]
+        ...
+
+iter_matching() does this for every quotation in a file.
+
+The XML is compared after removing its tags and folding it with
+qel.index.fold(), so the check is correct for case-insensitive
+patterns and for matches that span markup.  Whitespace is removed
+from the text and literals are split at whitespace, because the parser
+normalizes it and drops it next to markup; literals are also split at
+characters that can be written as entities.  Quotations containing entities
+other than the predefined ones, or CDATA sections, are always parsed.
+"""
+
+import re, mmap, itertools
+
+from qel import index, parse
+
+__all__ = ['Prefilter', 'iter_matching']
+
+# Characters that may be written differently in the XML than in
+# the text, or not at all
+_separator_re = re.compile(r'''[\s&<>"']+''')
+
+# Attribute values may contain '>', so quoted strings are skipped;
+# quotes in comments and processing instructions aren't special.
+_markup_re = re.compile(rb'<!--.*?-->|<\?.*?\?>|'
+                        rb'<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>', re.DOTALL)
+
+# Comments and CDATA sections can hide tags from scan_quotations().
+_hidden_re = re.compile(rb'<!--|<!\[CDATA\[')
+
+# Entities other than the predefined ones can stand for any text.
+_unusual_xml_re = re.compile(rb'&(?!amp;|lt;|gt;|quot;|apos;|#)|<!\[CDATA\[')
+
+def _charref(m):
+    "Return the character for a match of qel.parse._charref_re."
+    ref = m.group(1)
+    return chr(int(ref[1:], 16) if ref[0] == 'x' else int(ref))
+
+def _encoding(prolog):
+    "Return the encoding declared in 'prolog', or 'UTF-8'."
+    m = parse._encoding_re.match(prolog)
+    return m.group(1).decode('ascii') if m else 'UTF-8'
+
+
+class Prefilter:
+    """Decides whether the raw XML of a quotation could match a pattern.
+
+    Instance attributes:
+      .clauses : [ [ [str] ] ]
+        For each clause returned by required_literals(), a list of
+        alternatives; each alternative is a list of the pieces of a
+        literal, all of which must be present in the folded text.
+      .active : bool
+        False if the pattern doesn't require any text, or the encoding
+        isn't compatible with ASCII, in which case may_match() always
+        returns true.
+    """
+
+    def __init__ (self, pattern, encoding='UTF-8'):
+        self.encoding = encoding
+        self.clauses = []
+        for clause in index.required_literals(pattern):
+            alternatives = []
+            for literal in clause:
+                pieces = [s for s in _separator_re.split(literal) if s]
+                if not pieces:
+                    break
+                alternatives.append(pieces)
+            else:
+                self.clauses.append(alternatives)
+
+        # The same clauses as bytes, for XML that's entirely ASCII.
+        # Alternatives with other characters can't be present in it.
+        self._ascii_clauses = []
+        for clause in self.clauses:
+            self._ascii_clauses.append(
+                [[s.encode('ascii') for s in pieces]
+                 for pieces in clause
+                 if all(s.isascii() for s in pieces)])
+
+        try:
+            ascii_compatible = 'a<'.encode(encoding) == b'a<'
+        except LookupError:
+            ascii_compatible = False
+        self.active = bool(self.clauses) and ascii_compatible
+
+    def may_match (self, xml):
+        """Return false if the quotation whose XML is the bytes 'xml'
+        can't possibly match the pattern; true means that it has to be
+        parsed and checked.
+        """
+        if not self.active or _unusual_xml_re.search(xml):
+            return True
+        # The parser drops whitespace at the edges of markup, so
+        # text on either side of it may end up adjacent.  The pieces
+        # never contain whitespace, so it's all removed.
+        text = _markup_re.sub(b'', xml)
+        if text.isascii() and b'&#' not in text:
+            text = b''.join(text.lower().split())
+            clauses = self._ascii_clauses
+        else:
+            text = text.decode(self.encoding, 'replace')
+            if '&#' in text:
+                try:
+                    text = parse._charref_re.sub(_charref, text)
+                except (ValueError, OverflowError):
+                    return True
+            text = ''.join(index.fold(text).split())
+            clauses = self.clauses
+        for clause in clauses:
+            for pieces in clause:
+                for s in pieces:
+                    if s not in text:
+                        break
+                else:
+                    break
+            else:
+                return False
+        return True
+
+
+def iter_matching(path, pattern):
+    """Produce the quotations in the QEL file 'path' that match the
+    compiled regular expression 'pattern', as Quotation.is_matching_regex()
+    does.  Only the quotations accepted by a Prefilter are parsed.  The
+    file is mapped into memory and scanned as the quotations are
+    needed, so stopping early avoids reading the rest of it.
+
+    Errors in the quotations that are skipped aren't detected.  From
+    the first comment or CDATA section on, which could hide tags from
+    qel.parse.scan_quotations(), the file is parsed completely; so is
+    a file that doesn't end with the </quotations> tag, so that the
+    parser reports the error.
+    """
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            data = None
+        if data is None:
+            items = parse.iterparse(f)
+            next(items)
+            yield from _matching(items, pattern)
+            return
+        try:
+            yield from _iter_mapped(data, pattern)
+        finally:
+            data.close()
+
+def _iter_mapped(data, pattern):
+    "Implementation of iter_matching() for the mapped file 'data'."
+    prolog, spans = parse.iterscan_quotations(data)
+    end = data.rfind(b'</quotations>')
+    if (prolog is None or _hidden_re.search(prolog) or end == -1 or
+        data[end + len(b'</quotations>'):].strip()):
+        items = parse._iterparse_chunks(_mapped_chunks(data, 0))
+        next(items)
+        yield from _matching(items, pattern)
+        return
+
+    prefilter = Prefilter(pattern, _encoding(prolog))
+    # Candidates are parsed in batches, which start small so that the
+    # first matches are found quickly.
+    batch = []
+    batch_size = 1
+    pos = len(prolog)
+    try:
+        for start, end in spans:
+            if _hidden_re.search(data, pos, end):
+                break
+            xml = data[start:end]
+            if prefilter.may_match(xml):
+                batch.append(xml)
+                if len(batch) >= batch_size:
+                    yield from _check(prolog, batch, pattern)
+                    batch = []
+                    batch_size = min(2 * batch_size, 256)
+            pos = end
+        else:
+            if batch:
+                yield from _check(prolog, batch, pattern)
+            return
+    finally:
+        # The scanner holds a buffer on 'data', which has to be
+        # released before the file can be closed.
+        spans.close()
+
+    # The rest of the file is parsed, starting after the last
+    # quotation that was checked.
+    if batch:
+        yield from _check(prolog, batch, pattern)
+    items = parse._iterparse_chunks(
+        itertools.chain([prolog], _mapped_chunks(data, pos)))
+    next(items)
+    yield from _matching(items, pattern)
+
+def _mapped_chunks(data, pos, size=2**16):
+    "Produce the contents of the mmap 'data' from offset 'pos' on."
+    for i in range(pos, len(data), size):
+        yield data[i:i + size]
+
+def _matching(items, pattern):
+    for qt in items:
+        if qt.is_matching_regex(pattern):
+            yield qt
+
+def _check(prolog, batch, pattern):
+    "Parse the quotations in 'batch', a list of XML, and produce the matches."
+    yield from _matching(parse.parse_fragment(prolog, b''.join(batch)),
+                         pattern)
@@ -0,0 +1,132 @@
+"""
+qel.strfile -- Writing fortune(6) files along with their strfile indexes.
+
+fortune(6) picks a random quotation using a .dat file built by
+strfile(8), which holds the byte offset of each string in the
+text file.  This module computes the offsets while the text is being
+written, so a fortune database can be produced in a single pass:
+
+    with open('quotes', 'wb') as f, open('quotes.dat', 'wb') as dat:
+        strfile.write_fortunes(f, (qt.as_fortune() for qt in coll), dat)
+
+The .dat file matches the output of 'strfile quotes' without any
+options: a header of six 32-bit big-endian fields (version, number of
+strings, longest and shortest length, flags, and the delimiter
+character followed by padding) and then the offsets.
+"""
+
+import struct
+
+__all__ = ['VERSION', 'STR_RANDOM', 'STR_ORDERED', 'STR_ROTATED',
+           'Index', 'write_fortunes', 'read_index']
+
+VERSION = 2
+
+# Flags in the header; write_fortunes() never sets any of them.
+STR_RANDOM = 0x1
+STR_ORDERED = 0x2
+STR_ROTATED = 0x4
+
+_header = struct.Struct('>5Ic3x')
+
+class Index:
+    """The strfile index of a text file being written.
+
+    add() must be called with every chunk of bytes written to the text
+    file, in order; each chunk must end with a newline.  Strings are
+    separated by lines consisting only of the delimiter character, and
+    as in strfile, empty strings are left out of the index.
+    """
+    __slots__ = ('delim', 'offsets', 'longlen', 'shortlen', '_pos', '_start',
+                 '_delim_line')
+
+    def __init__ (self, delim='%'):
+        self.delim = delim
+        self.offsets = [0]
+        self.longlen = 0
+        self.shortlen = None
+        # _pos is the size of the text written so far, and _start the
+        # offset where the current string begins.
+        self._pos = self._start = 0
+        self._delim_line = b'\n' + delim.encode('ascii') + b'\n'
+
+    def add (self, data):
+        "Record the bytes 'data', which have been written to the text file."
+        pos = self._pos
+        delim_line = self._delim_line
+        # Look for delimiter lines; the first line of 'data' starts
+        # right after a newline, since every chunk ends with one.
+        i = 0
+        if data.startswith(delim_line[1:]):
+            self._end_string(pos, pos + len(delim_line) - 1)
+            i = len(delim_line) - 2
+        while True:
+            i = data.find(delim_line, i)
+            if i == -1:
+                break
+            self._end_string(pos + i + 1, pos + i + len(delim_line))
+            i += len(delim_line) - 1
+        self._pos = pos + len(data)
+
+    def _end_string (self, end, next_start):
+        """Record a string that ends at offset 'end', where a delimiter
+        line begins.  The next string starts at 'next_start'.
+        """
+        length = end - self._start
+        self._start = next_start
+        if length == 0:
+            return
+        self.offsets.append(next_start)
+        if length > self.longlen:
+            self.longlen = length
+        if self.shortlen is None or length < self.shortlen:
+            self.shortlen = length
+
+    def finish (self):
+        """Record the end of the text file, which ends the last string
+        if it isn't followed by a delimiter line.
+        """
+        self._end_string(self._pos, self._pos)
+
+    def __len__ (self):
+        "Return the number of strings."
+        return len(self.offsets) - 1
+
+    def write (self, fp):
+        "Write the index to the binary file 'fp' in strfile's format."
+        shortlen = self.shortlen
+        if shortlen is None:
+            shortlen = 0xffffffff
+        fp.write(_header.pack(VERSION, len(self), self.longlen, shortlen,
+                              0, self.delim.encode('ascii')))
+        fp.write(struct.pack('>%dI' % len(self.offsets), *self.offsets))
+
+def write_fortunes (fp, texts, dat=None, encoding='utf-8', delim='%'):
+    """Write each string in the iterable 'texts' to the binary file 'fp',
+    encoded with 'encoding' and followed by a newline.  The strings are
+    normally the output of Quotation.as_fortune(), which ends with the
+    delimiter.  If 'dat' is a binary file, the strfile index of the
+    output is written to it.  Returns an Index instance.
+    """
+    index = Index(delim)
+    for text in texts:
+        data = (text + '\n').encode(encoding)
+        fp.write(data)
+        index.add(data)
+    index.finish()
+    if dat is not None:
+        index.write(dat)
+    return index
+
+def read_index (fp):
+    """Read a strfile index from the binary file 'fp', returning a
+    (header, offsets) tuple.  'header' is a dictionary with the keys
+    'version', 'numstr', 'longlen', 'shortlen', 'flags' and 'delim'.
+    """
+    fields = _header.unpack(fp.read(_header.size))
+    header = dict(zip(('version', 'numstr', 'longlen', 'shortlen', 'flags'),
+                      fields))
+    header['delim'] = fields[5].decode('ascii')
+    count = header['numstr'] + 1
+    offsets = list(struct.unpack('>%dI' % count, fp.read(4 * count)))
+    return header, offsets
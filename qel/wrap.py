@@ -0,0 +1,113 @@
+"""
+qel.wrap -- Word wrapping for the text renderers.
+
+wrap() produces exactly the same lines as the textwrap module with its
+default options, but is considerably faster: the text is split into
+chunks by a precompiled regular expression, and each line is filled by
+a binary search over the chunk boundaries instead of by adding chunks
+one at a time.
+"""
+
+import re, textwrap
+from bisect import bisect_right
+from itertools import accumulate
+
+__all__ = ['wrap']
+
+# textwrap's rules for splitting text into chunks: at whitespace and
+# after hyphens, or at whitespace only.
+_hyphen_split = textwrap.TextWrapper.wordsep_re.split
+_whitespace_split = re.compile(r'(\s+)').split
+
+def _munge_whitespace(text):
+    "Expand tabs and replace other whitespace characters with spaces."
+    # A few replace() calls are much faster than str.translate().
+    text = text.expandtabs()
+    for c in '\n\r\x0b\x0c':
+        if c in text:
+            text = text.replace(c, ' ')
+    return text
+
+def wrap(text, width, initial_indent='', subsequent_indent='',
+         split_hyphens=True):
+    """Wrap 'text' into lines of at most 'width' characters, returning a
+    list of lines.  This is equivalent to
+
+        textwrap.wrap(text, width, initial_indent=initial_indent,
+                      subsequent_indent=subsequent_indent)
+
+    If 'split_hyphens' is false, lines are only broken at whitespace,
+    as if the TextWrapper's .wordsep_re attribute were set to
+    re.compile(r'(\\s+)').  Words too long to fit on a line are split,
+    after a hyphen if possible.
+    """
+    if width <= 0:
+        raise ValueError("invalid width %r (must be > 0)" % width)
+    text = _munge_whitespace(text)
+    if split_hyphens:
+        chunks = _hyphen_split(text)
+    else:
+        chunks = _whitespace_split(text)
+    chunks = list(filter(None, chunks))
+    # ends[k] is the offset in 'text' of the end of chunk k
+    ends = list(accumulate(map(len, chunks)))
+    n = len(chunks)
+
+    lines = []
+    i = 0           # Index of the next chunk
+    pos = 0         # Offset of the rest of the text; may be inside chunk i
+    while i < n:
+        if lines:
+            indent = subsequent_indent
+            # Whitespace at the start of a line is dropped.
+            if not text[pos:ends[i]].strip():
+                i += 1
+                if i == n:
+                    break
+                pos = ends[i-1]
+        else:
+            indent = initial_indent
+        avail = width - len(indent)
+        line_start = pos
+
+        # Add as many chunks as will fit.
+        j = bisect_right(ends, pos + avail, i)
+        line_end = ends[j-1] if j > i else pos
+        # Start of the last piece of the line, and the number of pieces
+        last_start = ends[j-2] if j > i+1 else pos
+        count = j - i
+
+        if j < n:
+            chunk_start = pos if j == i else ends[j-1]
+            chunk = text[chunk_start:ends[j]]
+            if not chunk:
+                # Only possible when the indent is wider than 'width';
+                # textwrap never finishes in this case.
+                j += 1
+            elif len(chunk) > avail:
+                # The next chunk can't fit on any line, so put as much
+                # of it on this line as possible.
+                if avail < 1:
+                    space_left = 1
+                else:
+                    space_left = avail - (line_end - pos)
+                end = space_left
+                if len(chunk) > space_left:
+                    # Break after the last hyphen, if there are
+                    # non-hyphens before it.
+                    hyphen = chunk.rfind('-', 0, space_left)
+                    if hyphen > 0 and chunk[:hyphen].strip('-'):
+                        end = hyphen + 1
+                last_start = chunk_start
+                line_end = chunk_start + min(end, len(chunk))
+                count += 1
+        i = j
+        pos = line_end
+
+        # Whitespace at the end of a line is dropped.
+        if count and not text[last_start:line_end].strip():
+            line_end = last_start
+            count -= 1
+        if count:
+            lines.append(indent + text[line_start:line_end])
+    return lines
@@ -0,0 +1,58 @@
+# Test suite for the qel.aio module
+
+import asyncio
+from io import StringIO
+import unittest
+from qel import aio, parse
+
+XML = """<?xml version="1.0" encoding="UTF-8"?>
+<quotations xmlns="http://www.amk.ca/qel/">
+<title>Title</title>
+<quotation id="q1"><p>para1</p></quotation>
+<quotation id="q2"><p>caf\xe9 <em>two</em></p></quotation>
+</quotations>"""
+
+async def iterate(data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i+chunk_size]
+
+class AsyncParseTest(unittest.TestCase):
+    def test_aiterparse(self):
+        data = XML.encode('utf-8')
+
+        async def read_stream():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return [item async for item in aio.aiterparse(reader, bufsize=7)]
+
+        items = asyncio.run(read_stream())
+        self.assertEqual(items[0].title, 'Title')
+        self.assertEqual([qt.id for qt in items[1:]], ['q1', 'q2'])
+
+        for coll in (asyncio.run(aio.aparse(iterate(data, 5))),
+                     asyncio.run(aio.aparse(iterate(XML, 1000), bufsize=3))):
+            self.assertEqual(coll.title, 'Title')
+            self.assertEqual([qt.id for qt in coll], ['q1', 'q2'])
+            self.assertEqual(coll[1].as_text(), 'caf\xe9 *two*\n')
+
+        async def bad():
+            return await aio.aparse(iterate(b'<other/>', 10))
+        self.assertRaises(parse.ParseError, asyncio.run, bad())
+
+    def test_render(self):
+        coll = parse.parse(StringIO(XML))
+
+        async def render():
+            text = [s async for s in aio.arender(coll, 'as_text')]
+            items = aio.aiterparse(iterate(XML, 10))
+            header = await items.__anext__()
+            xml = [s async for s in aio.arender_xml(header, items)]
+            return text, ''.join(xml)
+
+        text, xml = asyncio.run(render())
+        self.assertEqual(text, [qt.as_text() for qt in coll])
+        self.assertEqual(xml, coll.as_xml())
+
+if __name__ == "__main__":
+    unittest.main()
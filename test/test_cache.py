@@ -0,0 +1,167 @@
+
+# Test suite for the qel.cache module
+
+import os, shutil, tempfile, time
+import unittest
+from qel import cache, parse, quotation
+
+XML = """<?xml version="1.0" encoding="iso-8859-1"?>
+<quotations><title>%s</title>
+<quotation id="q1"><p>para1</p></quotation>
+</quotations>"""
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.path = os.path.join(self.dir, 'quotations.xml')
+        self.write_file('Title')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_file(self, title):
+        with open(self.path, 'w') as f:
+            f.write(XML % title)
+
+    def entries(self):
+        return [fn for fn in os.listdir(self.cache_dir)
+                if fn.endswith('.pickle')]
+
+    def test_cache(self):
+        pc = cache.ParseCache(self.cache_dir)
+        coll = pc.parse(self.path)
+        self.assertEqual(coll.title, 'Title')
+        self.assertEqual(coll[0].id, 'q1')
+        self.assertEqual(len(self.entries()), 1)
+
+        # A second call must not parse the file again.
+        real_parse = parse.parse
+        parse.parse = None
+        try:
+            coll2 = pc.parse(self.path)
+        finally:
+            parse.parse = real_parse
+        self.assertEqual(coll2.title, 'Title')
+        self.assertIsNot(coll, coll2)
+
+        # Changing the file results in a new entry.
+        self.write_file('New title')
+        self.assertEqual(pc.parse(self.path).title, 'New title')
+        self.assertEqual(len(self.entries()), 2)
+
+        pc.clear()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_eviction(self):
+        pc = cache.ParseCache(self.cache_dir, max_size=1)
+        pc.parse(self.path)
+        self.write_file('New title')
+        pc.parse(self.path)
+
+        # Only the most recently used entry is kept.
+        self.assertEqual(len(self.entries()), 1)
+        self.assertEqual(pc.parse(self.path).title, 'New title')
+
+        # Records of evicted entries and deleted files are dropped.
+        other = os.path.join(self.dir, 'other.xml')
+        shutil.copy(self.path, other)
+        pc.parse(other, backend='pulldom')
+        self.assertEqual(list(pc._read_index()),
+                         [other + "\0[('backend', 'pulldom')]"])
+        os.unlink(other)
+        pc.parse(self.path)
+        self.assertEqual(list(pc._read_index()), [self.path])
+
+    def test_arguments(self):
+        # Collections parsed with different arguments are kept apart.
+        pc = cache.ParseCache(self.cache_dir)
+        self.assertNotIsInstance(pc.parse(self.path)[0], parse.LazyQuotation)
+        self.assertIsInstance(pc.parse(self.path, lazy=True)[0],
+                              parse.LazyQuotation)
+        self.assertNotIsInstance(pc.parse(self.path)[0], parse.LazyQuotation)
+        self.assertEqual(len(self.entries()), 2)
+
+    def test_corrupt_entry(self):
+        pc = cache.ParseCache(self.cache_dir)
+        pc.parse(self.path)
+        # The entry is removed by another process while being loaded.
+        def load(f):
+            os.unlink(f.name)
+            raise ValueError('corrupt')
+        real_load = cache.pickle.load
+        cache.pickle.load = load
+        try:
+            self.assertEqual(pc.parse(self.path).title, 'Title')
+        finally:
+            cache.pickle.load = real_load
+        self.assertEqual(pc.parse(self.path).title, 'Title')
+
+    def test_concurrent(self):
+        # Processes sharing a cache don't lose each other's records.
+        import concurrent.futures
+        paths = []
+        for i in range(8):
+            path = os.path.join(self.dir, 'q%d.xml' % i)
+            with open(path, 'w') as f:
+                f.write(XML % i)
+            paths.append(path)
+        pc = cache.ParseCache(self.cache_dir)
+        with concurrent.futures.ProcessPoolExecutor(4) as executor:
+            titles = [coll.title for coll in executor.map(pc.parse, paths)]
+        self.assertEqual(titles, [str(i) for i in range(8)])
+        self.assertEqual(sorted(pc._read_index()), sorted(paths))
+
+
+class RenderCacheTest(unittest.TestCase):
+    def test_render(self):
+        qt = quotation.Quotation()
+        qt.text = [[quotation.Text('para')]]
+        renders = cache.RenderCache(maxsize=2)
+
+        self.assertEqual(renders.render(qt, 'as_text'), 'para\n')
+        self.assertEqual(renders.render(qt, 'as_text'), 'para\n')
+        self.assertEqual((renders.hits, renders.misses), (1, 1))
+        # Different arguments are cached separately.
+        self.assertEqual(renders.render(qt, 'as_text', include_note=1),
+                         'para\n')
+        self.assertEqual(renders.misses, 2)
+
+        # Assigning an attribute invalidates the results...
+        qt.author = quotation.Author()
+        qt.author.text = [quotation.Text('Someone')]
+        self.assertEqual(renders.render(qt, 'as_text'),
+                         'para\n      -- Someone\n')
+
+        # ...and so do changes made in place.
+        qt.text[0].append(quotation.Text(' more'))
+        self.assertEqual(renders.render(qt, 'as_text'),
+                         'para more\n      -- Someone\n')
+        qt.author.text[0].text = 'Anyone'
+        self.assertEqual(renders.render(qt, 'as_text'),
+                         'para more\n      -- Anyone\n')
+        qt.compile()
+        self.assertEqual(renders.render(qt, 'as_text'),
+                         'para more\n      -- Anyone\n')
+        self.assertEqual(renders.render(qt, 'as_text'),
+                         'para more\n      -- Anyone\n')
+        qt.text[0][0].text = 'text'
+        self.assertEqual(renders.render(qt, 'as_text'),
+                         'text more\n      -- Anyone\n')
+        misses = renders.misses
+        self.assertEqual(renders.render(qt, 'as_text'),
+                         'text more\n      -- Anyone\n')
+        self.assertEqual(renders.misses, misses)
+
+        # Least recently used results are discarded.
+        renders.render(qt, 'as_html')
+        self.assertEqual(len(renders), 2)
+        misses = renders.misses
+        renders.render(qt, 'as_text', include_note=1)
+        self.assertEqual(renders.misses, misses + 1)
+
+        renders.invalidate(qt)
+        self.assertEqual(len(renders), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# Test suite for the qel.incremental module
+
+import os, shutil, tempfile
+from io import BytesIO
+import unittest
+from qel import parse
+from qel.incremental import IncrementalParser
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<quotations xmlns="http://www.amk.ca/qel/">
+<title>%s</title>
+"""
+
+def make_xml(quotations, title='Title'):
+    xml = HEADER % title
+    for id, text in quotations:
+        xml += '<quotation id="%s"><p>%s</p></quotation>\n' % (id, text)
+    xml += '</quotations>'
+    return BytesIO(xml.encode('utf-8'))
+
+class IncrementalParserTest(unittest.TestCase):
+    def test_parse(self):
+        parser = IncrementalParser()
+        quotations = [('q%i' % i, 'para%i' % i) for i in range(5)]
+        coll, changes = parser.parse(make_xml(quotations))
+        self.assertEqual(coll.title, 'Title')
+        self.assertEqual(changes.added, ['q0', 'q1', 'q2', 'q3', 'q4'])
+        self.assertEqual(changes.removed, [])
+        self.assertTrue(changes.header_changed)
+
+        # Nothing changed
+        coll2, changes = parser.parse(make_xml(quotations))
+        self.assertFalse(changes)
+        self.assertEqual(coll2.title, 'Title')
+        for qt, qt2 in zip(coll, coll2):
+            self.assertIs(qt, qt2)
+
+        # Edit, delete, insert and move quotations
+        quotations[1] = ('q1', 'changed')
+        del quotations[2]
+        quotations.insert(0, ('q5', 'new'))
+        quotations.append(quotations.pop(1))
+        coll3, changes = parser.parse(make_xml(quotations, 'New title'))
+        self.assertEqual(changes.added, ['q5'])
+        self.assertEqual(changes.removed, ['q2'])
+        self.assertEqual(changes.modified, ['q1'])
+        self.assertTrue(changes.header_changed)
+        self.assertEqual(coll3.title, 'New title')
+        self.assertEqual([qt.id for qt in coll3],
+                         ['q5', 'q1', 'q3', 'q4', 'q0'])
+        self.assertIs(coll3[2], coll[3])
+        self.assertIs(coll3[4], coll[0])
+        self.assertEqual(coll3[1].text[0][0].as_text(), 'changed')
+
+        # The result matches a full parse.
+        full = parse.parse(make_xml(quotations, 'New title'))
+        self.assertEqual([qt.as_xml() for qt in coll3],
+                         [qt.as_xml() for qt in full])
+
+    def test_hidden_tags(self):
+        # Tags in comments and CDATA sections can't be scanned for, so
+        # the whole file is parsed and every quotation is reported.
+        parser = IncrementalParser()
+        quotations = [('q%i' % i, 'para%i' % i) for i in range(3)]
+        parser.parse(make_xml(quotations))
+        for hidden in ('<!-- <quotation id="c"><p>x</p></quotation> -->',
+                       '<![CDATA[</quotation>]]>'):
+            quotations[1] = ('q1', hidden)
+            coll, changes = parser.parse(make_xml(quotations))
+            self.assertEqual([qt.id for qt in coll], ['q0', 'q1', 'q2'])
+            self.assertEqual(changes.added, [])
+            self.assertEqual(changes.modified, ['q0', 'q1', 'q2'])
+            full = parse.parse(make_xml(quotations))
+            self.assertEqual([qt.as_xml() for qt in coll],
+                             [qt.as_xml() for qt in full])
+
+        # Scanning resumes once they're gone.
+        quotations[1] = ('q1', 'para1')
+        coll, changes = parser.parse(make_xml(quotations))
+        self.assertEqual(changes.modified, ['q0', 'q1', 'q2'])
+        coll, changes = parser.parse(make_xml(quotations))
+        self.assertFalse(changes)
+
+    def test_duplicates(self):
+        parser = IncrementalParser()
+        quotations = [('q1', 'same'), ('q1', 'same')]
+        coll, changes = parser.parse(make_xml(quotations))
+        self.assertEqual(changes.added, ['q1'])
+        self.assertIsNot(coll[0], coll[1])
+        coll, changes = parser.parse(make_xml(quotations * 2))
+        self.assertFalse(changes)
+        self.assertEqual(len(set(map(id, coll))), 4)
+
+    def test_save(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'state')
+            parser = IncrementalParser()
+            parser.parse(make_xml([('q1', 'para')]))
+            parser.save(path)
+            parser = IncrementalParser.load(path)
+            coll, changes = parser.parse(make_xml([('q1', 'para'),
+                                                   ('q2', 'para')]))
+            self.assertEqual(changes.added, ['q2'])
+            self.assertFalse(changes.header_changed)
+        finally:
+            shutil.rmtree(dir)
+
+if __name__ == "__main__":
+    unittest.main()
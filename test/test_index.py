@@ -0,0 +1,114 @@
+# Test suite for the qel.index module
+
+import os, re, tempfile
+import unittest
+from qel import index, parse, scripts
+from qel.index import SearchIndex, fold, required_literals
+
+XML = """<?xml version="1.0" encoding="UTF-8"?>
+<quotations xmlns="http://www.amk.ca/qel/">
+  <title>Test</title>
+  <quotation id="q1"><p>The answer is <em>forty-two</em>.</p>
+    <author>Deep Thought</author></quotation>
+  <quotation><p>ΟΔΥΣΣΕΥΣ went to Troy</p><p>Go now</p></quotation>
+  <quotation id="q3"><p>Nothing to see</p>
+    <source>The Answer</source></quotation>
+  <quotation id="q4"><p>Don't <cite>go</cite> away</p></quotation>
+</quotations>"""
+
+PATTERNS = ['answer', 'forty', 'FORTY-TWO', 'odysseus', 'οδυσσευς',
+            r'\bgo\b', 'go', 'to', 't[rh]', 'troy|nothing', 'deep',
+            'x', '.', 'answer is forty', 'ans(w|x)er']
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'test.xml')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(XML)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_fold(self):
+        self.assertEqual(fold('ABC def'), 'abc def')
+        self.assertEqual(fold('ΣΊΣΥΦΟΣ'), fold('σίσυφος'))
+        self.assertEqual(fold('ſtraße İ'), 'straße i')
+
+    def test_required_literals(self):
+        def literals(pattern):
+            return required_literals(re.compile(pattern, re.IGNORECASE))
+        self.assertEqual(literals('ab+c(d|ef)'), [('ab',), ('bc',), ('d', 'ef')])
+        self.assertEqual(literals('Deep(?: Thought)?'), [('deep',)])
+        self.assertEqual(literals(r'\bGo\b'), [('go',)])
+        self.assertEqual(literals('x.*yz|ab'), [('ab', 'yz')])
+        self.assertEqual(literals('a|b*'), [])
+        self.assertEqual(literals('.'), [])
+
+    def test_search(self):
+        coll = parse.parse(self.path)
+        with SearchIndex.open(self.path) as ix:
+            self.assertEqual(len(ix), 4)
+            self.assertTrue(os.path.exists(self.path + '.sidx'))
+            self.assertEqual(ix.lookup('wthought'), [0])
+            self.assertEqual(ix.lookup('tans'), [0, 2])
+            for pattern in PATTERNS:
+                pattern = re.compile(pattern, re.IGNORECASE)
+                expected = [qt.as_xml() for qt in coll
+                            if qt.is_matching_regex(pattern)]
+                self.assertEqual([qt.as_xml() for qt in ix.search(pattern)],
+                                 expected, pattern.pattern)
+
+            # The author and source are indexed, but aren't searched.
+            pattern = re.compile('thought', re.IGNORECASE)
+            self.assertEqual(ix.candidates(pattern), [0])
+            self.assertEqual(list(ix.search(pattern)), [])
+            self.assertEqual(ix.candidates(re.compile('zzz')), [])
+            self.assertIs(ix.candidates(re.compile('.')), None)
+
+    def test_hidden_tags(self):
+        # Comments and CDATA sections could hide tags from
+        # scan_quotations(), so the file is indexed by parsing it.
+        xml = XML.replace('<p>Nothing',
+                          '<!-- <quotation><p>go</p></quotation> -->'
+                          '<p><![CDATA[</quotation>]]></p><p>Nothing')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(xml)
+        coll = parse.parse(self.path)
+        with SearchIndex.open(self.path) as ix:
+            self.assertEqual(len(ix), 4)
+            self.assertIs(ix.get_xml(0), None)
+            self.assertEqual(ix.candidates(re.compile('troy', re.I)), [1])
+            for pattern in PATTERNS + ['quotation']:
+                pattern = re.compile(pattern, re.IGNORECASE)
+                expected = [qt.as_xml() for qt in coll
+                            if qt.is_matching_regex(pattern)]
+                self.assertEqual([qt.as_xml() for qt in ix.search(pattern)],
+                                 expected, pattern.pattern)
+        # The index is reused.
+        with SearchIndex.open(self.path) as ix:
+            self.assertEqual(len(list(ix.search(re.compile('troy', re.I)))),
+                             1)
+
+    def test_rebuild(self):
+        with SearchIndex.open(self.path) as ix:
+            self.assertEqual(ix.candidates(re.compile('troy', re.I)), [1])
+
+        # Changing the file makes the index out of date.
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(XML.replace('Troy', 'Ithaca'))
+        os.utime(self.path, ns=(0, 0))
+        with SearchIndex.open(self.path) as ix:
+            self.assertEqual(ix.candidates(re.compile('troy', re.I)), [])
+            self.assertEqual(ix.candidates(re.compile('ithaca', re.I)), [1])
+
+    def test_iter_matches(self):
+        pattern = re.compile('go', re.IGNORECASE)
+        for use_index in (False, True):
+            results = [(file, [qt.id for qt in matches])
+                       for file, matches in scripts.iter_matches(
+                           [self.path], pattern, use_index=use_index)]
+            self.assertEqual(results, [(self.path, [None, 'q4'])])
+
+if __name__ == "__main__":
+    unittest.main()
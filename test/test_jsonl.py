@@ -0,0 +1,77 @@
+# Test suite for the qel.jsonl module
+
+from io import BytesIO, StringIO
+import json, os, tempfile
+import unittest
+from qel import jsonl, parse, quotation
+
+XML = """<?xml version="1.0" encoding="UTF-8"?>
+<quotations xmlns="http://www.amk.ca/qel/"
+  xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <title>Test &amp; Title</title>
+  <editor>Editor</editor>
+  <license><p>para1 <em>em</em></p><p>para2</p></license>
+  <quotation id="q1" date="2000-01-01" type="funny, silly">
+    <p>Some <em>very <cite>nested</cite></em> text<br/>and
+       a <pre>
+     preformatted  block
+</pre> after &amp; it.</p>
+    <p>Café   — <foreign>etc.</foreign></p>
+    <author type="a1" rdf:resource="http://example.com">A <em>1</em></author>
+    <source type="s1,s2">s1</source>
+    <note><p>A <q>note</q>.</p></note>
+  </quotation>
+  <quotation><p>Second</p></quotation>
+</quotations>"""
+
+class JSONLTest(unittest.TestCase):
+    def setUp(self):
+        self.coll = parse.parse(StringIO(XML))
+        self.expected = self.coll.as_xml()
+
+    def test_roundtrip(self):
+        out = StringIO()
+        self.coll.write_jsonl(out)
+        lines = out.getvalue().split('\n')
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[2]), {'text': [['Second']]})
+
+        coll = jsonl.load(StringIO(out.getvalue()))
+        self.assertEqual(coll.title, 'Test & Title')
+        self.assertEqual(coll[0].author.uri, 'http://example.com')
+        self.assertEqual(coll[0].source.type, ['s1', 's2'])
+        self.assertEqual(coll.as_xml(), self.expected)
+
+        # Quotations that have been decompiled are written the same way.
+        self.assertEqual(len(coll[0].text), 2)
+        self.assertEqual(coll[0].as_jsonl(), lines[1] + '\n')
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'coll.jsonl')
+            with open(path, 'wb') as f:
+                jsonl.dump(self.coll, f)
+            self.assertEqual(jsonl.load(path).as_xml(), self.expected)
+            with open(path, 'rb') as f:
+                coll = jsonl.load(f, workers=2)
+            self.assertEqual(coll.as_xml(), self.expected)
+
+        items = jsonl.iterload(BytesIO(self.coll[0].as_jsonl().encode('utf-8')))
+        header = next(items)
+        self.assertIs(header.title, None)
+        self.assertEqual([qt.id for qt in items], ['q1'])
+        self.assertEqual(len(jsonl.load(BytesIO(b''))), 0)
+
+    def test_unknown_element(self):
+        line = '{"text": [["a", ["blink", "b"]]]}\n'
+        self.assertRaises(parse.ParseError, jsonl.load, StringIO(line))
+
+    def test_custom_markup(self):
+        class Custom(quotation.Markup):
+            __slots__ = ()
+        qt = quotation.Quotation()
+        qt.text = [[Custom('text')]]
+        self.assertRaises(TypeError, qt.as_jsonl)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+# Test suite for the qel.opcodes module
+
+from io import StringIO
+import pickle, random, re
+import unittest
+from qel import opcodes, parse, quotation
+from qel.opcodes import TEXT, OPEN, CLOSE, BREAK, PRE
+
+XML = """<?xml version="1.0" encoding="UTF-8"?>
+<quotations xmlns="http://www.amk.ca/qel/">
+<quotation id="q1">
+  <p>Some <em>very <cite>nested</cite></em> text<br/>and
+     a <pre>
+   preformatted  block
+</pre> after &amp; it.</p>
+  <p>Second</p>
+  <author>Someone</author>
+  <note><p>A <q>note</q>.</p></note>
+</quotation>
+</quotations>"""
+
+METHODS = [('as_text', ()), ('as_text', (1, 1)), ('as_rst', ()),
+           ('as_wiki', ()), ('as_fortune', ()), ('as_html', ()),
+           ('as_xml', ())]
+
+def render_all(qt):
+    return [getattr(qt, method)(*args) for method, args in METHODS]
+
+def random_node(rand, depth):
+    words = ['a', 'word', ' ', '  ', '\n', 'x-y', '&<>', 'long' * 12,
+             '', ' lead', 'trail ']
+    classes = [quotation.Abbreviation, quotation.CitedText,
+               quotation.CodeFormattedText, quotation.EmphasizedText,
+               quotation.ForeignText, quotation.QuotedText]
+    r = rand.random()
+    if r < 0.5 or depth > 3:
+        return quotation.Text(''.join(rand.choice(words)
+                                      for i in range(rand.randint(0, 4))))
+    elif r < 0.6:
+        return quotation.Break()
+    elif r < 0.7:
+        inst = quotation.PreformattedText()
+    else:
+        inst = rand.choice(classes)()
+    inst.children = [random_node(rand, depth + 1)
+                     for i in range(rand.randint(0, 3))]
+    return inst
+
+class OpcodesTest(unittest.TestCase):
+    def test_compile(self):
+        em = quotation.EmphasizedText('b')
+        pre = quotation.PreformattedText(' c ')
+        paragraph = [quotation.Text('a '), em, quotation.Break(), pre]
+        code = opcodes.compile_paragraph(paragraph)
+        self.assertEqual(code, (TEXT, 'a ',
+                                OPEN, quotation.EmphasizedText, TEXT, 'b',
+                                CLOSE, quotation.EmphasizedText,
+                                BREAK, None, PRE, (TEXT, ' c ')))
+        self.assertEqual(opcodes.length(code), 6)
+        self.assertEqual(list(opcodes.texts(code)), ['a ', 'b', ' c '])
+
+        tree = opcodes.decompile_paragraph(code)
+        self.assertEqual([t.__class__ for t in tree],
+                         [t.__class__ for t in paragraph])
+        self.assertEqual(''.join(t.as_xml() for t in tree),
+                         'a <em>b</em><br /><pre> c </pre>')
+
+        self.assertRaises(TypeError, opcodes.compile_paragraph, ['string'])
+
+    def test_parsed(self):
+        coll = parse.parse(StringIO(XML))
+        qt = coll[0]
+        self.assertIsNot(qt._code, None)
+        length = len(qt)
+        self.assertTrue(qt.is_matching_regex(re.compile('nest')))
+        self.assertFalse(qt.is_matching_regex(re.compile('note')))
+        output = render_all(qt)
+
+        # Pickling keeps the compiled form.
+        qt2 = pickle.loads(pickle.dumps(qt))
+        self.assertIsNot(qt2._code, None)
+        self.assertEqual(render_all(qt2), output)
+
+        # Accessing .text rebuilds the tree, which is used from then on.
+        self.assertEqual(qt.text[1][0].text, 'Second')
+        self.assertIs(qt._code, None)
+        self.assertEqual(len(qt.note), 1)
+        self.assertEqual(len(qt), length)
+        self.assertEqual(render_all(qt), output)
+
+        # Lazily parsed quotations are compiled when they're loaded.
+        lazy = parse.parse(StringIO(XML), lazy=True)[0]
+        self.assertEqual(render_all(lazy), output)
+        self.assertIsNot(lazy._code, None)
+
+        # Assigning .text leaves .note intact.
+        qt2.text = [[quotation.Text('New')]]
+        self.assertIs(qt2._code, None)
+        self.assertEqual(qt2.note[0][1].as_xml(), '<q>note</q>')
+
+    def test_compare(self):
+        "Compare the compiled renderers with the tree renderers"
+        rand = random.Random(17)
+        for i in range(1000):
+            qt = quotation.Quotation()
+            qt.text = [[random_node(rand, 0)
+                        for k in range(rand.randint(0, 6))]
+                       for j in range(rand.randint(1, 3))]
+            qt.note = [[random_node(rand, 0)
+                        for k in range(rand.randint(0, 4))]
+                       for j in range(rand.randint(0, 2))]
+            expected = render_all(qt)
+            length = len(qt)
+            qt.compile()
+            self.assertIsNot(qt._code, None)
+            self.assertEqual(render_all(qt), expected)
+            self.assertEqual(len(qt), length)
+
+    def test_uncompilable(self):
+        class Custom(quotation.Markup):
+            __slots__ = ()
+        qt = quotation.Quotation()
+        qt.text = [[Custom('text')]]
+        qt.compile()
+        self.assertIs(qt._code, None)
+        self.assertEqual(qt.as_text(), 'text\n')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,111 @@
 
 # Test suite for the qel.parse module
 
-from io import StringIO
+from io import StringIO, BytesIO
 
+import random, re
 import unittest
 from qel import parse, quotation
 
+def reference_simplify(text_list, trim_ends = True):
+    "The original implementation of parse.simplify(), for comparison"
+    # Merge consecutive Text objects
+    for i in range(1, len(text_list)):
+        t1 = text_list[i-1]
+        t2 = text_list[i]
+        if isinstance(t1, quotation.Text) and isinstance(t2, quotation.Text):
+            t2.text = t1.text + t2.text
+            text_list[i-1] = None
+            i += 1
+
+    # Remove Nones
+    text_list = [obj for obj in text_list if obj is not None]
+
+    # Translate all whitespace to spaces, and condense runs of whitespace
+    # down to a single space.
+    for i in range(len(text_list)):
+        t = text_list[i]
+        if isinstance(t, quotation.Text):
+            text_list[i] = quotation.Text(re.sub(r'\s+', ' ', t.text))
+        elif t.is_break() or t.is_preformatted():
+            continue
+        else:
+            t.children = reference_simplify(t.children, trim_ends=False)
+
+    # Remove redundant whitespace between chunks.
+    for i in range(len(text_list)-2, -1, -1):
+        left, right = text_list[i:i+2]
+        if (left.is_break() or right.is_break() or
+            left.is_preformatted() or right.is_preformatted()):
+            continue
+        if (left.endswith(' ') and right.startswith(' ')):
+            if left.is_plain():
+                if len(right) > 1:
+                    text_list[i+1] = right = right.lstrip()
+            elif right.is_plain():
+                if len(left) > 1:
+                    text_list[i] = left = left.rstrip()
+            else:
+                # Both chunks are something formatted.  This is likely to
+                # be an error, so we'll insert a Text chunk between them.
+                text_list[i] = left = left.rstrip()
+                text_list[i+1] = right = right.lstrip()
+                text_list.insert( i+1, quotation.Text(' '))
+
+    # Remove leading whitespace from the first Text instance,
+    # and trailing whitespace from the last one.
+    changed = True
+    while trim_ends and len(text_list) and changed:
+        changed = False
+        first = text_list[0]
+        if not (first.is_preformatted() or first.is_break()):
+            text_list[0] = first = first.lstrip()
+            if len(first) == 0:
+                del text_list[0]
+                changed = True
+
+    changed = True
+    while trim_ends and len(text_list) and changed:
+        changed = False
+        last = text_list[-1]
+        if not (last.is_preformatted() or last.is_break() ):
+            text_list[-1] = last = last.rstrip()
+            if len(last) == 0:
+                del text_list[-1]
+                changed = True
+
+    if text_list and trim_ends:
+        assert not text_list[0].startswith(' ')
+
+    return text_list
+
+def make_text_list(rng, depth=0):
+    "Generate a random list of Text and Markup instances"
+    L = []
+    for i in range(rng.randrange(6)):
+        kind = rng.randrange(6)
+        if kind < 3 or depth > 1:
+            L.append(quotation.Text(rng.choice(['', ' ', '  ', 'a', 'b c',
+                                                ' a', 'b ', ' a\nb ',
+                                                '\t', 'ab  cd'])))
+        elif kind == 3:
+            L.append(quotation.Break())
+        else:
+            klass = rng.choice([quotation.EmphasizedText,
+                                quotation.CitedText,
+                                quotation.Acronym,
+                                quotation.PreformattedText])
+            inst = klass()
+            inst.children = make_text_list(rng, depth+1)
+            L.append(inst)
+    return L
+
+def dump(text_list):
+    "Return a nested structure describing a list of Text instances"
+    return [(t.__class__.__name__, dump(t.children))
+            if isinstance(t, quotation.Markup) else t.text
+            for t in text_list]
+
 class QELParseTest(unittest.TestCase):
     "Test of the qel.parse module"
 
@@ -79,6 +179,156 @@ class QELParseTest(unittest.TestCase):
         self.assertEqual(qt.source.type, ['s1','s2'])
         self.assertEqual(qt.note[0][0].as_text(), 'n1')
 
+    def test_iterparse(self):
+        "Check that iterparse() returns the header, then each quotation"
+        xml = self.xml_header + ("""<quotations>
+        <title>Test Title</title>
+        <quotation id="q1"><p>para1</p></quotation>
+        <quotation id="q2"><p>para2</p></quotation>
+        </quotations>""")
+
+        items = parse.iterparse(StringIO(xml))
+        coll = next(items)
+        self.assertEqual(coll.title, 'Test Title')
+        self.assertEqual(len(coll), 0)
+        self.assertEqual([qt.id for qt in items], ['q1', 'q2'])
+
+        # No <quotations> element at all
+        items = parse.iterparse(StringIO(self.xml_header + "<title/>"))
+        self.assertRaises(parse.ParseError, next, items)
+
+    def test_backends(self):
+        "Check that the SAX and pulldom backends produce the same result"
+        xml = self.xml_header + ("""<quotations>
+        <title>Test &amp; Title</title>
+        <quotation id="qtid" type="funny">
+        <p>  para1 <em> bold <q>quoted</q> </em> <cite>c</cite>end </p>
+        <p>line1<br/>line2<pre>
+          pre <em>text</em>
+        </pre></p><ignored>ignored</ignored>
+        <author type="a1" rdf:resource="http://example.com"
+        xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+        >a<em>1</em></author>
+        <source>s1</source><note><p>n1</p><p><em>n2</em></p></note>
+        </quotation></quotations>""")
+
+        pulldom_coll = parse.parse(StringIO(xml), backend='pulldom')
+        sax_coll = parse.parse(StringIO(xml), backend='sax')
+        self.assertEqual(sax_coll.title, 'Test & Title')
+        self.assertEqual(len(sax_coll), len(pulldom_coll))
+        pulldom_qt, sax_qt = pulldom_coll[0], sax_coll[0]
+        self.assertEqual(sax_qt.type, ['funny'])
+        self.assertEqual(sax_qt.author.uri, 'http://example.com')
+        self.assertEqual(sax_qt.as_text(include_note=True),
+                         pulldom_qt.as_text(include_note=True))
+        self.assertEqual(sax_qt.as_html(), pulldom_qt.as_html())
+        self.assertEqual(sax_qt.as_rst(), pulldom_qt.as_rst())
+
+        self.assertRaises(ValueError, parse.parse, StringIO(xml),
+                          backend='bogus')
+
+        # Unknown markup inside a paragraph
+        xml = self.xml_header + ("<quotations><quotation><p><bogus/></p>"
+                                 "</quotation></quotations>")
+        for backend in ('sax', 'pulldom'):
+            self.assertRaises(parse.ParseError, parse.parse,
+                              StringIO(xml), backend=backend)
+
+    def test_scan_quotations(self):
+        "Check locating quotations without parsing"
+        xml = self.xml_header + ("""<quotations xmlns="http://www.amk.ca/qel/">
+        <title>Title</title>
+        <quotation id="q1"><p>para1</p></quotation>
+        <quotation id="q2"/>
+        <quotation id="q3"><p>para3</p></quotation></quotations>""")
+
+        prolog, spans = parse.scan_quotations(xml)
+        self.assertTrue(prolog.endswith('xmlns="http://www.amk.ca/qel/">'))
+        start, end = spans[1]
+        self.assertEqual(xml[start:end], '<quotation id="q2"/>')
+
+        for data in (xml, xml.encode('iso-8859-1')):
+            prolog, spans = parse.scan_quotations(data)
+            self.assertEqual(len(spans), 3)
+            quotations = parse.parse_fragment(prolog,
+                                              data[spans[0][0]:spans[2][1]])
+            self.assertEqual([qt.id for qt in quotations], ['q1', 'q2', 'q3'])
+            self.assertEqual(quotations[2].text[0][0].as_text(), 'para3')
+
+        self.assertEqual(parse.scan_quotations("<other/>"), (None, []))
+
+    def test_parallel(self):
+        "Check parsing in several processes"
+        xml = self.xml_header + "<quotations><title>Title</title>"
+        for i in range(10):
+            xml += '<quotation id="q%i"><p>para%i</p></quotation>\n' % (i, i)
+        xml += "</quotations>"
+
+        coll = parse.parse(StringIO(xml), workers=2)
+        self.assertEqual(coll.title, 'Title')
+        self.assertEqual([qt.id for qt in coll],
+                         ['q%i' % i for i in range(10)])
+        self.assertEqual(coll[9].text[0][0].as_text(), 'para9')
+
+        # Tags in comments and CDATA sections don't confuse it.
+        xml = xml.replace('<quotation id="q3">',
+                          '<!-- <quotation id="c"><p>x</p></quotation> -->'
+                          '<quotation id="q3">')
+        xml = xml.replace('para5', '<![CDATA[</quotation>]]>')
+        coll = parse.parse(StringIO(xml), workers=2)
+        self.assertEqual([qt.id for qt in coll],
+                         ['q%i' % i for i in range(10)])
+        self.assertEqual(coll[5].text[0][0].as_text(), '</quotation>')
+
+    def test_lazy(self):
+        "Check lazy parsing of quotations"
+        xml = (self.xml_header + '<quotations><title>Title</title>'
+               '<quotation id="q1" date="2001" type="a, b">'
+               '<p>First &amp; <em>one</em></p><author>A. Writer</author>'
+               '<note><p>Note</p></note></quotation>\n'
+               "<quotation id='q&quot;2&#x41;'><p>Second</p></quotation>"
+               '</quotations>')
+        expected = parse.parse(StringIO(xml))
+
+        for data in (xml, xml.encode('utf-8')):
+            stream = StringIO(data) if isinstance(data, str) else BytesIO(data)
+            coll = parse.parse(stream, lazy=True)
+            self.assertEqual(coll.title, 'Title')
+            self.assertEqual(len(coll), 2)
+            qt1, qt2 = coll
+            self.assertIsInstance(qt1, parse.LazyQuotation)
+            self.assertEqual(qt1.id, 'q1')
+            self.assertEqual(qt1.date, '2001')
+            self.assertEqual(qt1.type, ['a', 'b'])
+            self.assertEqual(qt2.id, 'q"2A')
+            for qt, exp in zip(coll, expected):
+                self.assertEqual((qt.id, qt.date, qt.type),
+                                 (exp.id, exp.date, exp.type))
+            # Nothing has been parsed yet.
+            self.assertIsNotNone(qt1._xml)
+
+            for qt, exp in zip(coll, expected):
+                self.assertEqual(qt.as_text(), exp.as_text())
+                self.assertEqual(qt.as_xml(), exp.as_xml())
+            self.assertIsNone(qt1._xml)
+            self.assertRaises(AttributeError, getattr, qt1, 'missing')
+
+        # Assigned attributes aren't overwritten by the lazy parse.
+        qt = parse.parse(StringIO(xml), lazy=True)[0]
+        qt.note = []
+        self.assertEqual(qt.author.as_text(), 'A. Writer')
+        self.assertEqual(qt.note, [])
+
+        # Files where comments or CDATA sections could hide tags are
+        # parsed right away.
+        for hidden in ('<!-- <quotation id="c"><p>x</p></quotation> -->',
+                       '<![CDATA[</quotation>]]>'):
+            data = xml.replace('<p>Second', hidden + '<p>Second')
+            expected = parse.parse(StringIO(data))
+            coll = parse.parse(StringIO(data), lazy=True)
+            self.assertEqual([qt.as_xml() for qt in coll],
+                             [qt.as_xml() for qt in expected])
+
     def test_simplify(self):
         "Check the simplify() internal function: 6"
         from qel.quotation import Text, CitedText, EmphasizedText
@@ -106,5 +356,44 @@ class QELParseTest(unittest.TestCase):
         self.assertEqual(L[0].as_text(), '*abc*')
         self.assertEqual(L[1].as_text(), ' ')
 
+    def test_simplify_corpus(self):
+        "Compare simplify() with the original implementation"
+        compared = 0
+        for seed in range(3000):
+            for trim_ends in (True, False):
+                try:
+                    expected = dump(reference_simplify(
+                        make_text_list(random.Random(seed)), trim_ends))
+                except (IndexError, AssertionError):
+                    # The original failed on empty chunks and
+                    # leading <pre> elements.
+                    continue
+                L = parse.simplify(make_text_list(random.Random(seed)),
+                                   trim_ends)
+                self.assertEqual(dump(L), expected)
+                compared += 1
+        self.assertTrue(compared > 5000)
+
+        # The parser simplifies markup as it's closed, and then skips
+        # re-simplifying it when the paragraph is closed.
+        def simplify_bottom_up(L):
+            for t in L:
+                if isinstance(t, quotation.Markup) and not t.is_break():
+                    simplify_bottom_up(t.children)
+                    if not t.is_preformatted():
+                        t.children = parse.simplify(t.children)
+            return L
+        for seed in range(1000):
+            L = simplify_bottom_up(make_text_list(random.Random(seed)))
+            self.assertEqual(dump(parse._simplify(L, True, False)),
+                             dump(parse.simplify(L)))
+
+        # Previously these raised IndexError.
+        from qel.quotation import Text, Break, EmphasizedText
+        L = parse.simplify([Break(), Text(' text ')])
+        self.assertEqual(dump(L), [('Break', []), ' text'])
+        L = parse.simplify([EmphasizedText(), Text(' text')])
+        self.assertEqual(dump(L), ['text'])
+
 if __name__ == "__main__":
     unittest.main()
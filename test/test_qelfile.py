@@ -0,0 +1,74 @@
+
+# Test suite for the qel.qelfile module
+
+import gc, os, shutil, tempfile, warnings
+import unittest
+from qel import parse
+from qel.qelfile import QELFile
+
+XML = """<?xml version="1.0" encoding="iso-8859-1"?>
+<quotations xmlns="http://www.amk.ca/qel/">
+<title>Title</title>
+<quotation id="q1"><p>para1</p></quotation>
+<quotation><p>no ID</p></quotation>
+<quotation id='q&amp;2' date="2000-01-01"><p>caf\xe9</p></quotation>
+<quotation id="q&#51;"><p>character reference</p></quotation>
+</quotations>"""
+
+class QELFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'quotations.xml')
+        with open(self.path, 'w', encoding='iso-8859-1') as f:
+            f.write(XML)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get(self):
+        with QELFile.open(self.path) as qf:
+            self.assertEqual(len(qf), 3)
+            self.assertEqual(qf.ids(), ['q1', 'q&2', 'q3'])
+            self.assertEqual(qf.get('q3').id, 'q3')
+            self.assertTrue('q1' in qf)
+            qt = qf.get('q&2')
+            self.assertEqual(qt.id, 'q&2')
+            self.assertEqual(qt.date, '2000-01-01')
+            self.assertEqual(qt.text[0][0].as_text(), 'caf\xe9')
+            self.assertEqual(qf.get_xml('q1'),
+                             b'<quotation id="q1"><p>para1</p></quotation>')
+            self.assertRaises(KeyError, qf.get, 'bogus')
+        self.assertTrue(os.path.exists(self.path + '.idx'))
+
+        # The sidecar index is used on the next open...
+        with QELFile.open(self.path) as qf:
+            self.assertEqual(qf.get('q1').text[0][0].as_text(), 'para1')
+
+        # ...but rebuilt if the file changes.
+        with open(self.path, 'w', encoding='iso-8859-1') as f:
+            f.write(XML.replace('q1', 'q10'))
+        with QELFile.open(self.path) as qf:
+            self.assertEqual(qf.ids(), ['q10', 'q&2', 'q3'])
+
+    def test_errors(self):
+        # The file is closed if it can't be indexed.
+        with open(self.path, 'w') as f:
+            f.write('<other/>')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            self.assertRaises(parse.ParseError, QELFile.open, self.path)
+            gc.collect()
+        self.assertEqual(caught, [])
+
+        # Quotations can't be located if comments or CDATA sections
+        # might hide their tags.
+        for hidden in ('<!-- <quotation id="c"></quotation> -->',
+                       '<![CDATA[</quotation>]]>'):
+            with open(self.path, 'w', encoding='iso-8859-1') as f:
+                f.write(XML.replace('<p>para1', '<p>' + hidden))
+            self.assertRaises(parse.ParseError, QELFile.open, self.path)
+        self.assertEqual(os.listdir(self.dir), ['quotations.xml'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 # Test suite for the Quotation class
 
+import io, pickle
 import unittest
 import re
 from qel import quotation
@@ -131,6 +132,39 @@ class QuotationTestBasic(unittest.TestCase):
         self.assertTrue(self.qt.is_matching_regex(re.compile('para')))
         self.assertFalse(self.qt.is_matching_regex(re.compile('bogus')))
 
+    def test_search_text(self):
+        em = quotation.EmphasizedText('very ')
+        self.qt.text = [[quotation.Text('a '), em, quotation.Text('long')],
+                        [quotation.Text('para2')]]
+        self.qt.author = quotation.Author()
+        self.qt.author.text = [quotation.Text('author')]
+        self.qt.note = [[quotation.Text('note')]]
+        self.assertEqual(self.qt.search_text(), 'a very long\npara2')
+        self.assertEqual(self.qt.search_text(True),
+                         'a very long\npara2\nauthor\nnote')
+
+        # Matches can span markup, but the author isn't searched by default.
+        self.assertTrue(self.qt.is_matching_regex(re.compile('a very l')))
+        self.assertFalse(self.qt.is_matching_regex(re.compile('author')))
+        self.assertTrue(self.qt.is_matching_regex(re.compile('author'), True))
+
+        # The text is cached until the quotation changes.
+        self.assertIs(self.qt.search_text(), self.qt.search_text())
+        em.children[0].text = 'short '
+        self.assertEqual(self.qt.search_text(), 'a very long\npara2')
+        self.qt.invalidate()
+        self.assertEqual(self.qt.search_text(), 'a short long\npara2')
+        self.qt.text = [[quotation.Text('new')]]
+        self.assertEqual(self.qt.search_text(), 'new')
+
+        # Compiled quotations give the same result, and the cache
+        # isn't pickled.
+        self.qt.compile()
+        self.assertEqual(self.qt.search_text(True), 'new\nauthor\nnote')
+        qt2 = pickle.loads(pickle.dumps(self.qt))
+        self.assertRaises(AttributeError, getattr, qt2, '_search_cache')
+        self.assertEqual(qt2.search_text(), 'new')
+
 
 
 class TestText(unittest.TestCase):
@@ -168,6 +202,75 @@ class TestText(unittest.TestCase):
             self.assertEqual(t.as_text(), text)
             self.assertEqual(t.as_html(), html)
 
+class RenderTest(unittest.TestCase):
+    def setUp(self):
+        qt = self.qt = quotation.Quotation()
+        em = quotation.EmphasizedText('very ')
+        em.children.append(quotation.CitedText('nested'))
+        qt.text = [[quotation.Text('Some '), em, quotation.Text(' text')]]
+        qt.author = quotation.Author()
+        qt.author.text = [quotation.Text('Author')]
+
+    def test_markup_children(self):
+        # All of a Markup instance's children are written.
+        self.assertEqual(self.qt.text[0][1].as_xml(),
+                         '<em>very <cite>nested</cite></em>')
+
+    def test_render(self):
+        for fmt in ('text', 'rst', 'wiki', 'fortune', 'html', 'xml'):
+            out = io.StringIO()
+            self.assertEqual(quotation.render(self.qt, fmt, out), None)
+            self.assertEqual(out.getvalue(),
+                             getattr(self.qt, 'as_' + fmt)())
+            self.assertEqual(quotation.render(self.qt, fmt), out.getvalue())
+
+        self.assertEqual(quotation.render(self.qt, 'text', include_date=1,
+                                          include_note=1),
+                         self.qt.as_text(1, 1))
+        self.assertEqual(quotation.render(self.qt.text[0][1], 'html'),
+                         '<em>very <cite>nested</cite></em>')
+        self.assertRaises(ValueError, quotation.render, self.qt, 'bogus')
+
+        coll = quotation.Collection()
+        coll.append(self.qt)
+        self.assertEqual(quotation.render(coll, 'xml'), coll.as_xml())
+
+class SlotsTest(unittest.TestCase):
+    def test_break(self):
+        # There's only one Break instance, even after unpickling.
+        br = quotation.Break()
+        self.assertIs(br, quotation.Break())
+        self.assertIs(pickle.loads(pickle.dumps(br)), br)
+        self.assertIs(br.lstrip(), br)
+        self.assertEqual(br.as_xml(), '<br />')
+
+    def test_slots(self):
+        for obj in (quotation.Quotation(), quotation.Collection(),
+                    quotation.Text('a'), quotation.EmphasizedText('b'),
+                    quotation.Source(), quotation.Break()):
+            self.assertFalse(hasattr(obj, '__dict__'), obj)
+        self.assertRaises(AttributeError, setattr, quotation.Text('a'),
+                          'bogus', 1)
+
+    def test_pickle(self):
+        qt = quotation.Quotation()
+        qt.id = 'q1'
+        em = quotation.EmphasizedText('very ')
+        em.children.append(quotation.CitedText('nested'))
+        qt.text = [[quotation.Text('Some '), em, quotation.Break()]]
+        coll = quotation.Collection()
+        coll.title = 'Title'
+        coll.append(qt)
+
+        coll2 = pickle.loads(pickle.dumps(coll, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(coll2.title, 'Title')
+        self.assertEqual(coll2.as_xml(), coll.as_xml())
+        self.assertIs(coll2[0].text[0][2], quotation.Break())
+        # Unpickled quotations still track changes.
+        version = coll2[0]._version
+        coll2[0].note = 'note'
+        self.assertNotEqual(coll2[0]._version, version)
+
 class CollectionTest(unittest.TestCase):
     def setUp(self):
         coll = self.coll = quotation.Collection()
@@ -195,6 +298,30 @@ class CollectionTest(unittest.TestCase):
 </quotations>
 """)
 
+    def test_write_xml(self):
+        qt = quotation.Quotation()
+        qt.text = [[quotation.Text('caf\xe9 \u20ac')]]
+        self.coll.append(qt)
+        self.coll.license = [[quotation.Text('CC0')]]
+
+        out = io.StringIO()
+        self.coll.write_xml(out)
+        self.assertEqual(out.getvalue(), self.coll.as_xml())
+        self.assertIn('<license>\n    <p>CC0</p>\n  </license>',
+                      out.getvalue())
+
+        # Binary files are written in the given encoding.
+        out = io.BytesIO()
+        self.coll.write_xml(out, 'iso-8859-1')
+        self.assertEqual(out.getvalue(),
+                         self.coll.as_xml('iso-8859-1').replace(
+                             '\u20ac', '&#8364;').encode('iso-8859-1'))
+
+        # Quotations can be supplied separately.
+        out = io.StringIO()
+        self.coll.write_xml(out, quotations=iter([qt, qt]))
+        self.assertEqual(out.getvalue().count('<quotation>'), 2)
+
 
 class QuotationToHTMLTest(unittest.TestCase):
     def setUp(self):
@@ -1,9 +1,10 @@
 
 # Test suite for qel.scripts module
 
+import contextlib, io, os, random, re, tempfile
 import unittest
 from qel import scripts
-from qel.quotation import Collection, Quotation
+from qel.quotation import Collection, Quotation, Text
 
 
 class MergeTests(unittest.TestCase):
@@ -65,5 +66,194 @@ class MergeTests(unittest.TestCase):
         self.assertEqual(qt2.id, 'q46')
 
 
+class RenderTests(unittest.TestCase):
+    def test_iter_rendered(self):
+        quotations = []
+        for i in range(50):
+            qt = Quotation()
+            qt.text = [[Text('para%i' % i)]] * (i % 3 + 1)
+            quotations.append(qt)
+
+        expected = [qt.as_text() for qt in quotations]
+        self.assertEqual(list(scripts.iter_rendered(quotations, 'as_text',
+                                                    chunksize=7)),
+                         expected)
+        self.assertEqual(list(scripts.iter_rendered(iter(quotations),
+                                                    'as_text', jobs=2,
+                                                    chunksize=7)),
+                         expected)
+
+        # Quotations longer than 'maxlength' lines are dropped.
+        self.assertEqual(list(scripts.iter_rendered(quotations, 'as_text', 2,
+                                                    jobs=2, chunksize=7)),
+                         [text for text in expected
+                          if text.count('\n') <= 2])
+
+
+class SearchTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for i in range(4):
+            coll = Collection()
+            for j in range(5):
+                qt = Quotation()
+                qt.id = 'q%i-%i' % (i, j)
+                qt.text = [[Text('match' if (i + j) % 3 else 'other')]]
+                coll.append(qt)
+            path = os.path.join(self.tempdir.name, 'f%i.xml' % i)
+            with open(path, 'w') as f:
+                f.write(coll.as_xml())
+            self.files.append(path)
+        # A file object is searched in the main process.
+        self.files[2] = io.StringIO(coll.as_xml())
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_iter_matches(self):
+        pattern = re.compile('MATCH', re.IGNORECASE)
+        serial = [(file, [qt.as_xml() for qt in matches])
+                  for file, matches in scripts.iter_matches(self.files,
+                                                            pattern)]
+        self.assertEqual(len(serial[0][1]), 3)
+        self.files[2].seek(0)
+        parallel = [(file, [qt.as_xml() for qt in matches])
+                    for file, matches in scripts.iter_matches(self.files,
+                                                              pattern,
+                                                              jobs=2)]
+        self.assertEqual(parallel, serial)
+
+    def test_count_matches(self):
+        pattern = re.compile('other')
+        expected = list(zip(self.files, [2, 1, 2, 2]))
+        self.assertEqual(list(scripts.count_matches(self.files, pattern)),
+                         expected)
+        self.files[2].seek(0)
+        self.assertEqual(list(scripts.count_matches(self.files, pattern,
+                                                    jobs=2)),
+                         expected)
+
+    def test_max_count(self):
+        pattern = re.compile('match')
+        for jobs in (1, 2):
+            self.files[2].seek(0)
+            results = [(file, [qt.id for qt in matches])
+                       for file, matches in scripts.iter_matches(
+                           self.files, pattern, jobs=jobs, max_count=2)]
+            self.assertEqual(results[0], (self.files[0], ['q0-1', 'q0-2']))
+            self.assertEqual(results[1], (self.files[1], ['q1-0', 'q1-1']))
+            self.files[2].seek(0)
+            counts = list(scripts.count_matches(self.files, pattern,
+                                                jobs=jobs, max_count=1))
+            self.assertEqual(counts, list(zip(self.files, [1, 1, 1, 1])))
+
+def reference_columns(htmls, column_size=5*1024):
+    "The original column division of write_html_dir(), for comparison"
+    current_size = 0
+    column_list = [ [] ]
+    for html in htmls:
+        column_list[-1].append(html)
+        current_size += len(html)
+        if current_size > column_size:
+            current_size = 0
+            column_list.append( [] )
+    if len(column_list[-1]) == 0:
+        del column_list[-1]
+    if (len(column_list) % 2) == 1:
+        column_list.append([])
+    return column_list
+
+TEMPLATE = """<title>{title}</title><body {last_attr}>{page_num}
+{col1}
+----
+{col2}
+</body>"""
+
+class HTMLDirTests(unittest.TestCase):
+    def test_iter_pages(self):
+        rand = random.Random(3)
+        for i in range(200):
+            htmls = ['x' * rand.randint(0, 30)
+                     for j in range(rand.randint(0, 40))]
+            columns = reference_columns(htmls, 50)
+            expected = [(columns[j], columns[j+1], j+2 == len(columns))
+                        for j in range(0, len(columns), 2)]
+            self.assertEqual(list(scripts._iter_pages(iter(htmls), 50)),
+                             expected)
+
+    def test_write_html_dir(self):
+        quotations = []
+        for i in range(300):
+            qt = Quotation()
+            qt.id = 'q%d' % i
+            qt.text = [[Text('Quotation number %d \u2014 caf\xe9 ' % i * 5)]]
+            quotations.append(qt)
+
+        with tempfile.TemporaryDirectory() as dir1, \
+             tempfile.TemporaryDirectory() as dir2, \
+             contextlib.redirect_stdout(io.StringIO()):
+            pages, written = scripts.write_html_dir(
+                dir1, iter(quotations), 'Title', template=TEMPLATE)
+            self.assertEqual(pages, written)
+            self.assertEqual(sorted(os.listdir(dir1)),
+                             sorted(['index.html'] +
+                                    ['%d.html' % i
+                                     for i in range(2, pages+1)]))
+            with open(os.path.join(dir1, '%d.html' % pages), 'rb') as f:
+                last = f.read()
+            self.assertIn(b'data-last=""', last)
+            self.assertIn(b'&#8212; caf\xe9', last)
+
+            # The same pages are written by several jobs.
+            self.assertEqual(scripts.write_html_dir(dir2, quotations, 'Title',
+                                                    jobs=2,
+                                                    template=TEMPLATE),
+                             (pages, written))
+            for fn in os.listdir(dir1):
+                with open(os.path.join(dir1, fn), 'rb') as f1, \
+                     open(os.path.join(dir2, fn), 'rb') as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+            # Unchanged pages aren't rewritten.
+            path = os.path.join(dir1, 'index.html')
+            os.utime(path, (0, 0))
+            self.assertEqual(scripts.write_html_dir(dir1, quotations,
+                                                    'Title',
+                                                    template=TEMPLATE),
+                             (pages, 0))
+            self.assertEqual(os.path.getmtime(path), 0)
+            # Changing a quotation without altering the length of its
+            # HTML only rewrites its own page.
+            text = quotations[0].text[0][0].text
+            quotations[0].text = [[Text(text.upper())]]
+            self.assertEqual(scripts.write_html_dir(dir1, quotations,
+                                                    'Title',
+                                                    template=TEMPLATE)[1],
+                             1)
+            self.assertNotEqual(os.path.getmtime(path), 0)
+
+    def test_write_if_changed(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'page.html')
+            mode = scripts._new_file_mode()
+            self.assertTrue(scripts._write_if_changed(path, b'a', mode))
+            self.assertEqual(os.stat(path).st_mode & 0o777, mode)
+            # Existing permissions are kept.
+            os.chmod(path, 0o600)
+            self.assertTrue(scripts._write_if_changed(path, b'b', mode))
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            self.assertFalse(scripts._write_if_changed(path, b'b', mode))
+
+            # Errors are reported, and no temporary files are left.
+            os.mkdir(os.path.join(dir, 'sub'))
+            self.assertRaises(OSError, scripts._write_if_changed,
+                              os.path.join(dir, 'sub'), b'a')
+            self.assertRaises(FileNotFoundError, scripts._write_if_changed,
+                              os.path.join(dir, 'missing', 'page.html'), b'a')
+            self.assertEqual(sorted(os.listdir(dir)), ['page.html', 'sub'])
+
+
+
 if __name__ == '__main__':
     unittest.main()
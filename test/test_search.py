@@ -0,0 +1,102 @@
+# Test suite for the qel.search module
+
+import os, re, tempfile
+from xml.sax import SAXParseException
+import unittest
+from qel import parse, search
+from qel.search import Prefilter
+
+PROLOG = b'<?xml version="1.0" encoding="UTF-8"?>\n<quotations>'
+
+QUOTATIONS = [
+    '<quotation id="q1"><p>The answer is <em>forty-two</em>.</p>'
+    '<author>Deep Thought</author></quotation>',
+    '<quotation id="q2"><p>AT&amp;T said &quot;don&apos;t&quot;\n'
+    '   panic</p></quotation>',
+    '<quotation id="q3"><p>The &#x17F;tar of &#75;elvin</p></quotation>',
+    '<quotation id="q4"><p>İstanbul, straße</p></quotation>',
+    '<quotation id="q5"><p>line one<br/>line two</p></quotation>',
+    '<quotation id="q6"><p>Nothing to see</p></quotation>',
+    # Whitespace at the edges of markup is dropped by the parser.
+    '<quotation id="q7"><p>It was <em>very </em>long.</p></quotation>',
+    '<quotation id="q8"><p>it\'s<em> </em>&#383;tar</p></quotation>',
+    # '>' may appear in attribute values.
+    '<quotation id="q9"><p>ab<em class="x>y">cd</em>'
+    '<em class=\'>\'>ef</em></p></quotation>',
+    '<quotation id="q10"><p>it<?pi it\'s?>em <em class=\'a\'>x</em></p>'
+    '</quotation>',
+    ]
+
+PATTERNS = ['answer', 'forty-two', 'answer is forty', 'thought', 'at&t',
+            '"don\'t"', 'said "don\'t" panic', 'star', 'kelvin',
+            'istanbul', 'STRASSE', 'straße', 'oneline', 'one line',
+            'nothing|answer', 'see$', 'xyzzy', '.', 'a.*z', 'verylong',
+            'ss', "it'sstar", 'abcd', 'abcdef', 'item']
+
+class PrefilterTest(unittest.TestCase):
+    def test_prefilter(self):
+        # The prefilter never rejects a quotation that matches.
+        for xml in QUOTATIONS:
+            xml = xml.encode('utf-8')
+            qt = parse.parse_fragment(PROLOG, xml)[0]
+            for pattern in PATTERNS:
+                pattern = re.compile(pattern, re.IGNORECASE)
+                prefilter = Prefilter(pattern)
+                for include_all in (False, True):
+                    if qt.is_matching_regex(pattern, include_all):
+                        self.assertTrue(prefilter.may_match(xml),
+                                        (pattern.pattern, xml))
+
+    def test_rejection(self):
+        def may_match(pattern, xml):
+            prefilter = Prefilter(re.compile(pattern, re.IGNORECASE))
+            return prefilter.may_match(xml.encode('utf-8'))
+        xml = QUOTATIONS[0]
+        self.assertTrue(may_match('answer', xml))
+        self.assertFalse(may_match('answer', QUOTATIONS[5]))
+        # Text inside tags isn't searched.
+        self.assertFalse(may_match('quotation', xml))
+        self.assertFalse(may_match('xyzzy|id', xml))
+        self.assertTrue(may_match('xyzzy|deep', xml))
+        # Character references are expanded.
+        self.assertTrue(may_match('kelvin', QUOTATIONS[2]))
+        self.assertFalse(may_match('kelvim', QUOTATIONS[2]))
+        # Patterns without literals, and XML with other entities,
+        # always have to be checked.
+        self.assertTrue(may_match('.', xml))
+        self.assertTrue(may_match('xyzzy', '<quotation>&nbsp;</quotation>'))
+        self.assertFalse(Prefilter(re.compile('a*')).active)
+        self.assertFalse(Prefilter(re.compile('a'), 'UTF-16').active)
+
+    def test_iter_matching(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'test.xml')
+            document = (PROLOG + '\n'.join(QUOTATIONS).encode('utf-8') +
+                        b'</quotations>\n')
+            commented = b'<!-- <quotation id="c"><p>answer</p></quotation> -->'
+            for data in (document,
+                         document.replace(b'<p>Nothing',
+                                          b'<!-- x --><p>Nothing'),
+                         document.replace(b'<quotation id="q3">',
+                                          commented + b'<quotation id="q3">'),
+                         document.replace(b'<quotations>',
+                                          b'<!-- x --><quotations>')):
+                with open(path, 'wb') as f:
+                    f.write(data)
+                coll = parse.parse(path)
+                for pattern in PATTERNS:
+                    pattern = re.compile(pattern, re.IGNORECASE)
+                    expected = [qt.id for qt in coll
+                                if qt.is_matching_regex(pattern)]
+                    self.assertEqual([qt.id for qt in
+                                      search.iter_matching(path, pattern)],
+                                     expected, pattern.pattern)
+
+            # Errors are still reported.
+            with open(path, 'wb') as f:
+                f.write(document[:-20])
+            self.assertRaises(SAXParseException, list,
+                              search.iter_matching(path, re.compile('x')))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+# Test suite for the qel.strfile module
+
+from io import BytesIO
+import struct
+import unittest
+from qel import strfile
+from qel.quotation import Quotation, Text
+
+class StrfileTest(unittest.TestCase):
+    def test_index(self):
+        texts = ['one\n%', 'two\nlines\n%', '%', 'caf\xe9\n%']
+        out = BytesIO()
+        dat = BytesIO()
+        index = strfile.write_fortunes(out, texts, dat)
+        data = out.getvalue()
+        self.assertEqual(data, b'one\n%\ntwo\nlines\n%\n%\ncaf\xc3\xa9\n%\n')
+        # The empty string is left out, as strfile does.
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.offsets, [0, 6, 18, 28])
+
+        header = struct.pack('>5I4s', 2, 3, 10, 4, 0, b'%\0\0\0')
+        self.assertEqual(dat.getvalue()[:24], header)
+        dat.seek(0)
+        header, offsets = strfile.read_index(dat)
+        self.assertEqual(header['longlen'], 10)
+        self.assertEqual(header['shortlen'], 4)
+        self.assertEqual(header['delim'], '%')
+        self.assertEqual(offsets, index.offsets)
+        self.assertEqual(data[offsets[2]:offsets[3]], b'%\ncaf\xc3\xa9\n%\n')
+
+    def test_embedded_delimiter(self):
+        # A '%' line inside a quotation separates two strings.
+        index = strfile.write_fortunes(BytesIO(), ['a\n%\nb\n%', 'c'])
+        self.assertEqual(index.offsets, [0, 4, 8, 10])
+        self.assertEqual(index.shortlen, 2)
+
+    def test_quotations(self):
+        qt = Quotation()
+        qt.text = [[Text('Text')]]
+        out = BytesIO()
+        index = strfile.write_fortunes(out, [qt.as_fortune()] * 2)
+        self.assertEqual(index.offsets, [0, 7, 14])
+        self.assertEqual(len(out.getvalue()), 14)
+
+if __name__ == "__main__":
+    unittest.main()
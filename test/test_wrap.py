@@ -0,0 +1,54 @@
+# Test suite for the qel.wrap module
+
+import random, re, textwrap
+import unittest
+from qel import wrap
+
+def reference_wrap(text, width, initial_indent='', subsequent_indent='',
+                   split_hyphens=True):
+    "Wrap 'text' using the textwrap module, for comparison"
+    wrapper = textwrap.TextWrapper(width, initial_indent=initial_indent,
+                                   subsequent_indent=subsequent_indent)
+    if not split_hyphens:
+        wrapper.wordsep_re = re.compile(r'(\s+)')
+    return wrapper.wrap(text)
+
+class WrapTest(unittest.TestCase):
+    def test_wrap(self):
+        text = 'The quick brown fox jumps over the well-known lazy dog.'
+        self.assertEqual(wrap.wrap(text, 20),
+                         ['The quick brown fox', 'jumps over the well-',
+                          'known lazy dog.'])
+        self.assertEqual(wrap.wrap(text, 20, split_hyphens=False),
+                         ['The quick brown fox', 'jumps over the',
+                          'well-known lazy dog.'])
+        self.assertEqual(wrap.wrap('  \t\n ', 10), [])
+        self.assertEqual(wrap.wrap('  a\tb\nc  ', 10), ['  a     b', 'c'])
+        self.assertEqual(wrap.wrap('abcdefghij', 4, '> ', '>> '),
+                         ['> ab', '>> c', '>> d', '>> e', '>> f', '>> g',
+                          '>> h', '>> i', '>> j'])
+        self.assertRaises(ValueError, wrap.wrap, 'text', 0)
+
+    def test_compare(self):
+        "Compare wrap() with the textwrap module on random text"
+        rand = random.Random(42)
+        pieces = ['a', 'word', 'extraordinarily', 'x' * 30, '-', '--',
+                  'well-known', 'a-b-c-', ' ', ' ', '  ', '\t', '\n',
+                  '\r', '\xa0', ' ', '.', '\xe9t\xe9']
+        for i in range(3000):
+            text = ''.join(rand.choice(pieces)
+                           for j in range(rand.randint(0, 40)))
+            width = rand.randint(1, 40)
+            # textwrap doesn't always finish if an indent is too wide.
+            initial = ' ' * rand.randint(0, width - 1)
+            subsequent = ' ' * rand.randint(0, width - 1)
+            split_hyphens = rand.random() < 0.5
+            args = (text, width, initial, subsequent, split_hyphens)
+            self.assertEqual(wrap.wrap(*args), reference_wrap(*args),
+                             repr(args))
+
+        # Too-wide indents are handled.
+        self.assertEqual(wrap.wrap('  abc', 2, '   '), ['   a', 'bc'])
+
+if __name__ == "__main__":
+    unittest.main()